@@ -1,3 +1,3 @@
-from actiontracker.actiontracker import ActionTracker
+from actiontracker.actiontracker import ActionTracker, PacketTracker
 
-__all__ = ['ActionTracker']
\ No newline at end of file
+__all__ = ['ActionTracker', 'PacketTracker']
\ No newline at end of file
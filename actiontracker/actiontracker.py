@@ -1,119 +1,287 @@
 from psc.psccommon.psc_common import *
+from psc.postgresql import exceptions
 
 
 class ActionTracker:
+    # incremental migrations of tracker tables: (version, query), "{0}" is replaced by "schema_location"
+    # migrations are never changed after release and never drop the existing history
+    migrations = [
+        (1, """
+            CREATE SCHEMA IF NOT EXISTS {0};
+
+            CREATE TABLE IF NOT EXISTS {0}.dbc_packets
+            (
+                id serial,
+                name character varying(128) not null,
+                status character varying(10) default 'started',
+                dt timestamp with time zone default now(),
+                packet_hash character varying(32) not null,
+                meta_data jsonb not null,
+                CONSTRAINT dbc_packets_pkey PRIMARY KEY (id),
+                CONSTRAINT packet_status CHECK (status in ('done', 'started', 'exception'))
+            );
+
+            CREATE TABLE IF NOT EXISTS {0}.dbc_steps
+            (
+                id serial,
+                name character varying(128) not null,
+                packet_id integer,
+                status character varying(10) default 'started',
+                dt timestamp with time zone default now(),
+                exception_descr text,
+                CONSTRAINT dbc_steps_pkey PRIMARY KEY (id),
+                CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
+                    REFERENCES {0}.dbc_packets (id),
+                CONSTRAINT step_status CHECK (status in ('done', 'started', 'exception'))
+            );
+
+            CREATE TABLE IF NOT EXISTS {0}.dbc_actions
+            (
+                dt timestamp with time zone default now(),
+                packet_id integer,
+                step_id integer,
+                step_hash character varying(32) not null,
+                CONSTRAINT dbc_actions_uniq UNIQUE (packet_id, step_id, step_hash),
+                CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
+                    REFERENCES {0}.dbc_packets (id),
+                CONSTRAINT fk_dbc_steps_id FOREIGN KEY (step_id)
+                    REFERENCES {0}.dbc_steps (id)
+            );
+
+            CREATE TABLE IF NOT EXISTS {0}.dbc_locks
+            (
+                id serial,
+                name character varying(128) not null,
+                locked boolean not null default true,
+                dt timestamp with time zone default now(),
+                CONSTRAINT dbc_locks_pkey PRIMARY KEY (id)
+            );
+
+            CREATE INDEX IF NOT EXISTS dbc_actions_dt_idx
+                ON {0}.dbc_actions USING btree (dt);
+            CREATE INDEX IF NOT EXISTS dbc_actions_step_hash_idx
+                ON {0}.dbc_actions USING btree (step_hash);
+            CREATE INDEX IF NOT EXISTS dbc_packets_meta_data_idx
+                ON {0}.dbc_packets USING GIN (meta_data);
+            CREATE UNIQUE INDEX IF NOT EXISTS dbc_packets_name_idx
+                ON {0}.dbc_packets USING btree (name);
+            CREATE UNIQUE INDEX IF NOT EXISTS dbc_locks_name_idx
+                ON {0}.dbc_locks USING btree (name);
+        """),
+        (2, """
+            -- chunked steps
+            ALTER TABLE {0}.dbc_actions ADD COLUMN IF NOT EXISTS chunk_end bigint;
+        """),
+        (3, """
+            -- bigint keys, "dbc_actions" is partitioned by packet: one partition per packet,
+            -- declarative partitioning is used since PostgreSQL 11, older servers keep the plain table
+            DO $$
+            declare
+                rec record;
+            begin
+                IF EXISTS(
+                    SELECT 1
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relname = 'dbc_actions' AND n.nspname = '{0}' AND c.relkind = 'p'
+                ) THEN
+                    RETURN;
+                END IF;
+
+                ALTER TABLE {0}.dbc_packets ALTER COLUMN id TYPE bigint;
+                ALTER TABLE {0}.dbc_steps ALTER COLUMN id TYPE bigint, ALTER COLUMN packet_id TYPE bigint;
+                IF current_setting('server_version_num')::integer >= 100000 THEN
+                    -- sequences are bigint before PostgreSQL 10
+                    EXECUTE 'ALTER SEQUENCE {0}.dbc_packets_id_seq AS bigint';
+                    EXECUTE 'ALTER SEQUENCE {0}.dbc_steps_id_seq AS bigint';
+                END IF;
+
+                IF current_setting('server_version_num')::integer < 110000 THEN
+                    ALTER TABLE {0}.dbc_actions ALTER COLUMN packet_id TYPE bigint, ALTER COLUMN step_id TYPE bigint;
+                    RETURN;
+                END IF;
+
+                ALTER TABLE {0}.dbc_actions RENAME TO dbc_actions_v2;
+                ALTER TABLE {0}.dbc_actions_v2 DROP CONSTRAINT dbc_actions_uniq;
+                DROP INDEX {0}.dbc_actions_dt_idx;
+                DROP INDEX {0}.dbc_actions_step_hash_idx;
+
+                EXECUTE '
+                    CREATE TABLE {0}.dbc_actions
+                    (
+                        dt timestamp with time zone default now(),
+                        packet_id bigint not null,
+                        step_id bigint not null,
+                        step_hash character varying(32) not null,
+                        chunk_end bigint,
+                        CONSTRAINT dbc_actions_uniq UNIQUE (packet_id, step_id, step_hash),
+                        CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
+                            REFERENCES {0}.dbc_packets (id),
+                        CONSTRAINT fk_dbc_steps_id FOREIGN KEY (step_id)
+                            REFERENCES {0}.dbc_steps (id)
+                    ) PARTITION BY LIST (packet_id)
+                ';
+                CREATE INDEX dbc_actions_dt_idx
+                    ON {0}.dbc_actions USING btree (dt);
+
+                FOR rec IN SELECT id FROM {0}.dbc_packets LOOP
+                    EXECUTE format(
+                        'CREATE TABLE {0}.dbc_actions_%s PARTITION OF {0}.dbc_actions FOR VALUES IN (%s)',
+                        rec.id, rec.id
+                    );
+                END LOOP;
+
+                INSERT INTO {0}.dbc_actions(dt, packet_id, step_id, step_hash, chunk_end)
+                SELECT dt, packet_id, step_id, step_hash, chunk_end
+                FROM {0}.dbc_actions_v2
+                WHERE packet_id IS NOT NULL AND step_id IS NOT NULL;
+                DROP TABLE {0}.dbc_actions_v2;
+            end$$;
+        """),
+        (4, """
+            -- telemetry of actions, partitioned by packet as "dbc_actions"
+            DO $$
+            declare
+                rec record;
+                partitioned boolean = current_setting('server_version_num')::integer >= 110000;
+            begin
+                EXECUTE '
+                    CREATE TABLE IF NOT EXISTS {0}.dbc_action_stats
+                    (
+                        packet_id bigint not null,
+                        step_id bigint not null,
+                        step_hash character varying(32) not null,
+                        started timestamp with time zone,
+                        duration double precision,      -- seconds
+                        row_count bigint,               -- rows of command tags of the action
+                        retry_count integer not null default 0,
+                        UNIQUE (packet_id, step_id, step_hash),
+                        CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
+                            REFERENCES {0}.dbc_packets (id),
+                        CONSTRAINT fk_dbc_steps_id FOREIGN KEY (step_id)
+                            REFERENCES {0}.dbc_steps (id)
+                    )
+                ' || CASE WHEN partitioned THEN ' PARTITION BY LIST (packet_id)' ELSE '' END;
+
+                IF partitioned THEN
+                    FOR rec IN SELECT id FROM {0}.dbc_packets LOOP
+                        EXECUTE format(
+                            'CREATE TABLE IF NOT EXISTS {0}.dbc_action_stats_%s PARTITION OF {0}.dbc_action_stats FOR VALUES IN (%s)',
+                            rec.id, rec.id
+                        );
+                    END LOOP;
+                END IF;
+            end$$;
+        """),
+        (5, """
+            -- progress of packet: number of actions to execute
+            ALTER TABLE {0}.dbc_packets ADD COLUMN IF NOT EXISTS actions_total bigint;
+        """),
+        (6, """
+            -- lock waits and cancellations of the lock observer, partitioned by packet as "dbc_actions"
+            DO $$
+            declare
+                rec record;
+                partitioned boolean = current_setting('server_version_num')::integer >= 110000;
+            begin
+                EXECUTE '
+                    CREATE TABLE IF NOT EXISTS {0}.dbc_lock_events
+                    (
+                        id bigserial,
+                        packet_id bigint not null,
+                        dt timestamp with time zone,    -- the wait was observed first time
+                        step_id bigint,                 -- running action of observed pid
+                        step_hash character varying(32),
+                        pid integer not null,           -- observed pid
+                        reason character varying(16) not null,  -- "blocker" or "wait"
+                        cancelled boolean not null default false,
+                        blocked_pid integer,
+                        blocking_pid integer,
+                        blocked_query text,
+                        blocking_query text,
+                        relation text,                  -- relation or type of the awaited lock
+                        wait_duration double precision, -- seconds since the start of the blocked query
+                        PRIMARY KEY (packet_id, id),
+                        CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
+                            REFERENCES {0}.dbc_packets (id),
+                        CONSTRAINT fk_dbc_steps_id FOREIGN KEY (step_id)
+                            REFERENCES {0}.dbc_steps (id)
+                    )
+                ' || CASE WHEN partitioned THEN ' PARTITION BY LIST (packet_id)' ELSE '' END;
+
+                IF partitioned THEN
+                    FOR rec IN SELECT id FROM {0}.dbc_packets LOOP
+                        EXECUTE format(
+                            'CREATE TABLE IF NOT EXISTS {0}.dbc_lock_events_%s PARTITION OF {0}.dbc_lock_events FOR VALUES IN (%s)',
+                            rec.id, rec.id
+                        );
+                    END LOOP;
+                END IF;
+            end$$;
+        """)
+    ]
+    # tables partitioned by packet
+    packet_tables = ('dbc_actions', 'dbc_action_stats', 'dbc_lock_events')
+    schema_version = migrations[-1][0]
+    verified_dbs = set()    # databases with up-to-date tracker tables, checked once per process
+    partitioned_dbs = {}    # key is database, value is True if tables of packet are partitioned (PostgreSQL 11+)
+
+    @staticmethod
+    def get_db_key(db_conn, schema_location):
+        connector = db_conn.connector
+        return "%s:%s/%s/%s" % (
+            getattr(connector, 'host', None), getattr(connector, 'port', None),
+            getattr(connector, 'database', None), schema_location
+        )
 
     @staticmethod
     def cleanup(db_conn, schema_location):
+        ActionTracker.verified_dbs.discard(ActionTracker.get_db_key(db_conn, schema_location))
+        ActionTracker.partitioned_dbs.pop(ActionTracker.get_db_key(db_conn, schema_location), None)
         db_conn.execute("""
             DROP TABLE IF EXISTS {0}.dbc_packets CASCADE;
             DROP TABLE IF EXISTS {0}.dbc_steps CASCADE;
             DROP TABLE IF EXISTS {0}.dbc_actions CASCADE;
+            DROP TABLE IF EXISTS {0}.dbc_action_stats CASCADE;
+            DROP TABLE IF EXISTS {0}.dbc_lock_events CASCADE;
             DROP TABLE IF EXISTS {0}.dbc_locks CASCADE;
+            DROP TABLE IF EXISTS {0}.dbc_schema_version CASCADE;
         """.format(schema_location)
         )
 
     @staticmethod
-    def init_tbls(db_conn, schema_location):
-        db_conn.execute("""
-        DO $$
-            begin
-            IF (
-                 SELECT count(1)
-                 FROM   pg_class c
-                 JOIN   pg_namespace n ON n.oid = c.relnamespace
-                 WHERE  c.relname in ('dbc_packets', 'dbc_steps', 'dbc_actions', 'dbc_locks')
-                    AND c.relkind = 'r'
-                    AND n.nspname = '{0}'
-            ) != 4
-            THEN
-                SET search_path = '{0}';
-                CREATE SCHEMA IF NOT EXISTS {0};
-
-                DROP TABLE IF EXISTS dbc_packets CASCADE;
-                DROP TABLE IF EXISTS dbc_steps CASCADE;
-                DROP TABLE IF EXISTS dbc_actions CASCADE;
-                DROP TABLE IF EXISTS dbc_locks CASCADE;
-    
-                CREATE TABLE dbc_packets
-                (
-                    id serial,
-                    name character varying(128) not null,
-                    status character varying(10) default 'started',
-                    dt timestamp with time zone default now(),
-                    packet_hash character varying(32) not null,
-                    meta_data jsonb not null,
-                    CONSTRAINT dbc_packets_pkey PRIMARY KEY (id),
-                    CONSTRAINT packet_status CHECK (status in ('done', 'started', 'exception'))
-                );
-    
-                CREATE TABLE dbc_steps
-                (
-                    id serial,
-                    name character varying(128) not null,
-                    packet_id integer,
-                    status character varying(10) default 'started',
-                    dt timestamp with time zone default now(),
-                    exception_descr text,
-                    CONSTRAINT dbc_steps_pkey PRIMARY KEY (id),
-                    CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
-                        REFERENCES dbc_packets (id),
-                    CONSTRAINT step_status CHECK (status in ('done', 'started', 'exception'))
-                );
-    
-                CREATE TABLE dbc_actions
-                (
-                    dt timestamp with time zone default now(),
-                    packet_id integer,
-                    step_id integer,
-                    step_hash character varying(32) not null,
-                    CONSTRAINT dbc_actions_uniq UNIQUE (packet_id, step_id, step_hash),
-                    CONSTRAINT fk_dbc_packets_id FOREIGN KEY (packet_id)
-                        REFERENCES dbc_packets (id),
-                    CONSTRAINT fk_dbc_steps_id FOREIGN KEY (step_id)
-                        REFERENCES dbc_steps (id)
-                );
-                
-                CREATE TABLE dbc_locks
-                (
-                    id serial,
-                    name character varying(128) not null,
-                    locked boolean not null default true,
-                    dt timestamp with time zone default now(),
-                    CONSTRAINT dbc_locks_pkey PRIMARY KEY (id)
-                );
-    
-                CREATE INDEX dbc_actions_dt_idx
-                    ON dbc_actions USING btree (dt);
-                CREATE INDEX dbc_actions_step_hash_idx
-                    ON dbc_actions USING btree (step_hash);
-                CREATE INDEX dbc_packets_meta_data_idx
-                    ON dbc_packets USING GIN (meta_data);
-                CREATE UNIQUE INDEX dbc_packets_name_idx
-                    ON dbc_packets USING btree (name);
-                CREATE UNIQUE INDEX dbc_locks_name_idx
-                    ON dbc_locks USING btree (name);
-            END IF;
-            end$$;
-        """.format(schema_location)
-        )
+    def get_schema_version(db_conn, schema_location):
+        try:
+            return get_scalar(db_conn, "SELECT max(version) FROM %s.dbc_schema_version" % schema_location) or 0
+        except exceptions.UndefinedTableError:
+            return 0
 
     @staticmethod
-    def is_action_exists(db_conn, schema_location, packet, step, step_hash):
-        return get_scalar(
-            db_conn,
-            """
-                SELECT EXISTS(
-                    SELECT 1
-                    FROM %s.dbc_actions a
-                    INNER JOIN %s.dbc_packets p ON a.packet_id = p.id
-                    INNER JOIN %s.dbc_steps s ON a.step_id = s.id
-                    WHERE p.name = '%s'
-                      AND s.name = '%s'
-                      AND a.step_hash = '%s'
-                )
-            """ % (schema_location, schema_location, schema_location, packet, step, step_hash)
-        )
+    def init_tbls(db_conn, schema_location):
+        db_key = ActionTracker.get_db_key(db_conn, schema_location)
+        if db_key in ActionTracker.verified_dbs:
+            return
+        if ActionTracker.get_schema_version(db_conn, schema_location) < ActionTracker.schema_version:
+            with db_conn.xact():
+                # concurrent runs on the same database wait for the first one
+                db_conn.execute("SELECT pg_advisory_xact_lock(hashtext('%s.dbc_schema_version'))" % schema_location)
+                db_conn.execute("""
+                    CREATE SCHEMA IF NOT EXISTS {0};
+                    CREATE TABLE IF NOT EXISTS {0}.dbc_schema_version
+                    (
+                        version integer not null,
+                        dt timestamp with time zone default now(),
+                        CONSTRAINT dbc_schema_version_pkey PRIMARY KEY (version)
+                    );
+                """.format(schema_location))
+                current_version = ActionTracker.get_schema_version(db_conn, schema_location)
+                for version, query in ActionTracker.migrations:
+                    if version > current_version:
+                        db_conn.execute(query.format(schema_location))
+                        db_conn.execute(
+                            "INSERT INTO %s.dbc_schema_version(version) VALUES (%d)" % (schema_location, version)
+                        )
+        ActionTracker.verified_dbs.add(db_key)
 
     @staticmethod
     def is_packet_locked(db_conn, schema_location, packet):
@@ -163,173 +331,167 @@ class ActionTracker:
             """ % (schema_location, packet)
         )
 
+    # tables of packet are partitioned by packet on PostgreSQL 11+, older servers have plain tables
     @staticmethod
-    def begin_action(db_conn, schema_location, packet_name, packet_hash, step_name, meta_data):
-        # "action" will be inserted into "dbc_actions" only in case of successful execution,
-        # but before execution of "action", it is necessary to set status of "step" = "started"
-        db_conn.execute("""
-        DO $$
-            declare
-                packet_name text = '%s';
-                step_name text = '%s';
-                packet_id_v integer = NULL;
-                step_id_v integer = NULL;
-            begin
-                SET search_path = '%s';
-                SELECT id into packet_id_v
-                FROM   dbc_packets
-                WHERE  name = packet_name;
-    
-                IF packet_id_v IS NULL THEN
-                    INSERT INTO dbc_packets(name, status, packet_hash, meta_data)
-                       VALUES (packet_name, 'started', '%s', '%s') RETURNING id INTO packet_id_v;
-                END IF;
-    
-                SELECT id into step_id_v
-                FROM   dbc_steps
-                WHERE  name = step_name and packet_id = packet_id_v;
-    
-                IF step_id_v IS NULL THEN
-                    INSERT INTO dbc_steps(name, packet_id, status)
-                       VALUES (step_name, packet_id_v, 'started');
-                END IF;
-            end$$;
-        """ % (packet_name, step_name, schema_location, packet_hash, meta_data)
-        )
+    def is_partitioned(db_conn, schema_location):
+        db_key = ActionTracker.get_db_key(db_conn, schema_location)
+        if db_key not in ActionTracker.partitioned_dbs:
+            ActionTracker.partitioned_dbs[db_key] = get_scalar(
+                db_conn,
+                """
+                    SELECT EXISTS(
+                        SELECT 1
+                        FROM pg_class c
+                        JOIN pg_namespace n ON n.oid = c.relnamespace
+                        WHERE c.relname = 'dbc_actions' AND n.nspname = '%s' AND c.relkind = 'p'
+                    )
+                """ % schema_location
+            )
+        return ActionTracker.partitioned_dbs[db_key]
 
     @staticmethod
-    def apply_action(db_conn, schema_location, packet_name, step_name, step_hash):
-        db_conn.execute("""
-        DO $$
-            declare
-                packet_name text = '%s';
-                step_name text = '%s';
-                packet_id_v integer = NULL;
-                step_id_v integer = NULL;
-            begin
-                SET search_path = '%s';
-                SELECT id into packet_id_v  -- id already exist
-                FROM   dbc_packets
-                WHERE  name = packet_name;
-    
-                SELECT id into step_id_v    -- id already exist
-                FROM   dbc_steps
-                WHERE  name = step_name and packet_id = packet_id_v;
-    
-                INSERT INTO dbc_actions(packet_id, step_id, step_hash)
-                        VALUES (packet_id_v, step_id_v, '%s');
-            end$$;
-        """ % (packet_name, step_name, schema_location, step_hash)
-        )
+    def get_partition(schema_location, packet_id, table='dbc_actions'):
+        return "%s.%s_%d" % (schema_location, table, packet_id)
 
     @staticmethod
-    def insert_step(db_conn, schema_location, packet, step):
-        db_conn.execute("""
-        DO $$
-            declare
-                packet_name text = '%s';
-                step_name text = '%s';
-                packet_id_v integer = NULL;
-                step_id_v integer = NULL;
-            begin
-                SET search_path = '%s';
-                SELECT id into packet_id_v
-                FROM   dbc_packets
-                WHERE  name = packet_name;
-    
-                IF packet_id_v IS NULL THEN
-                    INSERT INTO dbc_packets(name, status)
-                       VALUES (packet_name, 'started') RETURNING id INTO packet_id_v;
-                END IF;
-    
-                SELECT id into step_id_v
-                FROM   dbc_steps
-                WHERE  name = step_name and packet_id = packet_id_v;
-    
-                IF step_id_v IS NULL THEN
-                    INSERT INTO dbc_steps(name, packet_id, status)
-                       VALUES (step_name, packet_id_v, 'started');
-                END IF;
-            end$$;
-        """ % (packet, step, schema_location)
-        )
+    def drop_partitions(db_conn, schema_location, packet_id):
+        partitioned = ActionTracker.is_partitioned(db_conn, schema_location)
+        for table in ActionTracker.packet_tables:
+            if partitioned:
+                db_conn.execute(
+                    "DROP TABLE IF EXISTS %s" % ActionTracker.get_partition(schema_location, packet_id, table)
+                )
+            else:
+                db_conn.execute("DELETE FROM %s.%s WHERE packet_id = %d" % (schema_location, table, packet_id))
 
     @staticmethod
     def wipe_packet(db_conn, schema_location, packet):
-        is_data_exists = get_scalar(
-            db_conn,
-            """
-                SELECT EXISTS(
-                    SELECT 1
-                    FROM %s.dbc_packets p
-                    WHERE p.name = '%s'
-                )
-            """ % (schema_location, packet)
-        )
-        db_conn.execute("""
-            SET search_path = '%s';
-
-            DELETE FROM dbc_actions
-            WHERE (packet_id, step_id) IN
+        packet_ids = [
+            rec[0] for rec in get_resultset(
+                db_conn, "SELECT id FROM %s.dbc_packets WHERE name = '%s'" % (schema_location, packet)
+            )
+        ]
+        with db_conn.xact():
+            # actions of packet are removed by dropping of the partition instead of DELETE (PostgreSQL 11+)
+            for packet_id in packet_ids:
+                ActionTracker.drop_partitions(db_conn, schema_location, packet_id)
+            db_conn.execute("""
+                DELETE FROM {0}.dbc_steps WHERE packet_id IN
                 (
-                    SELECT
-                        a.packet_id,
-                        a.step_id
-                    FROM dbc_actions a
-                    JOIN dbc_steps s ON a.packet_id = s.packet_id
-                    JOIN dbc_packets p ON p.id = s.packet_id
-                    WHERE p.name = '%s'
-                 );
-    
-            DELETE FROM dbc_steps WHERE packet_id IN
-            (
-                SELECT p.id
-                FROM dbc_packets p
-                WHERE p.name = '%s'
-            );
-    
-            DELETE FROM dbc_packets WHERE name = '%s';
-        """ % (schema_location, packet, packet, packet)
-        )
-        return is_data_exists
+                    SELECT p.id
+                    FROM {0}.dbc_packets p
+                    WHERE p.name = '{1}'
+                );
+
+                DELETE FROM {0}.dbc_packets WHERE name = '{1}';
+            """.format(schema_location, packet)
+            )
+        return len(packet_ids) > 0
 
     @staticmethod
-    def set_step_status(db_conn, schema_location, packet_name, step, result):
-        db_conn.execute("""
-            SET search_path = '%s';
-
-            UPDATE dbc_steps
-            SET status = '%s', exception_descr = null
-            WHERE id = (
-                SELECT s.id from dbc_packets p
-                JOIN dbc_steps s on p.id = s.packet_id
-                WHERE p.name = '%s' AND s.name = '%s'
+    def drop_expired_actions(db_conn, schema_location, packet, retention_days):
+        # actions and their telemetry of the finished packet are dropped
+        # if the last step of packet is older than "retention_days",
+        # packet and steps are kept: the packet is still reported as deployed
+        has_actions = "to_regclass('{0}.dbc_actions_' || p.id) IS NOT NULL" \
+            if ActionTracker.is_partitioned(db_conn, schema_location) else \
+            "EXISTS(SELECT 1 FROM {0}.dbc_actions a WHERE a.packet_id = p.id)"
+        packet_ids = [
+            rec[0] for rec in get_resultset(
+                db_conn,
+                """
+                    SELECT p.id
+                    FROM {0}.dbc_packets p
+                    WHERE p.name = '{1}'
+                      AND p.status = 'done'
+                      AND coalesce(
+                          (SELECT max(s.dt) FROM {0}.dbc_steps s WHERE s.packet_id = p.id),
+                          p.dt
+                      ) < now() - interval '{2} days'
+                      AND %s
+                """.replace('%s', has_actions).format(schema_location, packet, int(retention_days))
             )
-        """ % (schema_location, result, packet_name, step)
-        )
+        ]
+        for packet_id in packet_ids:
+            with db_conn.xact():
+                ActionTracker.drop_partitions(db_conn, schema_location, packet_id)
+        return len(packet_ids) > 0
 
     @staticmethod
-    def set_step_exception_status(db_conn, schema_location, packet_name, step, exception_descr):
-        ActionTracker.insert_step(db_conn, schema_location, packet_name, step)
-        pquery = db_conn.prepare("""
-            UPDATE {0}.dbc_steps
-            SET status = 'exception', exception_descr = $1
-            WHERE id = (
-                SELECT s.id from {0}.dbc_packets p
-                JOIN {0}.dbc_steps s on p.id = s.packet_id
-                WHERE p.name = $2 AND s.name = $3
-            )""".format(schema_location)
+    def get_report(db_conn, schema_location, packet_name):
+        # throughput and percentiles of duration of actions for each step of packet
+        return get_resultset(
+            db_conn,
+            """
+                SELECT
+                    step,
+                    actions,
+                    retries,
+                    rows,
+                    round(duration::numeric, 3) AS duration,
+                    round((actions / nullif(wall_time, 0))::numeric, 2) AS actions_per_sec,
+                    round((rows / nullif(wall_time, 0))::numeric, 2) AS rows_per_sec,
+                    round(p50::numeric, 3) AS p50,
+                    round(p90::numeric, 3) AS p90,
+                    round(p99::numeric, 3) AS p99,
+                    round(max::numeric, 3) AS max
+                FROM (
+                    SELECT
+                        s.name AS step,
+                        count(1) AS actions,
+                        sum(a.retry_count) AS retries,
+                        sum(a.row_count) AS rows,
+                        sum(a.duration) AS duration,
+                        -- time from the start of the first action to the end of the last action of step
+                        extract(epoch FROM
+                            max(a.started + a.duration * interval '1 second') - min(a.started)
+                        ) AS wall_time,
+                        percentile_cont(0.5) WITHIN GROUP (ORDER BY a.duration) AS p50,
+                        percentile_cont(0.9) WITHIN GROUP (ORDER BY a.duration) AS p90,
+                        percentile_cont(0.99) WITHIN GROUP (ORDER BY a.duration) AS p99,
+                        max(a.duration) AS max
+                    FROM {0}.dbc_action_stats a
+                    JOIN {0}.dbc_packets p ON p.id = a.packet_id
+                    JOIN {0}.dbc_steps s ON s.id = a.step_id
+                    WHERE p.name = '{1}'
+                    GROUP BY s.name
+                ) t
+                ORDER BY step
+            """.format(schema_location, packet_name)
         )
-        with db_conn.xact(): pquery(exception_descr, packet_name, step)
 
     @staticmethod
-    def set_packet_status(db_conn, schema_location, packet_name, result):
-        db_conn.execute("""
-                UPDATE %s.dbc_packets
-                SET status = '%s'
-                WHERE name = '%s'
-            """ % (schema_location, result, packet_name)
+    def get_progress(db_conn, schema_location, packet_name, window=60):
+        # actions of chunked steps are not counted, throughput is the average over the last "window" seconds
+        res = get_resultset(
+            db_conn,
+            """
+                SELECT
+                    p.actions_total,
+                    count(a.step_hash) FILTER (WHERE a.chunk_end IS NULL) AS done,
+                    count(a.step_hash) FILTER (
+                        WHERE a.chunk_end IS NULL AND a.dt > now() - interval '{2} seconds'
+                    ) AS done_in_window
+                FROM {0}.dbc_packets p
+                LEFT JOIN {0}.dbc_actions a ON a.packet_id = p.id
+                WHERE p.name = '{1}'
+                GROUP BY p.actions_total
+            """.format(schema_location, packet_name, int(window))
+        )
+        if len(res) == 0 or res[0][0] is None:
+            return None
+        progress = {
+            "total": res[0][0],
+            "done": min(res[0][1], res[0][0]),
+            "actions_per_sec": float(res[0][2]) / window
+        }
+        progress["percent"] = round(float(progress["done"]) * 100 / progress["total"], 2) \
+            if progress["total"] > 0 else 100.0
+        remaining = progress["total"] - progress["done"]
+        progress["eta"] = 0 if remaining == 0 else (
+            remaining / progress["actions_per_sec"] if progress["actions_per_sec"] > 0 else None
         )
+        return progress
 
     @staticmethod
     def get_packet_status(db_conn, schema_location, packet_name):
@@ -349,3 +511,209 @@ class ActionTracker:
             res_status["hash"] = rec[3]
 
         return res_status
+
+
+class PacketTracker:
+    """
+    Tracker of one packet bound to the session of worker.
+    Ids of packet and steps are resolved once and cached, tracker writes are executed
+    by server-side prepared statements with bind parameters: each write is one execution of the cached plan.
+    """
+    queries = {
+        "get_packet_id": """
+            SELECT id FROM {0}.dbc_packets WHERE name = $1
+        """,
+        "insert_packet": """
+            INSERT INTO {0}.dbc_packets(name, status, packet_hash, meta_data, actions_total)
+            VALUES ($1, 'started', $2, $3::text::jsonb, $4)
+            ON CONFLICT (name) DO NOTHING
+            RETURNING id
+        """,
+        "get_step_id": """
+            SELECT id FROM {0}.dbc_steps WHERE packet_id = $1 AND name = $2
+        """,
+        "insert_step": """
+            INSERT INTO {0}.dbc_steps(name, packet_id, status)
+            VALUES ($1, $2, 'started')
+            RETURNING id
+        """,
+        "apply_action": """
+            INSERT INTO {0}.dbc_actions(packet_id, step_id, step_hash, chunk_end)
+            VALUES ($1, $2, $3, $4)
+        """,
+        "get_action_hashes": """
+            SELECT step_hash FROM {0}.dbc_actions WHERE packet_id = $1 AND step_id = $2
+        """,
+        "get_chunk_end": """
+            SELECT max(chunk_end) FROM {0}.dbc_actions WHERE packet_id = $1 AND step_id = $2
+        """,
+        "set_step_status": """
+            UPDATE {0}.dbc_steps SET status = $2, exception_descr = $3 WHERE id = $1
+        """,
+        "set_packet_status": """
+            UPDATE {0}.dbc_packets SET status = $2 WHERE id = $1
+        """,
+        "set_actions_total": """
+            UPDATE {0}.dbc_packets SET actions_total = $2 WHERE id = $1
+        """,
+        "get_done_actions_count": """
+            SELECT count(1) FROM {0}.dbc_actions WHERE packet_id = $1 AND chunk_end IS NULL
+        """,
+        "insert_action_stats": """
+            INSERT INTO {0}.dbc_action_stats(
+                packet_id, step_id, step_hash, started, duration, row_count, retry_count
+            )
+            SELECT $1, step_id, step_hash, to_timestamp(started), duration, row_count, retry_count
+            FROM unnest($2::bigint[], $3::text[], $4::float8[], $5::float8[], $6::bigint[], $7::integer[])
+                AS s(step_id, step_hash, started, duration, row_count, retry_count)
+            ON CONFLICT (packet_id, step_id, step_hash) DO NOTHING
+        """,
+        "insert_lock_events": """
+            INSERT INTO {0}.dbc_lock_events(
+                packet_id, dt, step_id, step_hash, pid, reason, cancelled, blocked_pid, blocking_pid,
+                blocked_query, blocking_query, relation, wait_duration
+            )
+            SELECT
+                $1, to_timestamp(dt), step_id, step_hash, pid, reason, cancelled, blocked_pid, blocking_pid,
+                blocked_query, blocking_query, relation, wait_duration
+            FROM unnest(
+                $2::float8[], $3::bigint[], $4::text[], $5::integer[], $6::text[], $7::boolean[], $8::integer[],
+                $9::integer[], $10::text[], $11::text[], $12::text[], $13::float8[]
+            ) AS e(
+                dt, step_id, step_hash, pid, reason, cancelled, blocked_pid, blocking_pid,
+                blocked_query, blocking_query, relation, wait_duration
+            )
+        """
+    }
+    stats_batch_size = 100      # telemetry of actions is written by one statement for this number of actions
+
+    def __init__(self, db_conn, schema_location, packet_name, packet_hash, meta_data):
+        self.db_conn = db_conn
+        self.schema_location = schema_location
+        self.packet_name = packet_name
+        self.packet_hash = packet_hash
+        self.meta_data = meta_data
+        self.packet_id = None
+        self.step_ids = {}      # key is step name, value is "dbc_steps.id"
+        self.statements = {}    # key is name of query, value is prepared statement
+        self.stats = []         # telemetry of finished actions not yet written to "dbc_action_stats"
+        self.actions_total = None
+
+    def execute(self, name, *args):
+        if name not in self.statements:
+            self.statements[name] = self.db_conn.prepare(self.queries[name].format(self.schema_location))
+        return self.statements[name](*args)
+
+    def first(self, name, *args):
+        res = self.execute(name, *args)
+        return None if len(res) == 0 else res[0][0]
+
+    def get_packet_id(self, register=True):
+        # packet is registered on first call
+        if self.packet_id is None:
+            self.packet_id = self.first("get_packet_id", self.packet_name)
+            if self.packet_id is None and register:
+                with self.db_conn.xact():
+                    # partitions of the tables of packet are visible together with the packet
+                    self.packet_id = self.first(
+                        "insert_packet", self.packet_name, self.packet_hash, self.meta_data, self.actions_total
+                    )
+                    if self.packet_id is not None and ActionTracker.is_partitioned(self.db_conn, self.schema_location):
+                        for table in ActionTracker.packet_tables:
+                            self.db_conn.execute(
+                                "CREATE TABLE %s PARTITION OF %s.%s FOR VALUES IN (%d)" % (
+                                    ActionTracker.get_partition(self.schema_location, self.packet_id, table),
+                                    self.schema_location,
+                                    table,
+                                    self.packet_id
+                                )
+                            )
+            if self.packet_id is None and register:
+                # registered by another session
+                self.packet_id = self.first("get_packet_id", self.packet_name)
+        return self.packet_id
+
+    def get_step_id(self, step_name):
+        # step is registered on first call
+        if step_name not in self.step_ids:
+            step_id = self.first("get_step_id", self.get_packet_id(), step_name)
+            if step_id is None:
+                step_id = self.first("insert_step", step_name, self.get_packet_id())
+            self.step_ids[step_name] = step_id
+        return self.step_ids[step_name]
+
+    def begin_action(self, step_name):
+        # "action" will be inserted into "dbc_actions" only in case of successful execution,
+        # but before execution of "action", it is necessary to set status of "step" = "started"
+        self.get_step_id(step_name)
+
+    def get_apply_action_query(self, step_name, step_hash, chunk_end=None):
+        # executed in the same simple query as the "action" itself, so bind parameters can't be used
+        return """
+            INSERT INTO %s.dbc_actions(packet_id, step_id, step_hash, chunk_end)
+            VALUES (%d, %d, '%s', %s)
+        """ % (
+            self.schema_location, self.get_packet_id(), self.get_step_id(step_name), step_hash,
+            'NULL' if chunk_end is None else int(chunk_end)
+        )
+
+    def apply_action(self, step_name, step_hash, chunk_end=None):
+        self.execute(
+            "apply_action",
+            self.get_packet_id(), self.get_step_id(step_name), step_hash, None if chunk_end is None else int(chunk_end)
+        )
+
+    def get_action_hashes(self, step_name):
+        return set(
+            rec[0] for rec in self.execute("get_action_hashes", self.get_packet_id(), self.get_step_id(step_name))
+        )
+
+    def get_chunk_end(self, step_name):
+        # the last key processed by the chunked step
+        return self.first("get_chunk_end", self.get_packet_id(), self.get_step_id(step_name))
+
+    def set_step_status(self, step_name, result):
+        self.execute("set_step_status", self.get_step_id(step_name), result, None)
+
+    def set_step_exception_status(self, step_name, exception_descr):
+        self.execute("set_step_status", self.get_step_id(step_name), 'exception', exception_descr)
+
+    def set_packet_status(self, result):
+        if self.get_packet_id(register=False) is not None:
+            self.execute("set_packet_status", self.packet_id, result)
+
+    def get_packet_status(self):
+        return ActionTracker.get_packet_status(self.db_conn, self.schema_location, self.packet_name)
+
+    def set_actions_total(self, actions_total):
+        # written with the packet if it is not registered yet
+        self.actions_total = actions_total
+        if self.get_packet_id(register=False) is not None:
+            self.execute("set_actions_total", self.packet_id, actions_total)
+
+    def get_done_actions_count(self):
+        if self.get_packet_id(register=False) is None:
+            return 0
+        return self.first("get_done_actions_count", self.packet_id)
+
+    def add_action_stats(self, step_name, step_hash, started, duration, row_count=None, retry_count=0):
+        self.stats.append((self.get_step_id(step_name), step_hash, started, duration, row_count, retry_count))
+        if len(self.stats) >= self.stats_batch_size:
+            self.flush_stats()
+
+    def flush_stats(self):
+        if len(self.stats) > 0:
+            stats, self.stats = self.stats, []
+            self.execute("insert_action_stats", self.get_packet_id(), *[list(col) for col in zip(*stats)])
+
+    # "events" are lock waits of ClusterObserver
+    def add_lock_events(self, events):
+        rows = [
+            (
+                e["dt"], None if e["step"] is None else self.get_step_id(e["step"]), e["step_hash"], e["pid"],
+                e["reason"], e["cancelled"], e["blocked_pid"], e["blocking_pid"], e["blocked_query"],
+                e["blocking_query"], e["relation"], e["wait_duration"]
+            ) for e in events
+        ]
+        if len(rows) > 0:
+            self.execute("insert_lock_events", self.get_packet_id(), *[list(col) for col in zip(*rows)])
@@ -1,4 +1,5 @@
 import time
+import threading
 import configparser
 import argparse
 from psc.psclogger.psc_logger import PSCLogger
@@ -13,6 +14,8 @@ from actiontracker import ActionTracker
 from dbccore import *
 import shutil
 from enum import Enum
+import multiprocessing
+import pickle
 
 VERSION = 1.3
 
@@ -49,8 +52,10 @@ class SysConf:
                 return default
 
         self.dbs_dict = {}
+        self.dbs_clusters = {}      # key is "db_name", value is "host:port" of PostgreSQL instance
         for db in self.config['databases']:
             self.dbs_dict[db] = read_conf_param_value(self.config['databases'][db])
+            self.dbs_clusters[db] = get_cluster_name(self.dbs_dict[db])
 
         # main parameters
         self.application_name = get_key('main', 'application_name', 'db_converter')
@@ -58,14 +63,28 @@ class SysConf:
         self.lock_observer_sleep_interval = int(
             get_key('main', 'lock_observer_sleep_interval', '5')
         )
+        # interval of lock observer is adapted between min and max values,
+        # "lock_observer_sleep_interval" is the max interval by default
+        self.lock_observer_min_interval = float(get_key('main', 'lock_observer_min_interval', '0.2'))
+        self.lock_observer_max_interval = float(
+            get_key('main', 'lock_observer_max_interval', str(self.lock_observer_sleep_interval))
+        )
         self.conn_exception_sleep_interval = int(
             get_key('main', 'conn_exception_sleep_interval', '5')
         )
+        self.progress_log_interval = int(get_key('main', 'progress_log_interval', '30'))
         self.cancel_blocker_tx_timeout = get_key('main', 'cancel_blocker_tx_timeout', '5 seconds')
         self.cancel_wait_tx_timeout = get_key('main', 'cancel_wait_tx_timeout', '5 seconds')
         self.detailed_traceback = get_key('main', 'detailed_traceback', 'True', boolean=True)
         self.db_name_all_confirmation = get_key('main', 'db_name_all_confirmation', 'True', boolean=True)
         self.schema_location = get_key('main', 'schema_location', 'public')
+        self.max_parallel = int(get_key('main', 'max_parallel', '10'))
+        self.workers = get_key('main', 'workers', 'thread')
+        self.preflight_parallel = int(get_key('main', 'preflight_parallel', '20'))
+        self.max_conns_per_db = int(get_key('main', 'max_conns_per_db', '4'))
+        self.max_parallel_per_cluster = int(get_key('main', 'max_parallel_per_cluster', '4'))
+        self.max_conns_per_cluster = int(get_key('main', 'max_conns_per_cluster', '0'))
+        self.conn_acquire_timeout = int(get_key('main', 'conn_acquire_timeout', '300'))
 
         # log parameters
         self.log_level = get_key('log', 'log_level', 'Info')
@@ -157,12 +176,42 @@ class DBCParams:
             action='store_true',
             default=False
         )
+        parser.add_argument(
+            "--max-parallel",
+            help="Maximum number of databases processed in parallel (overrides 'max_parallel' in [main])",
+            type=int
+        )
+        parser.add_argument(
+            "--workers",
+            help="Execution mode for multi-database runs: 'thread' (default) or 'process' "
+                 "to shard databases across a pool of processes",
+            type=str,
+            choices=['thread', 'process']
+        )
         parser.add_argument(
             "--wipe",
             help="Delete information about '--packet-name' from action tracker (dbc_* tables)",
             action='store_true',
             default=False
         )
+        parser.add_argument(
+            "--retention",
+            help="Drop tracked actions of '--packet-name' if the packet is finished more than specified days ago",
+            type=int
+        )
+        parser.add_argument(
+            "--report",
+            help="Show duration percentiles and throughput of tracked actions of '--packet-name' for each step",
+            action='store_true',
+            default=False
+        )
+        parser.add_argument(
+            "--analyze",
+            help="Show expected locks, table rewrites and non-transactional statements of '--packet-name' "
+                 "for each step without connecting to databases",
+            action='store_true',
+            default=False
+        )
         parser.add_argument(
             "--stop",
             help="Execute pg_terminate_backend for all db_converter connections with specific packet name",
@@ -242,6 +291,7 @@ class DBCParams:
                 sys.exit(0)
 
             self.sys_conf = SysConf(conf)
+            self.conf_file = conf
 
             packet_dir = os.path.join(self.sys_conf.current_dir, 'packets', self.args.packet_name)
             if not os.path.isdir(packet_dir) or len(self.args.packet_name) == 0:
@@ -292,10 +342,28 @@ class DBCParams:
                             conf_json[key] = read_conf_param_value(value, boolean=True)
                         if key in ('cancel_wait_tx_timeout', 'cancel_blocker_tx_timeout'):
                             conf_json[key] = """'%s'""" % read_conf_param_value(value)
+                        if key in (
+                                'max_parallel',
+                                'preflight_parallel',
+                                'max_conns_per_db',
+                                'max_parallel_per_cluster',
+                                'max_conns_per_cluster',
+                                'conn_acquire_timeout'
+                        ):
+                            conf_json[key] = int(value)
                     self.sys_conf.__dict__.update(conf_json)
                 except:
                     raise Exception('Invalid value in --conf parameter')
 
+            if hasattr(self.args, 'max_parallel') and self.args.max_parallel is not None:
+                self.sys_conf.max_parallel = self.args.max_parallel
+
+            if hasattr(self.args, 'workers') and self.args.workers is not None:
+                self.sys_conf.workers = self.args.workers
+
+            if self.args.seq:
+                self.sys_conf.max_parallel = 1
+
             if hasattr(self.args, 'placeholders') and self.args.placeholders != '':
                 try:
                     self.placeholders = json.loads(self.args.placeholders.replace("""\'""", "\""))
@@ -306,6 +374,8 @@ class DBCParams:
             log_name_part = self.args.db_name
             for s in replace_symbols:
                 log_name_part = log_name_part.replace(s, "_")
+            if getattr(self.args, 'shard_num', None) is not None:
+                log_name_part += "_shard_%d" % self.args.shard_num
             self.logger = PSCLogger.instance(
                 "dbc_" + log_name_part + "_" + self.args.packet_name,
                 log_level=logging._nameToLevel[self.sys_conf.log_level.upper()],
@@ -339,6 +409,9 @@ class DBCParams:
 class CommandType(BasicEnum, Enum):
     LIST = 'list'
     WIPE = 'wipe'
+    RETENTION = 'retention'
+    REPORT = 'report'
+    ANALYZE = 'analyze'
     RUN = 'run'
     STOP = 'stop'
     STATUS = 'status'
@@ -367,25 +440,34 @@ class DBCResult:
     result_code = None
     packet_status = None
     result_data = None
+    workers_result = None
+    preflight_latency = None
 
 
 class MainRoutine(DBCParams, DBCCore):
-    external_interrupt = False
+    _external_interrupt = False
+    signal_handler = None       # SignalHandler installed once for the whole "run"
     command_type = None         # CommandType
     packet_type = None          # PacketType
+    packet_meta_data = {}       # meta_data.json of packet
     result_code = {}            # {db_name: ResultCode}
     packet_status = {}          # {db_name: PacketStatus}
-    db_packet_status = {}       #
+    db_packet_status = {}       # {db_name: {...}}
 
-    # db_packet_status = {
+    # db_packet_status[db_name] = {
     #     status: 'done | started | exception',
     #     exception_descr: 'text',
     #     exception_dt: 'datetime',
     #     hash: 'text'
     # }
 
+    preflight_latency = {}      # {db_name: seconds}, None if database is unreachable
+    ready_dbs = set()           # databases locked by preflight and waiting for the main phase
+
     result_data = {}
     dbs = []        # lists of databases for processing
+    shard_dbs = set()   # databases processed by child processes in "--workers=process" mode
+    schedulers = []     # DBScheduler of the running phase, its slots are woken up on termination
 
     def terminate_conns(self, db_conn, db_name, app_name, packet, terminate=True):
         found_conns = False
@@ -416,6 +498,12 @@ class MainRoutine(DBCParams, DBCCore):
             self.command_type = CommandType.LIST
         elif self.args.wipe:
             self.command_type = CommandType.WIPE
+        elif getattr(self.args, 'retention', None) is not None:
+            self.command_type = CommandType.RETENTION
+        elif getattr(self.args, 'report', False):
+            self.command_type = CommandType.REPORT
+        elif getattr(self.args, 'analyze', False):
+            self.command_type = CommandType.ANALYZE
         elif self.args.stop:
             self.command_type = CommandType.STOP
         elif self.args.status:
@@ -438,6 +526,7 @@ class MainRoutine(DBCParams, DBCCore):
             current_file.close()
             try:
                 meta_data_json = json.loads(file_content)
+                self.packet_meta_data = meta_data_json
                 if "type" in meta_data_json:
                     if meta_data_json["type"] == 'default':
                         self.packet_type = PacketType.DEFAULT
@@ -498,42 +587,66 @@ class MainRoutine(DBCParams, DBCCore):
     # helper for iterate all threads
     def iterate_threads(self):
         common_list_of_threads = []
-        for db, threads_per_db in self.worker_threads.items():
+        for db, threads_per_db in list(self.worker_threads.items()):
             common_list_of_threads.extend(threads_per_db)
         for thread_i in common_list_of_threads:
             yield thread_i
 
-    # method for synchronous/asynchronous behaviour
-    def wait_threads(self):
-        alive_count = 1
-        live_iteration = 0
-        while alive_count > 0:
-            with SignalHandler() as handler:
-                alive_count = len([thread for thread in self.iterate_threads() if thread.is_alive()])
-                if alive_count == 0: break
-                time.sleep(0.1)
-                if live_iteration % (20 * 3) == 0:
-                    self.logger.log('Live %s threads: %s' % (
-                        alive_count,
-                        str([thread for thread in self.iterate_threads() if thread.is_alive()])
-                    ), "Debug", do_print=True)
-                live_iteration += 1
-                if handler.interrupted or self.external_interrupt:
-                    self.logger.log('Received termination signal! Call interrupt_all_conns...', "Debug", do_print=True)
+    # wake up all waiters of "threads_cond": called on thread completion, signals and external interrupt
+    def notify_threads(self):
+        with threads_cond:
+            threads_cond.notify_all()
+
+    @property
+    def external_interrupt(self):
+        return self._external_interrupt
+
+    @external_interrupt.setter
+    def external_interrupt(self, value):
+        self._external_interrupt = value
+        self.notify_threads()
+
+    def is_interrupted(self):
+        return self.external_interrupt or (self.signal_handler is not None and self.signal_handler.interrupted)
+
+    # method for synchronous/asynchronous behaviour, "threads" - wait only these threads instead of all threads
+    def wait_threads(self, threads=None):
+        with threads_cond:
+            while True:
+                if self.is_interrupted():
+                    if not self.is_terminate:
+                        self.logger.log(
+                            'Received termination signal! Call interrupt_all_conns...', "Debug", do_print=True
+                        )
                     self.is_terminate = True
                     self.interrupt_all_conns()
+                    for scheduler in self.schedulers:
+                        scheduler.wake_up()
+                alive_threads = [
+                    thread for thread in (self.iterate_threads() if threads is None else threads)
+                    if is_thread_running(thread)
+                ]
+                if len(alive_threads) == 0:
+                    break
+                # woken up by finished threads and by signals, timeout is used only for periodic logging
+                # and for repeated interruption of connections opened after termination
+                if not threads_cond.wait(1 if self.is_terminate else 6):
+                    self.logger.log(
+                        'Live %s threads: %s' % (len(alive_threads), str(alive_threads)), "Debug", do_print=True
+                    )
 
     def fill_status(self, db_name, db_conn):
-        self.db_packet_status = ActionTracker.get_packet_status(
+        db_packet_status = ActionTracker.get_packet_status(
             db_conn, self.sys_conf.schema_location, self.args.packet_name
         )
-        if "status" in self.db_packet_status:
-            if "exception_descr" in self.db_packet_status and self.db_packet_status["exception_descr"] is not None:
+        self.db_packet_status[db_name] = db_packet_status
+        if "status" in db_packet_status:
+            if "exception_descr" in db_packet_status and db_packet_status["exception_descr"] is not None:
                 self.packet_status[db_name] = PacketStatus.EXCEPTION
-            elif "status" in self.db_packet_status and self.db_packet_status["status"] is not None:
-                if self.db_packet_status["status"] == 'done':
+            elif "status" in db_packet_status and db_packet_status["status"] is not None:
+                if db_packet_status["status"] == 'done':
                     self.packet_status[db_name] = PacketStatus.DONE
-                if self.db_packet_status["status"] == 'started':
+                if db_packet_status["status"] == 'started':
                     self.packet_status[db_name] = PacketStatus.STARTED
         else:
             self.packet_status[db_name] = PacketStatus.NEW
@@ -547,14 +660,35 @@ class MainRoutine(DBCParams, DBCCore):
         self.workers_db_pid.clear()
         self.worker_threads.clear()
         self.workers_status.clear()
+        self.workers_finished.clear()
+        self.governors.clear()
+        self.action_retries.clear()
+        self.progress.clear()
+        self.lock_observers.clear()
+        self.lock_events.clear()
+        self.pid_actions.clear()
+        self.lock_probes.clear()
+        self.lock_impacts.clear()
         self.db_conns.clear()
+        self.trackers.clear()
         del self.dbs[:]
+        self.shard_dbs.clear()
+        del self.schedulers[:]
+        self.preflight_latency.clear()
+        self.ready_dbs.clear()
         self.command_type = None
         self.packet_type = None
+        self.packet_meta_data = {}
 
-    # processing specific DB
-    def run_on_db(self, db_name, str_conn):
-        db_conn = postgresql.open(str_conn)
+    # preflight of specific DB: status, wipe, unlock and acquiring of packet lock
+    def preflight_db(self, db_name, str_conn):
+        db_conn = self.conn_manager.acquire(db_name, str_conn)
+        try:
+            self.preflight_db_conn(db_name, db_conn)
+        finally:
+            self.conn_manager.release(db_name, db_conn)
+
+    def preflight_db_conn(self, db_name, db_conn):
         # ================================================================================================
         # Check 'dbc_packets', 'dbc_steps', 'dbc_actions', 'dbc_locks' tables
         ActionTracker.init_tbls(db_conn, self.sys_conf.schema_location)
@@ -595,6 +729,35 @@ class MainRoutine(DBCParams, DBCCore):
             self.result_code[db_name] = ResultCode.NOTHING_TODO
             self.packet_status[db_name] = PacketStatus.NEW
         # ================================================================================================
+        if self.command_type == CommandType.RETENTION:
+            if ActionTracker.drop_expired_actions(
+                db_conn, self.sys_conf.schema_location, self.args.packet_name, self.args.retention
+            ):
+                self.result_code[db_name] = ResultCode.SUCCESS
+                print(
+                    "=====> Database '%s', packet '%s' tracked actions older than %d days are dropped!" %
+                    (db_name, self.args.packet_name, self.args.retention)
+                )
+            else:
+                self.result_code[db_name] = ResultCode.NOTHING_TODO
+                print(
+                    "=====> Database '%s', packet '%s' no finished actions older than %d days!" %
+                    (db_name, self.args.packet_name, self.args.retention)
+                )
+        # ================================================================================================
+        if self.command_type == CommandType.REPORT:
+            report = ActionTracker.get_report(db_conn, self.sys_conf.schema_location, self.args.packet_name)
+            self.result_data[db_name] = report
+            if len(report) > 0:
+                self.result_code[db_name] = ResultCode.SUCCESS
+                table = [list(report[0].column_names)]
+                table.extend([[str(v) for v in row] for row in report])
+                print("=====> Database '%s', packet '%s' actions report:" % (db_name, self.args.packet_name))
+                print(print_table(table))
+            else:
+                self.result_code[db_name] = ResultCode.NOTHING_TODO
+                print("=====> Database '%s', packet '%s' no tracked actions!" % (db_name, self.args.packet_name))
+        # ================================================================================================
         if self.args.status:
             print(
                 "=====> Database '%s', packet '%s' status: %s" %
@@ -606,10 +769,21 @@ class MainRoutine(DBCParams, DBCCore):
             )
             self.result_code[db_name] = ResultCode.SUCCESS
 
-            if "exception_descr" in  self.db_packet_status and  self.db_packet_status["exception_descr"] is not None:
-                print("       Action date time: %s" % str( self.db_packet_status["exception_dt"]))
+            db_packet_status = self.db_packet_status.get(db_name, {})
+            if self.packet_status.get(db_name) == PacketStatus.STARTED:
+                progress = ActionTracker.get_progress(db_conn, self.sys_conf.schema_location, self.args.packet_name)
+                if progress is not None:
+                    self.result_data[db_name] = progress
+                    print(
+                        "       Progress: %s%% (%d of %d actions), %.2f actions/sec, ETA %s" % (
+                            progress["percent"], progress["done"], progress["total"],
+                            progress["actions_per_sec"], format_eta(progress["eta"])
+                        )
+                    )
+            if "exception_descr" in db_packet_status and db_packet_status["exception_descr"] is not None:
+                print("       Action date time: %s" % str(db_packet_status["exception_dt"]))
                 print("=".join(['=' * 100]))
-                print(self.db_packet_status["exception_descr"])
+                print(db_packet_status["exception_descr"])
                 print("=".join(['=' * 100]))
         # ================================================================================================
         if not self.args.unlock and self.command_type == CommandType.RUN:
@@ -630,28 +804,7 @@ class MainRoutine(DBCParams, DBCCore):
                         "Info",
                         do_print=True
                     )
-                    self.append_thread(
-                        db_name,
-                        self.lock_observer("lock_observer_%s" % str(db_name), str_conn, db_name, self.args.packet_name)
-                    )
-
-                    self.append_thread(
-                        db_name,
-                        self.worker_db_func(
-                            "manager_db_%s" % str(db_name),
-                            str_conn,
-                            db_name,
-                            self.args.packet_name,
-                            self.packet_type == PacketType.READ_ONLY
-                        )
-                    )
-
-                    self.logger.log(
-                        '--------> Packet \'%s\' started for \'%s\' database!' % \
-                        (self.args.packet_name, db_name),
-                        "Info",
-                        do_print=True
-                    )
+                    self.ready_dbs.add(db_name)
                 # ===========================================
             if self.packet_status[db_name] == PacketStatus.DONE:
                 self.logger.log(
@@ -682,10 +835,302 @@ class MainRoutine(DBCParams, DBCCore):
                     do_print=True
                 )
 
-        db_conn.close()
+    # main phase of specific DB: start worker_db_func for the locked packet and observe its sessions
+    # by the lock observer of the cluster
+    def run_on_db(self, db_name, str_conn):
+        self.set_worker_status_start(db_name)
+        self.append_thread(
+            db_name,
+            self.worker_db_func(
+                "manager_db_%s" % str(db_name),
+                str_conn,
+                db_name,
+                self.args.packet_name,
+                self.packet_type == PacketType.READ_ONLY
+            )
+        )
+
+        self.observe_db(db_name, str_conn, self.args.packet_name, self.packet_meta_data.get("lock_observer"))
+
+        self.logger.log(
+            '--------> Packet \'%s\' started for \'%s\' database!' % \
+            (self.args.packet_name, db_name),
+            "Info",
+            do_print=True
+        )
+
+    # slot of the preflight pool: runs "preflight_db" for the next database from the scheduler
+    @threaded
+    def preflight_slot(self, slot_name, scheduler):
+        while not self.is_terminate:
+            db_name = scheduler.next_db(lambda: self.is_terminate)
+            if db_name is None:
+                break
+            start_time = time.time()
+            try:
+                self.preflight_db(db_name, self.sys_conf.dbs_dict[db_name])
+                self.preflight_latency[db_name] = time.time() - start_time
+            except (
+                    postgresql.exceptions.AuthenticationSpecificationError,
+                    postgresql.exceptions.ClientCannotConnectError,
+                    TimeoutError
+            ) as e:
+                self.preflight_latency[db_name] = None
+                self.logger.log(
+                    'Cannot connect to %s: \n%s' % (db_name, exception_helper(self.sys_conf.detailed_traceback)),
+                    "Error",
+                    do_print=True
+                )
+            except:
+                self.preflight_latency[db_name] = time.time() - start_time
+                self.result_code[db_name] = ResultCode.FAIL
+                self.logger.log(
+                    'Exception in \'%s\' on processing \'%s\': \n%s' %
+                    (slot_name, db_name, exception_helper(self.sys_conf.detailed_traceback)),
+                    "Error",
+                    do_print=True
+                )
+            finally:
+                scheduler.done(db_name)
+
+    # preflight of all databases with "preflight_parallel" concurrent connections
+    def run_preflight(self):
+        # without limit per cluster, but spread across clusters
+        scheduler = DBScheduler(self.dbs, self.sys_conf.preflight_parallel, self.sys_conf.dbs_clusters)
+        self.schedulers.append(scheduler)
+        for slot_num in range(scheduler.slots_count):
+            self.append_thread("preflight_slot", self.preflight_slot("preflight_slot_%d" % slot_num, scheduler))
+        self.wait_threads(self.worker_threads.get("preflight_slot", []))
+
+        if len(self.preflight_latency) > 0:
+            self.logger.log(
+                '=====> Preflight of %d databases with %d parallel connections, latency:' %
+                (len(self.preflight_latency), scheduler.slots_count),
+                "Info",
+                do_print=True
+            )
+            # slowest and unreachable databases first
+            for db_name, latency in sorted(
+                    self.preflight_latency.items(),
+                    key=lambda v: float('inf') if v[1] is None else v[1],
+                    reverse=True
+            ):
+                self.logger.log(
+                    '       %s: %s' % (db_name, 'unreachable' if latency is None else '%.3f sec' % latency),
+                    "Info" if latency is not None else "Error",
+                    do_print=True
+                )
+
+    # slot of the databases pool: takes the next database from the scheduler
+    # as soon as worker_db_func of the previous one is finished
+    @threaded
+    def db_slot(self, slot_name, scheduler):
+        while not self.is_terminate:
+            db_name = scheduler.next_db(lambda: self.is_terminate)
+            if db_name is None:
+                break
+            try:
+                self.run_on_db(db_name, self.sys_conf.dbs_dict[db_name])
+                for thread in list(self.worker_threads.get(db_name, [])):
+                    thread.join()
+            except:
+                self.result_code[db_name] = ResultCode.FAIL
+                self.logger.log(
+                    'Exception in \'%s\' on processing \'%s\': \n%s' %
+                    (slot_name, db_name, exception_helper(self.sys_conf.detailed_traceback)),
+                    "Error",
+                    do_print=True
+                )
+            finally:
+                self.unobserve_db(db_name)
+                scheduler.done(db_name)
+
+    # databases of one cluster are never split between shards, so "max_parallel_per_cluster"
+    # and "max_conns_per_cluster" are kept by the shard of the cluster
+    def get_shards(self, shards_count):
+        clusters = {}
+        for db_name in self.dbs:
+            clusters.setdefault(self.sys_conf.dbs_clusters.get(db_name, db_name), []).append(db_name)
+        shards = [[] for _ in range(min(shards_count, len(clusters)))]
+        # the largest clusters first, each one to the shard with the smallest number of databases
+        for cluster_dbs in sorted(clusters.values(), key=len, reverse=True):
+            min(shards, key=len).extend(cluster_dbs)
+        return shards
+
+    # "--workers=process" mode: shard the list of databases across a pool of processes
+    # and merge the results of all shards
+    def run_shards(self):
+        shards_count = min(len(self.dbs), os.cpu_count() or 1)
+        if self.sys_conf.max_parallel > 0:
+            shards_count = min(shards_count, self.sys_conf.max_parallel)
+        shards = self.get_shards(shards_count)
+        shards_count = len(shards)
+        # the common limit of parallel databases is divided between shards, the sum of shares is the limit
+        shards_max_parallel = [
+            0 if self.sys_conf.max_parallel <= 0 else
+            self.sys_conf.max_parallel // shards_count + (1 if i < self.sys_conf.max_parallel % shards_count else 0)
+            for i in range(shards_count)
+        ]
+
+        self.logger.log(
+            '=====> Processing %d databases of %d clusters with %d processes' % (
+                len(self.dbs), len(set(self.sys_conf.dbs_clusters.get(db_name, db_name) for db_name in self.dbs)),
+                shards_count
+            ),
+            "Info",
+            do_print=True
+        )
+
+        def get_shard_args(shard_num):
+            shard_args = argparse.Namespace(**vars(self.args))
+            shard_args.shard_num = shard_num     # each shard writes its own log file
+            return shard_args
+
+        # a process per shard: unlike the workers of multiprocessing.Pool, the death of the shard process
+        # is detected, the pipe of the shard is closed without the result
+        mp_context = multiprocessing.get_context('spawn')
+        shard_results = [None] * shards_count
+
+        def wait_shard(shard_i, process, reader):
+            try:
+                shard_results[shard_i] = reader.recv()
+            except EOFError:
+                # the shard process died before its result was sent
+                process.join()
+                shard_results[shard_i] = {"exception": "shard process exited with code %s" % process.exitcode}
+            except BaseException:
+                shard_results[shard_i] = {"exception": exception_helper(self.sys_conf.detailed_traceback)}
+            process.join()
+            self.notify_threads()
+
+        wait_threads = []
+        for shard_num, shard in enumerate(shards, start=1):
+            reader, writer = mp_context.Pipe(duplex=False)
+            process = mp_context.Process(
+                target=send_shard_result,
+                args=(
+                    writer, run_shard, get_shard_args(shard_num), self.conf_file, shard,
+                    shards_max_parallel[shard_num - 1]
+                )
+            )
+            process.start()
+            writer.close()
+            wait_thread = threading.Thread(target=wait_shard, args=(shard_num - 1, process, reader), daemon=True)
+            wait_thread.start()
+            wait_threads.append(wait_thread)
+        with threads_cond:
+            while any(wait_thread.is_alive() for wait_thread in wait_threads):
+                if self.is_interrupted():
+                    self.logger.log('Received termination signal! Stopping shards...', "Debug", do_print=True)
+                    self.is_terminate = True
+                    for process in multiprocessing.active_children():
+                        if os.name == 'nt':
+                            process.terminate()
+                        else:
+                            os.kill(process.pid, signal.SIGINT)
+                    break
+                threads_cond.wait()
+        for wait_thread in wait_threads:
+            wait_thread.join()
+
+        for shard, shard_result in zip(shards, shard_results):
+            self.shard_dbs.update(shard)
+            if shard_result["exception"] is not None:
+                self.logger.log(
+                    'Exception in shard %s: \n%s' % (str(shard), shard_result["exception"]),
+                    "Error",
+                    do_print=True
+                )
+                for db_name in shard:
+                    self.result_code[db_name] = ResultCode.FAIL
+                continue
+            self.result_code.update(shard_result["result_code"])
+            self.packet_status.update(shard_result["packet_status"])
+            self.result_data.update(shard_result["result_data"])
+            self.workers_result.update(shard_result["workers_result"])
+            self.lock_observer_blocker_cnt += shard_result["lock_observer_blocker_cnt"]
+            self.lock_observer_wait_cnt += shard_result["lock_observer_wait_cnt"]
+            self.lock_observers_cnt += shard_result["lock_observers_cnt"]
+            self.lock_probe_wait_cnt += shard_result["lock_probe_wait_cnt"]
+            self.lock_events_history.extend(shard_result["lock_events_history"])
+
+    # lock waits of the run grouped by database and relation, the longest total wait first
+    def log_lock_events_summary(self, max_relations=10):
+        if len(self.lock_events_history) == 0:
+            return
+        relations = {}
+        for event in self.lock_events_history:
+            stat = relations.setdefault((event["db_name"], event["relation"]), [0, 0, 0.0, 0.0, set()])
+            stat[0] += 1
+            stat[1] += 1 if event["cancelled"] else 0
+            stat[2] += event["wait_duration"] or 0
+            stat[3] = max(stat[3], event["wait_duration"] or 0)
+            if event["step"] is not None:
+                stat[4].add(event["step"])
+        self.logger.log(
+            '=====> Lock waits: %d, cancelled as blocker: %d, cancelled on wait: %d' % (
+                len(self.lock_events_history),
+                len([e for e in self.lock_events_history if e["cancelled"] and e["reason"] == 'blocker']),
+                len([e for e in self.lock_events_history if e["cancelled"] and e["reason"] == 'wait'])
+            ),
+            "Info",
+            do_print=True
+        )
+        for (db_name, relation), stat in sorted(relations.items(), key=lambda v: -v[1][2])[:max_relations]:
+            self.logger.log(
+                '         %s: %s - %d waits, %d cancelled, total %.3f sec, max %.3f sec, steps %s' %
+                (db_name, relation, stat[0], stat[1], stat[2], stat[3], str(sorted(stat[4]))),
+                "Info",
+                do_print=True
+            )
+
+    # static analysis of the steps of packet: lock mode, rewrite risk and lock impact of each statement,
+    # see "get_statement_impact"
+    def analyze_packet(self):
+        parsed = self.parse_packet(self.args.packet_name, "analyze")
+        if parsed is None:
+            return []
+        step_files = parsed[0]
+        res = []
+        for step, query, _ in step_files:
+            if not step.endswith('.sql'):
+                continue
+            for impact in get_query_impact(query, self.sys_conf.non_tx_ops):
+                impact["step"] = step
+                res.append(impact)
+
+        table = [['step', 'statement', 'relations', 'lock_mode', 'rewrite', 'non_tx', 'impact']]
+        for impact in res:
+            statement = " ".join(impact["statement"].split())
+            table.append([
+                impact["step"],
+                statement if len(statement) <= 60 else statement[:57] + "...",
+                ", ".join(impact["relations"]),
+                impact["lock_mode"] or "-",
+                impact["rewrite"],
+                "yes" if impact["non_tx"] else "",
+                impact["impact"]
+            ])
+        print("=====> Packet '%s' lock impact (PostgreSQL 11+):" % self.args.packet_name)
+        if len(res) > 0:
+            print(print_table(table))
+        print(
+            "       Statements: %d, high impact: %d, medium impact: %d, unknown: %d, non-transactional: %d" % (
+                len(res),
+                len([v for v in res if v["impact"] == 'high']),
+                len([v for v in res if v["impact"] == 'medium']),
+                len([v for v in res if v["impact"] == 'unknown']),
+                len([v for v in res if v["non_tx"]])
+            )
+        )
+        print(
+            "       Before PostgreSQL 11, ADD COLUMN with DEFAULT also rewrites the table and its impact is higher"
+        )
+        return res
 
     def run(self) -> DBCResult:
         self.logger.log('=====> DBC %s started' % VERSION, "Info", do_print=True)
+        self.lock_events_history = []
 
         self.logger.log("#--------------- Incoming parameters", "Info")
         for arg in vars(self.args):
@@ -695,7 +1140,8 @@ class MainRoutine(DBCParams, DBCCore):
         # ========================================================================
         # confirmation
         break_deployment = False
-        if not self.args.list and not self.args.status and self.sys_conf.db_name_all_confirmation:
+        if not self.args.list and not self.args.status and self.command_type != CommandType.ANALYZE and \
+                self.sys_conf.db_name_all_confirmation:
             if len(self.dbs) > 1 and not self.args.force:
                 print("Deployment will be performed on these databases:\n")
                 for db_name in self.dbs:
@@ -707,6 +1153,10 @@ class MainRoutine(DBCParams, DBCCore):
                     self.result_code[db_name] = ResultCode.NOTHING_TODO
         # ========================================================================
 
+        if self.command_type == CommandType.ANALYZE:
+            self.result_data[self.args.packet_name] = self.analyze_packet()
+            break_deployment = True
+
         if self.args.list:
             print("List of targets:")
             for db_name in self.dbs:
@@ -714,36 +1164,70 @@ class MainRoutine(DBCParams, DBCCore):
                 break_deployment = True
                 self.result_code[db_name] = ResultCode.NOTHING_TODO
 
-        if not break_deployment:
-            if len(self.dbs) == 0:
-                self.logger.log('No target databases!', "Error", do_print=True)
-                for db in self.args.db_name.split(','):
-                    self.packet_status[db] = PacketStatus.UNKNOWN
-                    self.result_code[db] = ResultCode.NOTHING_TODO
-            for db_name in self.dbs:
-                try:
-                    self.run_on_db(db_name, self.sys_conf.dbs_dict[db_name])
-                    if self.args.seq:
-                        self.wait_threads()     # wait on pair (lock_observer, worker_db_func)
-                except (
-                        postgresql.exceptions.AuthenticationSpecificationError,
-                        postgresql.exceptions.ClientCannotConnectError,
-                        TimeoutError
-                ) as e:
-                    self.logger.log(
-                        'Cannot connect to %s: \n%s' % (db_name, exception_helper(self.sys_conf.detailed_traceback)),
-                        "Error",
-                        do_print=True
-                    )
+        self.conn_manager = DBConnManager(
+            self.sys_conf.max_conns_per_db,
+            self.sys_conf.dbs_clusters,
+            self.sys_conf.max_conns_per_cluster,
+            self.sys_conf.conn_acquire_timeout,
+            lambda: self.is_terminate
+        )
 
-        if not break_deployment:
-            self.wait_threads()     # wait all threads
+        # signal handler is installed once for the whole run: received signal wakes up "wait_threads"
+        with SignalHandler(callback=self.notify_threads) as self.signal_handler:
+            if not break_deployment:
+                if len(self.dbs) == 0:
+                    self.logger.log('No target databases!', "Error", do_print=True)
+                    for db in self.args.db_name.split(','):
+                        self.packet_status[db] = PacketStatus.UNKNOWN
+                        self.result_code[db] = ResultCode.NOTHING_TODO
+                if self.sys_conf.workers == 'process' and len(self.dbs) > 1 and self.sys_conf.max_parallel != 1:
+                    self.run_shards()
+                    self.wait_threads()     # wait all threads
+                else:
+                    self.run_preflight()
+                    scheduler = DBScheduler(
+                        [db_name for db_name in self.dbs if db_name in self.ready_dbs],
+                        self.sys_conf.max_parallel,
+                        self.sys_conf.dbs_clusters,
+                        self.sys_conf.max_parallel_per_cluster
+                    )
+                    self.schedulers.append(scheduler)
+                    if scheduler.slots_count > 0 and not self.is_terminate:
+                        self.logger.log(
+                            '=====> Processing %d databases of %d clusters with %d parallel slots' %
+                            (
+                                len(scheduler.pending()),
+                                len(set(scheduler.get_cluster(db_name) for db_name in scheduler.pending())),
+                                scheduler.slots_count
+                            ),
+                            "Info",
+                            do_print=True
+                        )
+                        for slot_num in range(scheduler.slots_count):
+                            self.append_thread("db_slot", self.db_slot("db_slot_%d" % slot_num, scheduler))
+
+                        self.wait_threads()     # wait all threads
+                    if len(scheduler.pending()) > 0:
+                        self.logger.log(
+                            'Databases skipped due to termination: %s' % str(scheduler.pending()),
+                            "Error",
+                            do_print=True
+                        )
+                        # release the packet locks acquired by preflight
+                        for db_name in scheduler.pending():
+                            db_conn = self.conn_manager.acquire(db_name, self.sys_conf.dbs_dict[db_name])
+                            ActionTracker.set_packet_unlock(
+                                db_conn, self.sys_conf.schema_location, self.args.packet_name
+                            )
+                            self.conn_manager.release(db_name, db_conn)
+                            self.result_code[db_name] = ResultCode.TERMINATE
 
         for db, result in self.workers_result.items():
-            if db in self.sys_conf.dbs_dict:
-                db_conn = postgresql.open(self.sys_conf.dbs_dict[db])
+            # databases processed by child processes are already unlocked by them
+            if db in self.sys_conf.dbs_dict and db not in self.shard_dbs:
+                db_conn = self.conn_manager.acquire(db, self.sys_conf.dbs_dict[db])
                 ActionTracker.set_packet_unlock(db_conn, self.sys_conf.schema_location, self.args.packet_name)
-                db_conn.close()
+                self.conn_manager.release(db, db_conn)
                 if result == WorkerResult.SUCCESS:
                     self.result_code[db] = ResultCode.SUCCESS
                     self.packet_status[db] = PacketStatus.DONE
@@ -754,6 +1238,13 @@ class MainRoutine(DBCParams, DBCCore):
                     self.result_code[db] = ResultCode.TERMINATE
                     self.packet_status[db] = PacketStatus.STARTED
 
+        self.log_lock_events_summary()
+        self.conn_manager.close_all()
+        self.logger.log(
+            '=====> Connections opened: %d, reused: %d' %
+            (self.conn_manager.opened_cnt, self.conn_manager.reused_cnt),
+            "Info"
+        )
         self.logger.log('<===== DBC %s finished' % VERSION, "Info", do_print=True)
         self.logger.stop()
 
@@ -763,10 +1254,72 @@ class MainRoutine(DBCParams, DBCCore):
         result.result_code = self.result_code.copy()
         result.packet_status = self.packet_status.copy()
         result.result_data = self.result_data.copy()
+        result.workers_result = self.workers_result.copy()
+        result.preflight_latency = self.preflight_latency.copy()
 
         self.cleanup()
         return result
 
 
+def portable_result_data(result_data):
+    # values like timestamps with py-postgresql FixedOffset timezone can't be pickled
+    def portable_value(value):
+        try:
+            pickle.loads(pickle.dumps(value))
+            return value
+        except:
+            return str(value)
+
+    res = {}
+    for db_name, steps in result_data.items():
+        res[db_name] = {}
+        for step, results in steps.items():
+            try:
+                pickle.loads(pickle.dumps(results))
+                res[db_name][step] = results
+            except:
+                res[db_name][step] = [
+                    [
+                        postgresql.types.Row.from_sequence(v.keymap, [portable_value(x) for x in v])
+                        if isinstance(v, postgresql.types.Row) else v
+                        for v in result
+                    ] if isinstance(result, list) else result
+                    for result in results
+                ]
+    return res
+
+
+# entry point of the child process in "--workers=process" mode
+def run_shard(args, conf, dbs, max_parallel):
+    shard_result = {"exception": None}
+    try:
+        args.workers = 'thread'
+        args.max_parallel = max_parallel
+        main = MainRoutine(args, conf)
+        main.sys_conf.db_name_all_confirmation = False
+        main.dbs[:] = dbs
+        res = main.run()
+        shard_result["result_code"] = res.result_code
+        shard_result["packet_status"] = res.packet_status
+        shard_result["result_data"] = portable_result_data(res.result_data)
+        shard_result["workers_result"] = res.workers_result
+        shard_result["lock_observer_blocker_cnt"] = main.lock_observer_blocker_cnt
+        shard_result["lock_observer_wait_cnt"] = main.lock_observer_wait_cnt
+        shard_result["lock_observers_cnt"] = main.lock_observers_cnt
+        shard_result["lock_probe_wait_cnt"] = main.lock_probe_wait_cnt
+        shard_result["lock_events_history"] = main.lock_events_history
+    except BaseException:
+        shard_result["exception"] = exception_helper()
+    return shard_result
+
+
+# target of the shard process: the result of "func" is sent to the parent through the pipe
+def send_shard_result(conn, func, *args):
+    try:
+        conn.send(func(*args))
+    finally:
+        conn.close()
+
+
 if __name__ == "__main__":
     MainRoutine().run()
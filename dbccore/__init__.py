@@ -3,5 +3,30 @@ from dbccore.dbccore import BasicEnum
 from dbccore.dbccore import PacketType
 from dbccore.dbccore import WorkerResult
 from dbccore.dbccore import threaded
+from dbccore.dbccore import threads_cond
+from dbccore.dbccore import is_thread_running
+from dbccore.dbccore import print_table
+from dbccore.scheduler import DBScheduler
+from dbccore.scheduler import get_cluster_name
+from dbccore.connmanager import DBConnManager
+from dbccore.governor import ActionGovernor
+from dbccore.progress import ActionProgress
+from dbccore.progress import format_eta
+from dbccore.lockobserver import ClusterObserver
+from dbccore.steptemplate import QueryTemplate
+from dbccore.steptemplate import StepTemplate
+from dbccore.steptemplate import ActionQuery
+from dbccore.lockmodes import LOCK_MODES
+from dbccore.lockmodes import LOCK_CONFLICTS
+from dbccore.lockmodes import get_statement_locks
+from dbccore.lockmodes import get_query_locks
+from dbccore.lockmodes import get_statement_impact
+from dbccore.lockmodes import get_query_impact
+from dbccore.lockmodes import get_max_impact
 
-__all__ = ['DBCCore', 'BasicEnum', 'PacketType', 'WorkerResult', 'threaded']
+__all__ = [
+    'DBCCore', 'BasicEnum', 'PacketType', 'WorkerResult', 'threaded', 'threads_cond', 'is_thread_running',
+    'print_table', 'DBScheduler', 'get_cluster_name', 'DBConnManager', 'ActionGovernor', 'ActionProgress',
+    'format_eta', 'ClusterObserver', 'QueryTemplate', 'StepTemplate', 'ActionQuery', 'LOCK_MODES', 'LOCK_CONFLICTS',
+    'get_statement_locks', 'get_query_locks', 'get_statement_impact', 'get_query_impact', 'get_max_impact'
+]
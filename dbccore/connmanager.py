@@ -0,0 +1,162 @@
+import time
+import threading
+import psc.postgresql as postgresql
+
+
+class DBConnManager:
+    """
+    Sessions of databases shared by the phases of one run: preflight, lock observer, worker and final unlock.
+    Released sessions are kept idle and handed out again after a health check.
+    Number of sessions is limited per database and per cluster (databases with the same "host:port").
+    Waiting for a free session is limited by "acquire_timeout" seconds (0 - no limit) and is interrupted
+    as soon as "is_stopped" returns True, both raise the exception instead of waiting forever.
+    """
+    def __init__(self, max_conns_per_db=0, clusters=None, max_conns_per_cluster=0, acquire_timeout=0, is_stopped=None):
+        # max_conns_* <= 0 means "no limit", otherwise at least two sessions are required:
+        # worker and lock observer work at the same time
+        self.max_conns_per_db = max(max_conns_per_db, 2) if max_conns_per_db > 0 else 0
+        self.max_conns_per_cluster = max(max_conns_per_cluster, 2) if max_conns_per_cluster > 0 else 0
+        self.clusters = clusters if clusters is not None else {}     # key is "db_name", value is cluster name
+        self.acquire_timeout = float(acquire_timeout)
+        self.is_stopped = is_stopped
+        self.cond = threading.Condition()
+        self.idle = {}          # key is "db_name", value is list of idle sessions
+        self.used = {}          # key is "db_name", value is number of handed out sessions
+        self.cluster_used = {}  # key is cluster name, value is number of handed out and idle sessions
+        self.opened_cnt = 0
+        self.reused_cnt = 0
+
+    @staticmethod
+    def is_healthy(conn):
+        if conn.closed:
+            return False
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except:
+            return False
+
+    def get_cluster(self, db_name):
+        return self.clusters.get(db_name, db_name)
+
+    def can_open(self, db_name):
+        if 0 < self.max_conns_per_db <= self.used.get(db_name, 0):
+            return False
+        if 0 < self.max_conns_per_cluster <= self.cluster_used.get(self.get_cluster(db_name), 0):
+            # idle sessions of other databases of the cluster are closed to free up the limit
+            for idle_db_name, conns in self.idle.items():
+                if self.get_cluster(idle_db_name) == self.get_cluster(db_name) and len(conns) > 0:
+                    self.close_conn(conns.pop())
+                    self.cluster_used[self.get_cluster(db_name)] -= 1
+                    return True
+            return False
+        return True
+
+    # number of sessions of the database which can be handed out without waiting, None - no limit
+    def free_conns(self, db_name):
+        cluster = self.get_cluster(db_name)
+        free = []
+        with self.cond:
+            if self.max_conns_per_db > 0:
+                free.append(self.max_conns_per_db - self.used.get(db_name, 0))
+            if self.max_conns_per_cluster > 0:
+                free.append(
+                    self.max_conns_per_cluster - self.cluster_used.get(cluster, 0) + sum(
+                        len(conns) for idle_db_name, conns in self.idle.items()
+                        if self.get_cluster(idle_db_name) == cluster
+                    )
+                )
+        return max(min(free), 0) if len(free) > 0 else None
+
+    def check_wait(self, db_name, blocking, deadline):
+        limits = "max_conns_per_db = %d, max_conns_per_cluster = %d" % (
+            self.max_conns_per_db, self.max_conns_per_cluster
+        )
+        if not blocking:
+            raise Exception("No free session for '%s' database (%s)" % (db_name, limits))
+        if self.is_stopped is not None and self.is_stopped():
+            raise Exception("Waiting for a session of '%s' database is interrupted" % db_name)
+        if deadline is not None and time.time() >= deadline:
+            raise Exception(
+                "No free session for '%s' database in %s sec (%s)" % (db_name, self.acquire_timeout, limits)
+            )
+
+    # "blocking" - wait for a free session if the limit is reached, otherwise raise the exception at once
+    def acquire(self, db_name, str_conn, blocking=True):
+        cluster = self.get_cluster(db_name)
+        deadline = time.time() + self.acquire_timeout if self.acquire_timeout > 0 else None
+        while True:
+            conn = None
+            with self.cond:
+                while True:
+                    if len(self.idle.get(db_name, [])) > 0:
+                        conn = self.idle[db_name].pop()
+                        break
+                    if self.can_open(db_name):
+                        self.cluster_used[cluster] = self.cluster_used.get(cluster, 0) + 1
+                        break
+                    self.check_wait(db_name, blocking, deadline)
+                    # is_stopped is checked periodically
+                    self.cond.wait(
+                        0.5 if deadline is None else min(max(deadline - time.time(), 0), 0.5)
+                    )
+                self.used[db_name] = self.used.get(db_name, 0) + 1
+            if conn is None:
+                break
+            if self.is_healthy(conn):
+                with self.cond:
+                    self.reused_cnt += 1
+                return conn
+            # broken idle session: open the new one instead
+            self.close_conn(conn)
+            with self.cond:
+                self.used[db_name] -= 1
+                self.cluster_used[cluster] -= 1
+
+        try:
+            conn = postgresql.open(str_conn)
+        except:
+            with self.cond:
+                self.used[db_name] -= 1
+                self.cluster_used[cluster] -= 1
+                self.cond.notify_all()
+            raise
+        with self.cond:
+            self.opened_cnt += 1
+        return conn
+
+    def release(self, db_name, conn, reuse=True):
+        if conn is None:
+            return
+        if reuse and not conn.closed:
+            try:
+                # session variables are configured again by the next phase
+                conn.execute("RESET ALL")
+            except:
+                reuse = False
+        else:
+            reuse = False
+        if not reuse:
+            self.close_conn(conn)
+        with self.cond:
+            self.used[db_name] -= 1
+            if reuse:
+                self.idle.setdefault(db_name, []).append(conn)
+            else:
+                self.cluster_used[self.get_cluster(db_name)] -= 1
+            self.cond.notify_all()
+
+    @staticmethod
+    def close_conn(conn):
+        try:
+            conn.close()
+        except:
+            pass
+
+    def close_all(self):
+        with self.cond:
+            for db_name, conns in self.idle.items():
+                for conn in conns:
+                    self.close_conn(conn)
+                    self.cluster_used[self.get_cluster(db_name)] -= 1
+            self.idle.clear()
@@ -1,12 +1,20 @@
 from psc.psccommon.psc_common import *
 import psc.postgresql as postgresql
+from psc.postgresql.protocol import xact3 as pq_xact, element3 as pq_element
 import threading
 import time
+from collections import deque
 import sqlparse
 import hashlib
 from enum import Enum
 from functools import partial
-from actiontracker import ActionTracker
+from actiontracker import PacketTracker
+from dbccore.governor import ActionGovernor
+from dbccore.progress import ActionProgress
+from dbccore.lockobserver import ClusterObserver
+from dbccore.steptemplate import QueryTemplate, StepTemplate, ActionQuery, parse_query_placeholder
+from dbccore.lockmodes import LOCK_CONFLICTS, get_statement_locks, get_query_locks, get_query_impact, \
+    get_max_impact
 from sqlparse.sql import *
 import csv
 import pyzipper
@@ -27,15 +35,6 @@ class PacketType(BasicEnum, Enum):
     EXPORT_DATA = 'export_data'
 
 
-def parse_query_placeholder(query, gen_i, placeholder):
-    # placeholder is GEN_NSP_FLD_ or GEN_OBJ_FLD_
-    for fld_id, fld in enumerate(dict(gen_i).items()):
-        if fld_id > 0:
-            fld_val = fld[1]
-            query = query.replace(placeholder + str(fld_id), str(fld_val))
-    return query
-
-
 def print_table(table):
     table_text = ""
     col_width = [max(len(str(x)) for x in col) for col in zip(*table)]
@@ -65,13 +64,31 @@ class Context:
         )
 
 
+# notified each time when a thread started by "threaded" is finished
+threads_cond = threading.Condition()
+
+
 def threaded(fn):
     def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
+        def run():
+            try:
+                fn(*args, **kwargs)
+            finally:
+                thread.finished.set()
+                with threads_cond:
+                    threads_cond.notify_all()
+        thread = threading.Thread(target=run)
+        thread.finished = threading.Event()
         thread.start()
         return thread
     return wrapper
 
+
+def is_thread_running(thread):
+    if hasattr(thread, 'finished'):
+        return not thread.finished.is_set()
+    return thread.is_alive()
+
 # def threaded(fn, callback_func):
 #     def wrapper(*args, **kwargs):
 #         def do_callback():
@@ -96,22 +113,61 @@ class ExportResults:
 class DBCCore:
     lock = threading.Lock()
     workers_db_pid = {}     # key is "db_name", value is array of pids
-    worker_threads = {}     # key is "db_name", value is array of threads (one lock_observer and one worker_db_func)
+    worker_threads = {}     # key is "db_name", value is array of threads (worker_db_func), lock observers are
+                            # stored with "lock_observer" key
     workers_status = {}     # key is "db_name", boolean value: True is active, False is finished
+    workers_finished = {}   # key is "db_name", value is threading.Event which is set when worker is finished
     workers_result = {}     # key is "db_name", value is WorkerResult
     db_conns = {}
+    trackers = {}           # key is pid, value is PacketTracker bound to the session
+    conn_manager = None     # DBConnManager: sessions shared by all phases of the run
+    governors = {}          # key is "db_name", value is ActionGovernor if "governor" is set in meta_data.json
+    action_retries = {}     # key is "db_name", value is dict {step_hash: number of retries of interrupted action}
+    progress = {}           # key is "db_name", value is ActionProgress of the running packet
+    lock_observers = {}     # key is cluster name, value is ClusterObserver
+    lock_events = {}        # key is "db_name", value is list of lock waits not yet written to "dbc_lock_events"
+    lock_events_history = []    # all lock waits of the run, summarized at the end of the run
+    pid_actions = {}        # key is pid, value is (step, step_hash, lock impact of step) of the running action
+    lock_probes = {}        # key is pid, value is pair (session, prepared "lock_probe_query")
+    lock_impacts = {}       # key is (packet, step, server_version_num), value is lock impact before PostgreSQL 11
+    lock_retry_params = {
+        "lock_timeout": "1s",       # lock_timeout of the sessions of worker
+        "max_retries": 10,          # retries of action failed by lock_timeout
+        "initial_delay": 0.1,       # seconds, the max delay before the retry is doubled after each retry
+        "max_delay": 10
+    }
+    lock_probe_params = {
+        "max_wait": 60,             # seconds, the statement is executed anyway if there is no clear window
+        "interval": 0.5             # seconds between probes
+    }
+    lock_probe_query = """
+        SELECT
+            l.pid,
+            l.mode,
+            l.granted,
+            t.relation,
+            extract(epoch from clock_timestamp() - a.xact_start)::float8 AS xact_duration
+        FROM unnest($1::text[], $2::text[]) AS t(relation, mode)
+        JOIN pg_locks l ON l.locktype = 'relation'
+            AND l.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+            AND l.relation = to_regclass(t.relation)
+            AND l.mode = t.mode
+        LEFT JOIN pg_stat_activity a ON a.pid = l.pid
+        WHERE l.pid <> ALL($3::integer[])
+    """
     lock_observer_blocker_cnt = 0
+    lock_probe_wait_cnt = 0     # number of statements delayed by conflicting locks
+    lock_observers_cnt = 0  # number of started lock observers, one per cluster at a time
     lock_observer_wait_cnt = 0
     export_results = ExportResults()
 
+    def get_tracker(self, ctx):
+        return self.trackers[ctx.current_pid]
+
     def get_pids(self, db_name):
-        try:
-            if db_name in self.workers_db_pid:
-                yield next(iter(self.workers_db_pid[db_name]))
-            else:
-                return next(iter([]))
-        except StopIteration:
-            return
+        # all pids of the worker: main connection and connections of parallel actions
+        for pid in list(self.workers_db_pid.get(db_name, [])):
+            yield pid
 
     def remove_pid(self, db_name, pid):
         workers_db_pids = [v for v in self.get_pids(db_name)]
@@ -136,11 +192,20 @@ class DBCCore:
         else:
             return None
 
+    def get_worker_finished_event(self, db_name):
+        self.lock.acquire()
+        try:
+            return self.workers_finished.setdefault(db_name, threading.Event())
+        finally:
+            self.lock.release()
+
     def set_worker_status_start(self, db_name):
+        self.get_worker_finished_event(db_name)
         self.workers_status[db_name] = True
 
     def set_worker_status_finish(self, db_name):
         self.workers_status[db_name] = False
+        self.get_worker_finished_event(db_name).set()
 
     def set_worker_result(self, db_name, result):
         self.workers_result[db_name] = result
@@ -152,19 +217,105 @@ class DBCCore:
             conn.interrupt()
         self.lock.release()
 
-    @threaded
-    def lock_observer(self, thread_name, str_conn, db_name, app_name_postfix):
-        def sleep_lo():
-            for i in range(50):
-                if self.get_worker_status(db_name) is True or self.get_worker_status(db_name) is None:
-                    time.sleep(self.sys_conf.lock_observer_sleep_interval/50)
-                    if self.is_terminate:
-                        break
-                if self.get_worker_status(db_name) is False:
-                    break
+    # observed databases of one cluster are served by one lock observer, which is started
+    # by the first database and finished when there are no observed databases
+    # "params" is "lock_observer" section of meta_data.json: {"min_interval": 0.2, "max_interval": 5}
+    def observe_db(self, db_name, str_conn, app_name_postfix, params=None):
+        cluster = self.sys_conf.dbs_clusters.get(db_name, db_name)
+        self.lock.acquire()
+        try:
+            observer = self.lock_observers.get(cluster)
+            if observer is None:
+                params = params if params is not None else {}
+                observer = ClusterObserver(
+                    cluster, db_name, str_conn,
+                    params.get("min_interval", self.sys_conf.lock_observer_min_interval),
+                    params.get("max_interval", self.sys_conf.lock_observer_max_interval)
+                )
+                observer.db_names.add(db_name)
+                self.lock_observers[cluster] = observer
+                self.lock_observers_cnt += 1
+                observer.thread = self.lock_observer("lock_observer_%s" % cluster, observer, app_name_postfix)
+                self.append_thread("lock_observer", observer.thread)
+            observer.db_names.add(db_name)
+        finally:
+            self.lock.release()
+
+    def unobserve_db(self, db_name):
+        cluster = self.sys_conf.dbs_clusters.get(db_name, db_name)
+        self.lock.acquire()
+        try:
+            if cluster in self.lock_observers:
+                self.lock_observers[cluster].db_names.discard(db_name)
+                # wake up immediately if there are no observed databases
+                self.lock_observers[cluster].wakeup.set()
+        finally:
+            self.lock.release()
+
+    # key is pid, value is "db_name" of all observed pids of the cluster,
+    # returns None if there are no observed databases, in that case observer is unregistered
+    def get_observed_pids(self, observer):
+        self.lock.acquire()
+        try:
+            if len(observer.db_names) == 0 or self.is_terminate:
+                if self.lock_observers.get(observer.cluster) is observer:
+                    del self.lock_observers[observer.cluster]
+                return None
+            return {pid: db_name for db_name in observer.db_names for pid in self.get_pids(db_name)}
+        finally:
+            self.lock.release()
+
+    # the next database of the cluster starts the new observer
+    def drop_observer(self, observer):
+        self.lock.acquire()
+        if self.lock_observers.get(observer.cluster) is observer:
+            del self.lock_observers[observer.cluster]
+        self.lock.release()
+
+    def get_lock_event_context(self, pid, observed_pids):
+        step, step_hash, _ = self.pid_actions.get(pid, (None, None, None))
+        return {"db_name": observed_pids.get(pid), "step": step, "step_hash": step_hash}
+
+    # finished lock waits are written to "dbc_lock_events" by the workers of their databases
+    def collect_lock_events(self, observer):
+        events = observer.pop_finished()
+        self.lock.acquire()
+        for event in events:
+            self.lock_events_history.append(event)
+            if event["db_name"] is not None:
+                self.lock_events.setdefault(event["db_name"], []).append(event)
+        self.lock.release()
+
+    # lock waits of the finished worker which are still observed
+    def finish_lock_events(self, db_name):
+        observer = self.lock_observers.get(self.sys_conf.dbs_clusters.get(db_name, db_name))
+        if observer is not None:
+            observer.finish_db(db_name)
+            self.collect_lock_events(observer)
+
+    def flush_lock_events(self, db_name, tracker):
+        self.lock.acquire()
+        events = self.lock_events.pop(db_name, [])
+        self.lock.release()
+        if len(events) == 0:
+            return
+        try:
+            tracker.add_lock_events(events)
+        except:
+            # written by the next call, lock events must not break the deployment
+            self.lock.acquire()
+            self.lock_events[db_name] = events + self.lock_events.get(db_name, [])
+            self.lock.release()
+            self.logger.log(
+                'Exception in "flush_lock_events" for \'%s\' database: \n%s' %
+                (db_name, exception_helper(self.sys_conf.detailed_traceback)),
+                "Error"
+            )
 
+    @threaded
+    def lock_observer(self, thread_name, observer, app_name_postfix):
         self.logger.log(
-            'Thread \'%s\' runned! Observed pids: %s' % (thread_name, str([v for v in self.get_pids(db_name)])),
+            'Thread \'%s\' runned! Observed databases: %s' % (thread_name, str(sorted(observer.db_names))),
             "Info",
             do_print=True
         )
@@ -172,72 +323,56 @@ class DBCCore:
         db_conn = None
         while do_work:
             do_work = False
+            reuse_conn = True
             try:
-                db_conn = postgresql.open(str_conn)
+                db_conn = self.conn_manager.acquire(observer.db_name, observer.str_conn)
                 app_name = self.sys_conf.application_name + "_" + app_name_postfix
                 db_conn.execute("SET application_name = '%s'" % app_name)
+                observer.prepare(db_conn, self.sys_conf.cancel_blocker_tx_timeout, self.sys_conf.cancel_wait_tx_timeout)
 
-                while len([thread for thread in self.get_threads(db_name) if thread.is_alive()]) > 1 \
-                        and self.get_worker_status(db_name) is True and not self.is_terminate:
-                    for pid in self.get_pids(db_name):
-                        # ===========================================================================
-                        # case 1: detect backend activity
-                        pid_is_locker = get_scalar(db_conn, """
-                            SELECT exists(
-                                SELECT 1
-                                FROM pg_locks waiting
-                                JOIN pg_stat_activity waiting_stm ON waiting_stm.pid = waiting.pid
-                                JOIN pg_locks other ON waiting.database = other.database
-                                    AND waiting.relation = other.relation
-                                    OR waiting.transactionid = other.transactionid
-                                JOIN pg_stat_activity other_stm ON other_stm.pid = other.pid
-                                WHERE NOT waiting.granted
-                                    AND waiting.pid <> other.pid
-                                    AND age(clock_timestamp(), waiting_stm.xact_start) > interval %s
-                                    AND other.pid = %d
-                            )""" % (self.sys_conf.cancel_blocker_tx_timeout, pid)
-                        )
-                        if pid_is_locker:
-                            db_conn.execute("SELECT pg_cancel_backend(%d)" % pid)
-                            self.lock.acquire()
-                            if pid in self.get_pids(db_name): self.remove_pid(db_name, pid)
-                            self.lock.release()
+                while True:
+                    observed_pids = self.get_observed_pids(observer)
+                    if observed_pids is None:
+                        self.collect_lock_events(observer)
+                        break
+                    # ===========================================================================
+                    # one query for all observed pids: blockers and backends waiting for heavyweight locks
+                    cancel_pids = observer.check(
+                        observed_pids, lambda pid: self.get_lock_event_context(pid, observed_pids)
+                    )
+                    observer.cancel(cancel_pids)
+                    for pid, reason in cancel_pids:
+                        db_name = observed_pids[pid]
+                        self.lock.acquire()
+                        if pid in self.get_pids(db_name): self.remove_pid(db_name, pid)
+                        self.lock.release()
+                        if reason == 'blocker':
                             self.lock_observer_blocker_cnt += 1
-                            self.logger.log('%s: stopped pid %d as blocker' % (thread_name, pid), "Info")
-                        # ===========================================================================
-                        # case 2: how long to wait for access to relations
-                        any_heavyweight_lock_already = get_scalar(db_conn, """
-                            SELECT exists(
-                                SELECT 1
-                                FROM pg_stat_activity
-                                WHERE datname = current_database()
-                                    AND pid = %d
-                                    AND wait_event is not null
-                                    AND wait_event_type = 'Lock'
-                                    AND pid <> pg_backend_pid()
-                                    AND age(clock_timestamp(), xact_start) > interval %s
-                            )
-                        """ % (pid, self.sys_conf.cancel_wait_tx_timeout))
-                        if any_heavyweight_lock_already:
-                            db_conn.execute("SELECT pg_cancel_backend(%d)" % pid)
-                            self.lock.acquire()
-                            if pid in self.get_pids(db_name): self.remove_pid(db_name, pid)
-                            self.lock.release()
+                            self.logger.log('%s: stopped pid %d of %s as blocker' % (thread_name, pid, db_name), "Info")
+                        else:
                             self.lock_observer_wait_cnt += 1
-                            self.logger.log('%s: stopped pid %d with heavyweight lock' % (thread_name, pid), "Info")
-                        # ===========================================================================
+                            self.logger.log(
+                                '%s: stopped pid %d of %s with heavyweight lock' % (thread_name, pid, db_name), "Info"
+                            )
+                    self.collect_lock_events(observer)
+                    # ===========================================================================
+                    # steps with high lock impact are observed with the min interval
+                    interval = observer.next_interval(
+                        any(self.pid_actions.get(pid, (None, None, None))[2] == 'high' for pid in observed_pids)
+                    )
                     self.logger.log(
-                        '%s: iteration done. Sleep on %d seconds...' %
-                        (thread_name, self.sys_conf.lock_observer_sleep_interval),
+                        '%s: iteration done. Sleep on %s seconds...' % (thread_name, round(interval, 2)),
                         "Info",
                         do_print=True
                     )
                     self.logger.log(
-                        'Thread \'%s\': Observed pids: %s' % (thread_name, str([v for v in self.get_pids(db_name)])),
+                        'Thread \'%s\': Observed pids: %s' % (thread_name, str(sorted(observed_pids.keys()))),
                         "Info",
                         do_print=True
                     )
-                    sleep_lo()
+                    # wake up immediately if observed database is finished
+                    observer.wakeup.wait(interval)
+                    observer.wakeup.clear()
             except (
                     postgresql.exceptions.QueryCanceledError,
                     postgresql.exceptions.AdminShutdownError,
@@ -245,10 +380,10 @@ class DBCCore:
                     postgresql.exceptions.ServerNotReadyError,
                     AttributeError  # AttributeError: 'Statement' object has no attribute '_row_constructor'
             ) as e:
+                reuse_conn = False
                 if self.is_terminate:
                     self.logger.log('Thread %s stopped!' % thread_name, "Error", do_print=True)
-                    if db_conn is not None:
-                        db_conn.close()
+                    self.drop_observer(observer)
                     return
                 do_work = True
                 self.logger.log(
@@ -268,14 +403,19 @@ class DBCCore:
                     do_print=True
                 )
             finally:
-                if db_conn is not None:
-                    db_conn.close()
+                self.conn_manager.release(observer.db_name, db_conn, reuse_conn)
+                db_conn = None
+        self.drop_observer(observer)
         self.logger.log('Thread %s finished!' % thread_name, "Info", do_print=True)
 
-    def apply_placeholders(self, sql):
-        for k, v in self.placeholders.items():
-            sql = sql.replace("DBC_PL_%s" % k, v)
-        return sql
+    def apply_placeholders(self, sql, is_sql=True):
+        if not is_sql:
+            # python steps are not tokenized
+            for k, v in self.placeholders.items():
+                sql = sql.replace("DBC_PL_%s" % k, v)
+            return sql
+        # fields of generators are kept for StepTemplate
+        return QueryTemplate(sql, self.placeholders).render()
 
     def parse_packet(self, packet_name, thread_name):
         step_files = []
@@ -294,7 +434,7 @@ class DBCCore:
                     current_file.close()
 
                     if (step.endswith('.sql') or step.endswith('.py')) and step.find('_gen_') == -1:
-                        step_files.append([step, self.apply_placeholders(file_content)])
+                        step_files.append([step, self.apply_placeholders(file_content, step.endswith('.sql')), None])
                     if step.endswith('.sql') and step.find('_gen_obj') != -1:
                         gen_obj_files[step] = self.apply_placeholders(file_content)
                     if step.endswith('.sql') and step.find('_gen_nsp') != -1:
@@ -326,6 +466,18 @@ class DBCCore:
                         for keyword in [v for v in smt.tokens if v.is_keyword]:
                             tags.append(keyword.value)
                 meta_data_json["tags"] = list(set(tags))
+            # steps with generators are split into statements and classified once, see StepTemplate
+            for step in step_files:
+                if step[1].find("GEN_NSP_FLD_") > -1 or step[1].find("GEN_OBJ_FLD_") > -1:
+                    step[2] = StepTemplate(
+                        step[1], self.is_non_tx_query(step[1]), self.is_rows_query, self.sys_conf.non_tx_ops
+                    )
+            # expected lock impact of each step on PostgreSQL 11+: "high", "medium", "unknown" or "low",
+            # impact on older servers is classified by "get_lock_impact"
+            meta_data_json["lock_impact"] = {
+                step[0]: get_max_impact(get_query_impact(step[1], self.sys_conf.non_tx_ops))
+                for step in step_files if step[0].endswith('.sql')
+            }
             # ========================================================================
 
             step_files = sorted(step_files, key=lambda val: val[0])
@@ -375,6 +527,8 @@ class DBCCore:
                 'Exception in prepare_session: %s. Skip configuring session variables...' % str(e),
                 "Error"
             )
+        if "lock_retry" in meta_data_json:
+            db_local.execute("SET lock_timeout = '%s'" % self.get_lock_retry_params(meta_data_json)["lock_timeout"])
 
     @threaded
     def worker_db_func(self, thread_name, db_conn_str, db_name, packet_name, read_only):
@@ -386,7 +540,7 @@ class DBCCore:
         )
         self.set_worker_status_start(db_name)
 
-        step_files = []         # vector of pairs [step, sql]
+        step_files = []         # vector of triples [step, sql, StepTemplate or None]
         gen_obj_files = {}      # dict with generators of objects
         gen_nsp_files = {}      # dict with generators of schemas
         steps_hashes = {}       # temporary storage for executed steps
@@ -400,12 +554,26 @@ class DBCCore:
             meta_data,\
             meta_data_json = self.parse_packet(packet_name, thread_name)
 
+        if "governor" in meta_data_json and not read_only:
+            self.governors[db_name] = ActionGovernor(
+                meta_data_json["governor"],
+                self.conn_manager,
+                db_name,
+                db_conn_str,
+                self.logger,
+                lambda: self.is_terminate
+            )
+
         do_work = True
         work_breaked = False
         db_local = None
+        tracker = None
         current_pid = None
         exception_descr = None
         th_result = False
+        # lock waits are written to the tracker as actions of packet
+        track_lock_events = not read_only and meta_data_json["type"] == PacketType.DEFAULT.value and \
+            self.sys_conf.execute_sql
 
         while do_work:
             do_work = False
@@ -419,7 +587,7 @@ class DBCCore:
                             self.append_pid(db_name, current_pid)
                     except:
                         self.logger.log("%s: Connection to DB is broken" % thread_name, "Error")
-                        db_local.close()
+                        self.conn_manager.release(db_name, db_local, reuse=False)
                         db_local = None     # needs reconnect
 
                 # ======================================================
@@ -427,9 +595,11 @@ class DBCCore:
                 if db_local is None:
                     if current_pid is not None and current_pid in self.get_pids(db_name):
                         self.remove_pid(db_name, current_pid)
+                    self.trackers.pop(current_pid, None)
+                    self.lock_probes.pop(current_pid, None)
 
                     self.logger.log("Thread '%s': connecting to '%s' database..." % (thread_name, db_name), "Info")
-                    db_local = postgresql.open(db_conn_str)
+                    db_local = self.conn_manager.acquire(db_name, db_conn_str)
                     db_local.execute(
                         "SET application_name = '%s'" %
                         (self.sys_conf.application_name + "_" + os.path.splitext(packet_name)[0])
@@ -439,6 +609,10 @@ class DBCCore:
 
                     current_pid = get_scalar(db_local, "SELECT pg_backend_pid()")
                     self.db_conns[current_pid] = db_local
+                    tracker = PacketTracker(
+                        db_local, self.sys_conf.schema_location, packet_name, packet_hash, meta_data
+                    )
+                    self.trackers[current_pid] = tracker
                     self.append_pid(db_name, current_pid)
                     self.logger.log(
                         "Thread '%s': connected to '%s' database with pid %d" %
@@ -447,9 +621,7 @@ class DBCCore:
                     )
                 # ======================================================
                 if not self.args.force and not read_only:
-                    packet_status = ActionTracker.get_packet_status(
-                        db_local, self.sys_conf.schema_location, packet_name
-                    )
+                    packet_status = tracker.get_packet_status()
                     if "hash" in packet_status:
                         if packet_status["hash"] != packet_hash:
                             do_work = False
@@ -469,7 +641,10 @@ class DBCCore:
                         if run_once and step[0] == 'run_once.sql' or run_once is False:
                             ctx = Context(db_name, thread_name, current_pid, packet_name,
                                           packet_hash, meta_data, meta_data_json, step)
-                            progress = str(round(float(num) * 100 / len(step_files), 2)) + "%"
+                            if db_name in self.progress:
+                                progress = self.progress[db_name].describe()
+                            else:
+                                progress = str(round(float(num) * 100 / len(step_files), 2)) + "%"
                             self.logger.log(
                                 '%s: progress %s' % (ctx.info(), progress),
                                 "Info",
@@ -491,6 +666,8 @@ class DBCCore:
                                     gen_obj_data,
                                     steps_hashes
                                 )
+                            if track_lock_events:
+                                self.flush_lock_events(db_name, tracker)
                             if result == 'exception' and exception_descr in ('connection', 'deadlock_detected'):
                                 # transaction cancelled or connection stopped
                                 time.sleep(self.sys_conf.conn_exception_sleep_interval)
@@ -503,26 +680,16 @@ class DBCCore:
                                     do_print=True
                                 )
                                 if not read_only:
-                                    ActionTracker.set_step_exception_status(
-                                        db_local,
-                                        self.sys_conf.schema_location,
-                                        packet_name,
-                                        step[0],
-                                        exception_descr
-                                    )
+                                    tracker.set_step_exception_status(step[0], exception_descr)
                             if result == 'done' and exception_descr is None:
                                 # step successfully complete
                                 if not read_only:
-                                    ActionTracker.set_step_status(
-                                        db_local, self.sys_conf.schema_location, packet_name, step[0], result
-                                    )
+                                    tracker.set_step_status(step[0], result)
                             if result == 'exception' and exception_descr is not None and \
                                     exception_descr not in('connection', 'skip_step'):
                                 # syntax exception or pre/post check raised exception
                                 if not read_only:
-                                    ActionTracker.set_step_exception_status(
-                                        db_local, self.sys_conf.schema_location, packet_name, step[0], exception_descr
-                                    )
+                                    tracker.set_step_exception_status(step[0], exception_descr)
                                 return result, exception_descr, False
                             if result == 'terminate':
                                 return 'terminate', None, False
@@ -540,6 +707,14 @@ class DBCCore:
                 for step, query in gen_nsp_files.items():
                     gen_nsp_data[step.replace("_gen_nsp", "_step")] = get_resultset(db_local, query)
 
+                actions_total = self.count_actions(step_files, gen_nsp_data, gen_obj_data, meta_data_json)
+                done_actions = 0
+                if not read_only and meta_data_json["type"] == PacketType.DEFAULT.value and \
+                        self.sys_conf.execute_sql:
+                    tracker.set_actions_total(actions_total)
+                    done_actions = tracker.get_done_actions_count()
+                self.progress[db_name] = ActionProgress(actions_total, done_actions)
+
                 th_result, exception_descr, do_work = steps_processing()
                 # ===========================================================================
             except (
@@ -582,28 +757,34 @@ class DBCCore:
                       (thread_name, current_pid, packet_name, exception_descr)
                 self.logger.log(msg, "Error", do_print=True)
 
+        self.finish_lock_events(db_name)
+        if track_lock_events and tracker is not None and not self.is_terminate:
+            self.flush_lock_events(db_name, tracker)
+
         if not work_breaked and self.errors_count == 0:
             if not read_only:
-                ActionTracker.set_packet_status(
-                    db_local,
-                    self.sys_conf.schema_location,
-                    packet_name,
-                    'done' if exception_descr is None else 'exception'
-                )
+                tracker.set_packet_status('done' if exception_descr is None else 'exception')
 
         if not work_breaked and self.errors_count > 0:
             if not read_only:
-                ActionTracker.set_packet_status(db_local, self.sys_conf.schema_location, packet_name, 'exception')
+                tracker.set_packet_status('exception')
             self.set_worker_result(db_name, WorkerResult.FAIL)
 
-        if db_local is not None:
-            db_local.close()
+        if db_name in self.governors:
+            self.governors.pop(db_name).close()
+        self.progress.pop(db_name, None)
 
         self.lock.acquire()
         if current_pid is not None and current_pid in self.get_pids(db_name):
             self.remove_pid(db_name, current_pid)
+        self.db_conns.pop(current_pid, None)
+        self.trackers.pop(current_pid, None)
+        self.lock_probes.pop(current_pid, None)
         self.lock.release()
 
+        # interrupted session is not reused
+        self.conn_manager.release(db_name, db_local, reuse=not self.is_terminate)
+
         self.logger.log("Finished '%s' thread for '%s' database" % (thread_name, db_name), "Info")
         if exception_descr is None and th_result is True and self.errors_count == 0:
             self.set_worker_result(db_name, WorkerResult.SUCCESS)
@@ -828,8 +1009,20 @@ class DBCCore:
         # if statement(s) is not SELECT or mixed: INSERT, ALTER, etc... return False
         return stms_is_export
 
-    def execute_q(self, ctx, conn, query, isolation_level="READ COMMITTED", read_only=False):
+    @staticmethod
+    def is_rows_query(stm):
+        parsed = sqlparse.parse(stm)
+        if len(parsed) > 0 and parsed[0].get_type() == 'SELECT':
+            return True
+        return stm.upper().find("RETURNING") > -1
+
+    # "track_query" is executed in the same transaction as "query": tracked action and its row in "dbc_actions"
+    # are committed together. If "query" doesn't return rows, all statements are sent by one simple query
+    # which is executed by server as one implicit transaction: one round trip and one commit per action.
+    # Returns the number of rows processed by "query" according to command tags, None if unknown
+    def execute_q(self, ctx, conn, query, isolation_level="READ COMMITTED", read_only=False, track_query=None):
         results = []
+        row_counts = []
 
         if "client_min_messages" in ctx.meta_data_json:
             # conn.execute("set client_min_messages = 'NOTICE'")
@@ -842,14 +1035,34 @@ class DBCCore:
                 return True
 
         conn.msghook = partial(filter_notices, msgs_list=results)
-        conn.execute('RESET search_path')
 
         try:
-            if self.is_non_tx_query(query):
+            if isinstance(query, ActionQuery):
+                # action of the step with generators is already split and classified, see StepTemplate
+                non_tx, stms, returns_rows = query.non_tx, query.stms, query.returns_rows
+                query = query.text
+            else:
+                non_tx = self.is_non_tx_query(query)
+                stms = [] if non_tx else sqlparse.split(query)
+                returns_rows = None
+            if track_query is not None and len(stms) > 0 and \
+                    ctx.meta_data_json['type'] == PacketType.DEFAULT.value and \
+                    isolation_level == "READ COMMITTED" and not read_only and \
+                    not (any(self.is_rows_query(stm) for stm in stms) if returns_rows is None else returns_rows):
+                # command tags of "RESET" and "track_query" are skipped
+                batch = "\n;\n".join(['RESET search_path'] + stms + [track_query])
+                for res in self.execute_commands(conn, batch)[1:-1]:
+                    results.append(res)
+                    row_counts.append(res[1])
+                    self.logger.log('%s' % str(res), "Info", do_print=True)
+            elif non_tx:
+                conn.execute('RESET search_path')
                 self.logger.log("%s Executing as maintenance query:\n%s" % (ctx.info(), query), "Info", do_print=True)
                 conn.execute(query)
+                if track_query is not None:
+                    conn.execute(track_query)
             else:
-                stms = sqlparse.split(query)
+                conn.execute('RESET search_path')
                 stms_is_export = False
                 if ctx.meta_data_json['type'] == PacketType.EXPORT_DATA.value:
                     stms_is_export = self.export_data(ctx, conn, stms)
@@ -863,6 +1076,10 @@ class DBCCore:
                             prepared = conn.prepare(stm)
                             res = prepared()
                             results.append(res)
+                            if isinstance(res, tuple):
+                                row_counts.append(res[1])
+                            if isinstance(res, list):
+                                row_counts.append(len(res))
                             # ===============================================================================
                             # output to stdout
                             if isinstance(res, tuple):
@@ -886,6 +1103,8 @@ class DBCCore:
                             if ctx.meta_data_json["type"] == PacketType.NO_COMMIT.value:
                                 self.logger.log("%s: Performing rollback..." % (ctx.info()), "Info")
                                 xact.rollback()
+                        if track_query is not None:
+                            conn.execute(track_query)
         except (
                 postgresql.exceptions.OperationError,
                 postgresql.exceptions.ReadOnlyTransactionError
@@ -901,6 +1120,430 @@ class DBCCore:
         self.result_data.setdefault(ctx.db_name, {})
         self.result_data[ctx.db_name].update({ctx.step[0]: results})
         self.resultset_hook(ctx, results)
+        row_counts = [cnt for cnt in row_counts if cnt is not None]
+        return sum(row_counts) if len(row_counts) > 0 else None
+
+    @staticmethod
+    def execute_commands(conn, query):
+        """
+        Statements of "query" are sent in one round trip by the simple query protocol, as by "conn.execute",
+        and the pairs (command, count) of their command tags are returned: "conn.execute" drops the tags.
+        The messages are exchanged by the same internals of the bundled py-postgresql as in "execute".
+        """
+        instruction = pq_xact.Instruction(
+            (pq_element.Query(conn.typio._encode(query)[0]),),
+            asynchook=conn._receive_async
+        )
+        conn._pq_push(instruction, conn)
+        conn._pq_complete()
+        return [
+            (msg.extract_command().decode('ascii'), msg.extract_count())
+            for _, msgs in instruction.completed
+            for msg in msgs if getattr(msg, 'type', None) == pq_element.Complete.type
+        ]
+
+    def get_lock_retry_params(self, meta_data_json):
+        params = dict(self.lock_retry_params)
+        params.update(meta_data_json["lock_retry"])
+        return params
+
+    def execute_action_q(self, ctx, conn, query, step_hash=None, track_query=None):
+        # lock waits observed on the session are attributed to the running action
+        self.pid_actions[ctx.current_pid] = (ctx.step[0], step_hash, self.get_lock_impact(ctx, conn))
+        try:
+            return self.execute_lock_retry_q(ctx, conn, query, step_hash, track_query)
+        finally:
+            self.pid_actions.pop(ctx.current_pid, None)
+
+    @staticmethod
+    def get_server_version_num(conn):
+        # as "server_version_num" setting: 90605 for 9.6.5, 110002 for 11.2
+        major, minor, patch = conn.version_info[:3]
+        return major * 10000 + (minor * 100 + patch if major < 10 else minor)
+
+    def get_lock_impact(self, ctx, conn):
+        # "lock_impact" of meta_data.json is classified for PostgreSQL 11+, see "parse_packet"
+        lock_impact = ctx.meta_data_json.get("lock_impact", {}).get(ctx.step[0])
+        server_version_num = self.get_server_version_num(conn)
+        if lock_impact is None or server_version_num >= 110000:
+            return lock_impact
+        key = (ctx.packet_name, ctx.step[0], server_version_num)
+        if key not in self.lock_impacts:
+            self.lock_impacts[key] = get_max_impact(
+                get_query_impact(ctx.step[1], self.sys_conf.non_tx_ops, server_version_num)
+            )
+        return self.lock_impacts[key]
+
+    def execute_probed_q(self, ctx, conn, query, track_query=None):
+        if "lock_probe" in ctx.meta_data_json:
+            self.wait_lock_window(ctx, conn, query)
+        return self.execute_q(ctx, conn, query, track_query=track_query)
+
+    def get_lock_probe_params(self, meta_data_json):
+        params = dict(self.lock_probe_params)
+        params.update(meta_data_json["lock_probe"])
+        return params
+
+    # "lock_probe_query" is prepared once per session
+    def get_lock_probe(self, ctx, conn):
+        session, probe = self.lock_probes.get(ctx.current_pid, (None, None))
+        if session is not conn:
+            probe = conn.prepare(self.lock_probe_query)
+            self.lock_probes[ctx.current_pid] = (conn, probe)
+        return probe
+
+    # "lock_probe" mode of packet: before DDL the relations of the statements are checked for the locks
+    # held or awaited by other sessions in the conflicting modes, the statement is executed when there are
+    # no such locks instead of waiting in the lock queue and blocking the traffic behind it
+    def wait_lock_window(self, ctx, conn, query):
+        if isinstance(query, ActionQuery) and not query.non_tx:
+            targets = [target for stm in query.stms for target in get_statement_locks(stm)]
+        else:
+            targets = get_query_locks(str(query))
+        if len(targets) == 0:
+            return
+        params = self.get_lock_probe_params(ctx.meta_data_json)
+        relations = []
+        modes = []
+        for relation, mode in targets:
+            for conflicting_mode in LOCK_CONFLICTS[mode]:
+                relations.append(relation)
+                modes.append(conflicting_mode)
+        probe = self.get_lock_probe(ctx, conn)
+        start_time = time.time()
+        waited = False
+        while not self.is_terminate:
+            own_pids = list(self.get_pids(ctx.db_name)) + [ctx.current_pid]
+            holders = probe(relations, modes, own_pids)
+            if len(holders) == 0:
+                if waited:
+                    self.logger.log(
+                        "%s: locks are released after %.2f sec" % (ctx.info(), time.time() - start_time),
+                        "Info",
+                        do_print=True
+                    )
+                break
+            if time.time() - start_time >= float(params["max_wait"]):
+                self.logger.log(
+                    "%s: conflicting locks are held for %.2f sec, executing anyway" %
+                    (ctx.info(), time.time() - start_time),
+                    "Error",
+                    do_print=True
+                )
+                break
+            if not waited:
+                waited = True
+                self.lock_probe_wait_cnt += 1
+                self.logger.log(
+                    "%s: waiting for conflicting locks: %s" % (
+                        ctx.info(),
+                        ", ".join(
+                            "pid %d %s %s on %s (transaction %s sec)" % (
+                                pid, "holds" if granted else "waits for", mode, relation,
+                                "-" if xact_duration is None else "%.2f" % xact_duration
+                            ) for pid, mode, granted, relation, xact_duration in holders
+                        )
+                    ),
+                    "Info",
+                    do_print=True
+                )
+            wait_until = time.time() + float(params["interval"])
+            while time.time() < wait_until and not self.is_terminate:
+                time.sleep(min(0.1, max(wait_until - time.time(), 0)))
+
+    # "lock_retry" mode of packet: the action failed by "lock_timeout" is executed again on the same session
+    # after exponential backoff with jitter, so short DDL leaves the lock queue quickly instead of waiting
+    # for cancellation by the lock observer, reconnect and restart of the step
+    def execute_lock_retry_q(self, ctx, conn, query, step_hash=None, track_query=None):
+        if "lock_retry" not in ctx.meta_data_json:
+            return self.execute_probed_q(ctx, conn, query, track_query)
+        params = self.get_lock_retry_params(ctx.meta_data_json)
+        retry_num = 0
+        while True:
+            try:
+                return self.execute_probed_q(ctx, conn, query, track_query)
+            except postgresql.exceptions.UnavailableLockError:
+                if retry_num >= int(params["max_retries"]) or self.is_terminate:
+                    raise
+                delay = random.uniform(
+                    0, min(float(params["initial_delay"]) * 2 ** retry_num, float(params["max_delay"]))
+                )
+                retry_num += 1
+                if step_hash is not None:
+                    retries = self.action_retries.setdefault(ctx.db_name, {})
+                    retries[step_hash] = retries.get(step_hash, 0) + 1
+                self.logger.log(
+                    "%s: lock timeout, retry %d of %d after %.2f sec" %
+                    (ctx.info(), retry_num, int(params["max_retries"]), delay),
+                    "Info"
+                )
+                wait_until = time.time() + delay
+                while time.time() < wait_until and not self.is_terminate:
+                    time.sleep(min(0.1, max(wait_until - time.time(), 0)))
+
+    # telemetry of finished action: start time, duration, rows and retries, see PacketTracker.add_action_stats
+    def track_action_stats(self, ctx, step_hash, started, row_count):
+        try:
+            self.get_tracker(ctx).add_action_stats(
+                ctx.step[0], step_hash, started, time.time() - started, row_count,
+                self.action_retries.get(ctx.db_name, {}).get(step_hash, 0)
+            )
+        except:
+            # telemetry must not break the deployment
+            self.logger.log(
+                '%s: Exception in "track_action_stats": \n%s' %
+                (ctx.info(), exception_helper(self.sys_conf.detailed_traceback)),
+                "Error"
+            )
+
+    def flush_action_stats(self, ctx):
+        try:
+            self.get_tracker(ctx).flush_stats()
+        except:
+            self.logger.log(
+                '%s: Exception in "flush_action_stats": \n%s' %
+                (ctx.info(), exception_helper(self.sys_conf.detailed_traceback)),
+                "Error"
+            )
+
+    # number of actions of packet used by progress: generated actions and steps without generators,
+    # actions of chunked steps are not known in advance and are not counted
+    @staticmethod
+    def count_actions(step_files, gen_nsp_data, gen_obj_data, meta_data_json):
+        actions_total = 0
+        for step_name, query, _ in step_files:
+            if step_name in meta_data_json.get("chunks", {}):
+                continue
+            is_nsp = query.find("GEN_NSP_FLD_") > -1
+            is_obj = query.find("GEN_OBJ_FLD_") > -1
+            if is_nsp and is_obj:
+                actions_total += len(gen_nsp_data.get(step_name, [])) * len(gen_obj_data.get(step_name, []))
+            elif is_obj:
+                actions_total += len(gen_obj_data.get(step_name, []))
+            elif is_nsp:
+                actions_total += len(gen_nsp_data.get(step_name, []))
+            else:
+                actions_total += 1
+        return actions_total
+
+    def track_progress(self, ctx):
+        if ctx.db_name not in self.progress:
+            return
+        progress = self.progress[ctx.db_name]
+        progress.add()
+        if progress.is_due(self.sys_conf.progress_log_interval):
+            self.logger.log('%s: progress %s' % (ctx.info(), progress.describe()), "Info", do_print=True)
+
+    # adaptive delay between generator actions, see ActionGovernor
+    def throttle_action(self, ctx):
+        if ctx.db_name in self.governors and self.sys_conf.execute_sql:
+            self.governors[ctx.db_name].throttle()
+
+    # chunked step: the range of integer "key" of "table" is split into chunks GEN_CHUNK_START..GEN_CHUNK_END,
+    # the size of chunk is adapted to keep the duration of action close to "target_duration"
+    def execute_chunked_step(self, ctx, db_local, steps_hashes, enable_at, step_state):
+        params = {
+            "initial_size": 10000,
+            "min_size": 100,
+            "max_size": 10000000,
+            "target_duration": 1        # seconds
+        }
+        params.update(ctx.meta_data_json["chunks"][ctx.step[0]])
+        for param in ("table", "key"):
+            if param not in params:
+                raise Exception('%s: parameter "%s" of chunked step is not specified' % (ctx.info(), param))
+
+        key_min, key_max = get_resultset(
+            db_local, "SELECT min(%s), max(%s) FROM %s" % (params["key"], params["key"], params["table"])
+        )[0]
+        if key_min is None:
+            self.logger.log("%s: table %s is empty, nothing to do" % (ctx.info(), params["table"]), "Info")
+            return
+
+        chunk_start = key_min
+        if enable_at:
+            chunk_end = self.get_tracker(ctx).get_chunk_end(ctx.step[0])
+            if chunk_end is not None:
+                chunk_start = max(chunk_start, chunk_end + 1)
+                self.logger.log("%s: resuming from key %d" % (ctx.info(), chunk_start), "Info")
+        if "skip_to" in step_state:
+            chunk_start = max(chunk_start, step_state["skip_to"])
+
+        chunk_size = step_state.get("size", int(params["initial_size"]))
+        if enable_at and self.sys_conf.execute_sql and chunk_start <= key_max:
+            self.get_tracker(ctx).begin_action(ctx.step[0])
+        while chunk_start <= key_max:
+            chunk_end = chunk_start + chunk_size - 1
+            gen_query = ctx.step[1].replace("GEN_CHUNK_START", str(chunk_start)).replace(
+                "GEN_CHUNK_END", str(chunk_end)
+            )
+            step_hash = hashlib.md5(gen_query.encode()).hexdigest()
+            step_state["hash"] = step_hash
+            step_state["range"] = (chunk_start, chunk_end)
+
+            self.throttle_action(ctx)
+            if self.sys_conf.log_sql == 1:
+                self.logger.log("%s:\n%s" % (ctx.info(), gen_query), "Info")
+            if self.sys_conf.execute_sql:
+                start_time = time.time()
+                row_count = self.execute_action_q(
+                    ctx, db_local, gen_query, step_hash,
+                    track_query=self.get_tracker(ctx).get_apply_action_query(
+                        ctx.step[0], step_hash, chunk_end
+                    ) if enable_at else None
+                )
+                duration = time.time() - start_time
+                if enable_at:
+                    self.track_action_stats(ctx, step_hash, start_time, row_count)
+                steps_hashes[step_hash] = ctx.step[0]
+                # grow or shrink the chunk, but not more than twice at once
+                factor = min(max(float(params["target_duration"]) / max(duration, 0.001), 0.5), 2)
+                chunk_size = min(
+                    max(int(chunk_size * factor), int(params["min_size"])), int(params["max_size"])
+                )
+                step_state["size"] = chunk_size
+                self.logger.log(
+                    "%s: chunk %d..%d finished in %.3f sec, next chunk size %d" %
+                    (ctx.info(), chunk_start, chunk_end, duration, chunk_size),
+                    "Info"
+                )
+            chunk_start = chunk_end + 1
+        step_state.pop("range", None)
+        step_state.pop("hash", None)
+        if enable_at and self.sys_conf.execute_sql:
+            self.flush_action_stats(ctx)
+
+    # action is a tuple (maintenance queries, generated query, hash of generated query)
+    def execute_action(self, ctx, conn, action, steps_hashes, enable_at):
+        maint_queries, gen_query, step_hash = action
+        self.throttle_action(ctx)
+        # ========================================================================
+        for maint_query in maint_queries:   # run maintenance command
+            if self.sys_conf.log_sql == 1:
+                self.logger.log("%s:\n%s" % (ctx.info(), maint_query), "Info")
+            if self.sys_conf.execute_sql:
+                self.execute_action_q(ctx, conn, maint_query)
+        # ========================================================================
+        if self.sys_conf.log_sql == 1:
+            self.logger.log("%s:\n%s" % (ctx.info(), gen_query), "Info")
+        if self.sys_conf.execute_sql:
+            # packet and step are registered by "execute_actions" before the first action
+            start_time = time.time()
+            row_count = self.execute_action_q(
+                ctx, conn, gen_query, step_hash,
+                track_query=self.get_tracker(ctx).get_apply_action_query(
+                    ctx.step[0], step_hash
+                ) if enable_at else None
+            )
+            if enable_at:
+                self.track_action_stats(ctx, step_hash, start_time, row_count)
+            steps_hashes[step_hash] = ctx.step[0]
+            self.logger.log("%s: action finished" % (ctx.info()), "Info")
+            self.track_progress(ctx)
+
+    # actions of the step are executed by "parallelism" connections: the main connection of the worker
+    # and "parallelism - 1" additional connections, the first exception stops all connections
+    def execute_actions(self, ctx, db_local, actions, steps_hashes, enable_at, step_state):
+        parallelism = min(int(ctx.meta_data_json.get("parallelism", {}).get(ctx.step[0], 1)), len(actions))
+        free_conns = self.conn_manager.free_conns(ctx.db_name)
+        if parallelism > 1 and free_conns is not None:
+            # additional connections must not wait for the sessions of worker, lock observer and governor
+            if ctx.db_name in self.governors and self.governors[ctx.db_name].conn is None:
+                free_conns -= 1
+            if parallelism - 1 > free_conns:
+                self.logger.log(
+                    "%s: parallelism is limited to %d by max_conns_per_db and max_conns_per_cluster" %
+                    (ctx.info(), max(free_conns, 0) + 1),
+                    "Info",
+                    do_print=True
+                )
+                parallelism = max(free_conns, 0) + 1
+        if enable_at and self.sys_conf.execute_sql:
+            # packet and step are registered once before the actions, this also avoids
+            # duplicates in "dbc_steps" in case of parallel actions
+            self.get_tracker(ctx).begin_action(ctx.step[0])
+        if parallelism <= 1 or not self.sys_conf.execute_sql:
+            for action in actions:
+                step_state["hash"] = action[2]
+                self.execute_action(ctx, db_local, action, steps_hashes, enable_at)
+            step_state.pop("hash", None)
+            if enable_at and self.sys_conf.execute_sql:
+                self.flush_action_stats(ctx)
+            return
+
+        self.logger.log(
+            "%s: %d actions are executed by %d connections" % (ctx.info(), len(actions), parallelism),
+            "Info",
+            do_print=True
+        )
+        actions_queue = deque(actions)
+        errors = []     # pairs (exception, hash of action)
+        threads = [
+            self.parallel_actions_worker(
+                "%s_action_%d" % (ctx.thread_name, num), ctx, actions_queue, steps_hashes, enable_at, errors
+            ) for num in range(1, parallelism)
+        ]
+        self.execute_actions_queue(ctx, db_local, actions_queue, steps_hashes, enable_at, errors)
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            if errors[0][1] is not None:
+                step_state["hash"] = errors[0][1]
+            raise errors[0][0]
+
+    def execute_actions_queue(self, ctx, conn, actions_queue, steps_hashes, enable_at, errors):
+        while len(errors) == 0 and not self.is_terminate:
+            try:
+                action = actions_queue.popleft()
+            except IndexError:
+                break
+            try:
+                self.execute_action(ctx, conn, action, steps_hashes, enable_at)
+            except Exception as e:
+                errors.append((e, action[2]))
+        if enable_at and len(errors) == 0:
+            self.flush_action_stats(ctx)
+
+    @threaded
+    def parallel_actions_worker(self, thread_name, ctx, actions_queue, steps_hashes, enable_at, errors):
+        conn = None
+        pid = None
+        try:
+            conn = self.conn_manager.acquire(ctx.db_name, self.sys_conf.dbs_dict[ctx.db_name])
+            conn.execute(
+                "SET application_name = '%s'" %
+                (self.sys_conf.application_name + "_" + os.path.splitext(ctx.packet_name)[0])
+            )
+            self.prepare_session(conn, ctx.meta_data_json)
+            pid = get_scalar(conn, "SELECT pg_backend_pid()")
+            self.lock.acquire()
+            self.db_conns[pid] = conn
+            self.trackers[pid] = PacketTracker(
+                conn, self.sys_conf.schema_location, ctx.packet_name, ctx.packet_hash, ctx.meta_data
+            )
+            self.append_pid(ctx.db_name, pid)
+            self.lock.release()
+
+            worker_ctx = Context(
+                ctx.db_name, thread_name, pid, ctx.packet_name, ctx.packet_hash, ctx.meta_data, ctx.meta_data_json,
+                ctx.step
+            )
+            self.logger.log(
+                "Thread '%s': connected to '%s' database with pid %d" % (thread_name, ctx.db_name, pid),
+                "Info"
+            )
+            self.execute_actions_queue(worker_ctx, conn, actions_queue, steps_hashes, enable_at, errors)
+        except Exception as e:
+            errors.append((e, None))
+        finally:
+            self.lock.acquire()
+            if pid is not None and pid in self.get_pids(ctx.db_name):
+                self.remove_pid(ctx.db_name, pid)
+            self.db_conns.pop(pid, None)
+            self.trackers.pop(pid, None)
+            self.lock_probes.pop(pid, None)
+            self.lock.release()
+            self.conn_manager.release(ctx.db_name, conn, reuse=len(errors) == 0 and not self.is_terminate)
 
     def execute_step(
             self,
@@ -914,80 +1557,50 @@ class DBCCore:
         step_hash = None
         execute_step_do_work = True
         enable_at = True if ctx.meta_data_json["type"] == PacketType.DEFAULT.value else False
+        is_chunked = ctx.step[0] in ctx.meta_data_json.get("chunks", {})
+        step_state = {}
 
         while execute_step_do_work:
             execute_step_do_work = False
             try:
+                # completed actions of the step are loaded once when the step starts or resumes
+                done_hashes = self.get_tracker(ctx).get_action_hashes(ctx.step[0]) \
+                    if enable_at and not is_chunked else set()
+                # case 0: chunked step
+                if is_chunked:
+                    self.execute_chunked_step(ctx, db_local, steps_hashes, enable_at, step_state)
                 # case 1: both generators is exists
+                actions = []    # see execute_actions
+                planned_hashes = set()
                 if ctx.step[1].find("GEN_NSP_FLD_") > -1 and ctx.step[1].find("GEN_OBJ_FLD_") > -1:
                     if ctx.step[0] not in gen_obj_data:
-                        self.logger.log(
-                            "%s: not found generator for this step, but GEN_OBJ_FLD_ is exists" % (ctx.info()),
-                            "Error"
-                        )
+                        msg = "%s: not found generator for this step, but GEN_OBJ_FLD_ is exists" % (ctx.info())
+                        self.logger.log(msg, "Error")
                         raise Exception(msg)
                     if ctx.step[0] not in gen_nsp_data:
-                        self.logger.log(
-                            "%s: not found generator for this step, but GEN_NSP_FLD_ is exists" % (ctx.info()),
-                            "Error"
-                        )
+                        msg = "%s: not found generator for this step, but GEN_NSP_FLD_ is exists" % (ctx.info())
+                        self.logger.log(msg, "Error")
                         raise Exception(msg)
                     for gen_nsp_i in gen_nsp_data[ctx.step[0]]:  # namespace generators have a major priority
                         for gen_obj_i in gen_obj_data[ctx.step[0]]:  # object generators have a minor priority
-                            gen_query = parse_query_placeholder(
-                                parse_query_placeholder(ctx.step[1], gen_nsp_i, 'GEN_NSP_FLD_'),
-                                gen_obj_i, 'GEN_OBJ_FLD_'
-                            )
-                            step_hash = hashlib.md5(gen_query.encode()).hexdigest()
-                            if step_hash in steps_hashes:
+                            gen_query = ctx.step[2].render(gen_nsp_i, gen_obj_i)
+                            step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
+                            if step_hash in steps_hashes or step_hash in planned_hashes:
                                 continue
-                            if enable_at and ActionTracker.is_action_exists(
-                                    db_local, self.sys_conf.schema_location, ctx.packet_name, ctx.step[0], step_hash
-                            ):
+                            if step_hash in done_hashes:
                                 steps_hashes[step_hash] = ctx.step[0]
                                 self.logger.log(
                                     "%s: action already executed with hash %s" % (ctx.info(), step_hash),
                                     "Info"
                                 )
                             else:
-                                # ========================================================================
+                                maint_queries = []
                                 if gen_nsp_i[0] is not None and len(str(gen_nsp_i[0])) > 0:  # run maintenance command
-                                    if self.sys_conf.log_sql == 1:
-                                        self.logger.log("%s:\n%s" % (ctx.info(), gen_nsp_i[0]), "Info")
-                                    if self.sys_conf.execute_sql:
-                                        self.execute_q(ctx, db_local, gen_nsp_i[0])
-
+                                    maint_queries.append(gen_nsp_i[0])
                                 if gen_obj_i[0] is not None and len(str(gen_obj_i[0])) > 0:  # run maintenance command
-                                    gen_obj_i_query = parse_query_placeholder(gen_obj_i[0], gen_nsp_i, 'GEN_NSP_FLD_')
-                                    if self.sys_conf.log_sql == 1:
-                                        self.logger.log("%s:\n%s" % (ctx.info(), gen_obj_i_query), "Info")
-                                    if self.sys_conf.execute_sql:
-                                        self.execute_q(ctx, db_local, gen_obj_i_query)
-                                # ========================================================================
-                                if self.sys_conf.log_sql == 1:
-                                    self.logger.log("%s:\n%s" % (ctx.info(), gen_query), "Info")
-                                if self.sys_conf.execute_sql:
-                                    if enable_at:
-                                        ActionTracker.begin_action(
-                                            db_local,
-                                            self.sys_conf.schema_location,
-                                            ctx.packet_name,
-                                            ctx.packet_hash,
-                                            ctx.step[0],
-                                            ctx.meta_data
-                                        )
-                                    self.execute_q(ctx, db_local, gen_query)
-                                    if enable_at:
-                                        ActionTracker.apply_action(
-                                            db_local,
-                                            self.sys_conf.schema_location,
-                                            ctx.packet_name,
-                                            ctx.step[0],
-                                            step_hash
-                                        )
-                                    steps_hashes[step_hash] = ctx.step[0]
-                                    self.logger.log("%s: action finished" % (ctx.info()), "Info")
-                                # ========================================================================
+                                    maint_queries.append(parse_query_placeholder(gen_obj_i[0], gen_nsp_i, 'GEN_NSP_FLD_'))
+                                actions.append((maint_queries, gen_query, step_hash))
+                                planned_hashes.add(step_hash)
                 # case 2: only OBJ generator is exists
                 if ctx.step[1].find("GEN_NSP_FLD_") == -1 and ctx.step[1].find("GEN_OBJ_FLD_") > -1:
                     if ctx.step[0] not in gen_obj_data:
@@ -995,54 +1608,22 @@ class DBCCore:
                         self.logger.log(msg, "Error")
                         raise Exception(msg)
                     for gen_obj_i in gen_obj_data[ctx.step[0]]:
-                        gen_query = parse_query_placeholder(ctx.step[1], gen_obj_i, 'GEN_OBJ_FLD_')
-                        step_hash = hashlib.md5(gen_query.encode()).hexdigest()
-                        if step_hash in steps_hashes:
+                        gen_query = ctx.step[2].render(gen_obj_i=gen_obj_i)
+                        step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
+                        if step_hash in steps_hashes or step_hash in planned_hashes:
                             continue
-                        if enable_at and ActionTracker.is_action_exists(
-                                db_local,
-                                self.sys_conf.schema_location,
-                                ctx.packet_name,
-                                ctx.step[0],
-                                step_hash
-                        ):
+                        if step_hash in done_hashes:
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log(
                                 "%s: already executed with hash %s" % (ctx.info(), step_hash),
                                 "Info"
                             )
                         else:
-                            # ========================================================================
+                            maint_queries = []
                             if gen_obj_i[0] is not None and len(str(gen_obj_i[0])) > 0:  # run maintenance command
-                                if self.sys_conf.log_sql == 1:
-                                    self.logger.log("%s:\n%s" % (ctx.info(), gen_obj_i[0]), "Info")
-                                if self.sys_conf.execute_sql:
-                                    self.execute_q(ctx, db_local, gen_obj_i[0])
-                            # ========================================================================
-                            if self.sys_conf.log_sql == 1:
-                                self.logger.log("%s:\n%s" % (ctx.info(), gen_query), "Info")
-                            if self.sys_conf.execute_sql:
-                                if enable_at:
-                                    ActionTracker.begin_action(
-                                        db_local,
-                                        self.sys_conf.schema_location,
-                                        ctx.packet_name,
-                                        ctx.packet_hash,
-                                        ctx.step[0],
-                                        ctx.meta_data
-                                    )
-                                self.execute_q(ctx, db_local, gen_query)
-                                if enable_at:
-                                    ActionTracker.apply_action(
-                                        db_local,
-                                        self.sys_conf.schema_location,
-                                        ctx.packet_name,
-                                        ctx.step[0],
-                                        step_hash
-                                    )
-                                steps_hashes[step_hash] = ctx.step[0]
-                                self.logger.log("%s: action finished" % (ctx.info()), "Info")
-                            # ========================================================================
+                                maint_queries.append(gen_obj_i[0])
+                            actions.append((maint_queries, gen_query, step_hash))
+                            planned_hashes.add(step_hash)
                 # case 3: only NSP generator is exists
                 if ctx.step[1].find("GEN_NSP_FLD_") > -1 and ctx.step[1].find("GEN_OBJ_FLD_") == -1:
                     if ctx.step[0] not in gen_nsp_data:
@@ -1050,48 +1631,27 @@ class DBCCore:
                         self.logger.log(msg, "Error")
                         raise Exception(msg)
                     for gen_nsp_i in gen_nsp_data[ctx.step[0]]:
-                        gen_query = parse_query_placeholder(ctx.step[1], gen_nsp_i, 'GEN_NSP_FLD_')
-                        step_hash = hashlib.md5(gen_query.encode()).hexdigest()
-                        if step_hash in steps_hashes:
+                        gen_query = ctx.step[2].render(gen_nsp_i=gen_nsp_i)
+                        step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
+                        if step_hash in steps_hashes or step_hash in planned_hashes:
                             continue
-                        if enable_at and ActionTracker.is_action_exists(
-                                db_local, self.sys_conf.schema_location, ctx.packet_name, ctx.step[0], step_hash
-                        ):
+                        if step_hash in done_hashes:
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log("%s: action already executed with hash %s" % (ctx.info(), step_hash), "Info")
                         else:
-                            # ========================================================================
+                            maint_queries = []
                             if gen_nsp_i[0] is not None and len(str(gen_nsp_i[0])) > 0:  # run maintenance command
-                                if self.sys_conf.log_sql == 1:
-                                    self.logger.log("%s:\n%s" % (ctx.info(), gen_nsp_i[0]), "Info")
-                                if self.sys_conf.execute_sql:
-                                    self.execute_q(ctx, db_local, gen_nsp_i[0])
-                            # ========================================================================
-                            if self.sys_conf.log_sql == 1:
-                                self.logger.log("%s:\n%s" % (ctx.info(), gen_query), "Info")
-                            if self.sys_conf.execute_sql:
-                                if enable_at: ActionTracker.begin_action(
-                                    db_local,
-                                    self.sys_conf.schema_location,
-                                    ctx.packet_name,
-                                    ctx.packet_hash,
-                                    ctx.step[0],
-                                    ctx.meta_data
-                                )
-                                self.execute_q(ctx, db_local, gen_query)
-                                if enable_at: ActionTracker.apply_action(
-                                    db_local, self.sys_conf.schema_location, ctx.packet_name, ctx.step[0], step_hash
-                                )
-                                steps_hashes[step_hash] = ctx.step[0]
-                                self.logger.log("%s: action finished" % (ctx.info()), "Info")
-                            # ========================================================================
+                                maint_queries.append(gen_nsp_i[0])
+                            actions.append((maint_queries, gen_query, step_hash))
+                            planned_hashes.add(step_hash)
+                if len(actions) > 0:
+                    self.execute_actions(ctx, db_local, actions, steps_hashes, enable_at, step_state)
                 # case 4: no generators
-                if ctx.step[1].find("GEN_NSP_FLD_") == -1 and ctx.step[1].find("GEN_OBJ_FLD_") == -1:
+                if ctx.step[1].find("GEN_NSP_FLD_") == -1 and ctx.step[1].find("GEN_OBJ_FLD_") == -1 and \
+                        not is_chunked:
                     step_hash = hashlib.md5(ctx.step[1].encode()).hexdigest()
                     if step_hash not in steps_hashes:
-                        if enable_at and ActionTracker.is_action_exists(
-                                db_local, self.sys_conf.schema_location, ctx.packet_name, ctx.step[0], step_hash
-                        ):
+                        if step_hash in done_hashes:
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log(
                                 "%s: action already executed with hash %s" % (ctx.info(), step_hash),
@@ -1102,25 +1662,31 @@ class DBCCore:
                             if self.sys_conf.log_sql == 1:
                                 self.logger.log("%s:\n%s" % (ctx.info(), ctx.step[1]), "Info")
                             if self.sys_conf.execute_sql:
-                                if enable_at: ActionTracker.begin_action(
-                                    db_local,
-                                    self.sys_conf.schema_location,
-                                    ctx.packet_name,
-                                    ctx.packet_hash,
-                                    ctx.step[0],
-                                    ctx.meta_data
-                                )
+                                if enable_at: self.get_tracker(ctx).begin_action(ctx.step[0])
+                                step_state["hash"] = step_hash
+                                start_time = time.time()
+                                row_count = None
                                 if ctx.step[0].endswith(".py"):
                                     # python step custom execution
                                     exec(ctx.step[1])
+                                elif enable_at:
+                                    row_count = self.execute_action_q(
+                                        ctx, db_local, ctx.step[1], step_hash,
+                                        track_query=self.get_tracker(ctx).get_apply_action_query(
+                                            ctx.step[0], step_hash
+                                        )
+                                    )
                                 else:
-                                    self.execute_q(ctx, db_local, ctx.step[1])
+                                    self.execute_action_q(ctx, db_local, ctx.step[1], step_hash)
+                                if enable_at and ctx.step[0].endswith(".py"):
+                                    self.get_tracker(ctx).apply_action(ctx.step[0], step_hash)
                                 if enable_at:
-                                    ActionTracker.apply_action(
-                                        db_local, self.sys_conf.schema_location, ctx.packet_name, ctx.step[0], step_hash
-                                    )
+                                    self.track_action_stats(ctx, step_hash, start_time, row_count)
+                                    self.flush_action_stats(ctx)
+                                step_state.pop("hash", None)
                                 steps_hashes[step_hash] = ctx.step[0]
                                 self.logger.log("%s: action finished" % (ctx.info()), "Info")
+                                self.track_progress(ctx)
                             # ========================================================================
             except (
                 postgresql.exceptions.PLPGSQLRaiseError
@@ -1145,6 +1711,10 @@ class DBCCore:
                 '''
                 if self.is_terminate:
                     return 'terminate', None
+                if "hash" in step_state:
+                    # interrupted action will be executed again
+                    retries = self.action_retries.setdefault(ctx.db_name, {})
+                    retries[step_state["hash"]] = retries.get(step_state["hash"], 0) + 1
                 self.logger.log(
                     'Exception in %s (execute_step): %s. Reconnecting after %d sec...' %
                     (ctx.info(), str(e), self.sys_conf.conn_exception_sleep_interval),
@@ -1156,6 +1726,12 @@ class DBCCore:
                     self.errors_count += 1
                     return 'exception', 'skip_step'
                 elif self.args.skip_action_cancel:
+                    if "hash" in step_state:
+                        # hash of the failed action
+                        step_hash = step_state.pop("hash")
+                    if "range" in step_state:
+                        # skip the failed chunk
+                        step_state["skip_to"] = step_state.pop("range")[1] + 1
                     steps_hashes[step_hash] = ctx.step[0]
                     self.logger.log(
                         '%s (execute_step): action %s in step %s skipped!' %
@@ -1248,11 +1824,8 @@ class DBCCore:
                         raise Exception(msg)
                     for gen_nsp_i in gen_nsp_data[ctx.step[0]]:  # namespace generators have a major priority
                         for gen_obj_i in gen_obj_data[ctx.step[0]]:  # object generators have a minor priority
-                            gen_query = parse_query_placeholder(
-                                parse_query_placeholder(ctx.step[1], gen_nsp_i, 'GEN_NSP_FLD_'),
-                                gen_obj_i, 'GEN_OBJ_FLD_'
-                            )
-                            step_hash = hashlib.md5(gen_query.encode()).hexdigest()
+                            gen_query = ctx.step[2].render(gen_nsp_i, gen_obj_i)
+                            step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
                             if step_hash in steps_hashes:
                                 continue
                             # ========================================================================
@@ -1275,6 +1848,7 @@ class DBCCore:
                                 execute_ro(db_local, gen_query)
                                 steps_hashes[step_hash] = ctx.step[0]
                                 self.logger.log("%s: action finished" % (ctx.info()), "Info")
+                                self.track_progress(ctx)
                             # ========================================================================
                 # case 2: only OBJ generator is exists
                 if ctx.step[1].find("GEN_NSP_FLD_") == -1 and ctx.step[1].find("GEN_OBJ_FLD_") > -1:
@@ -1283,8 +1857,8 @@ class DBCCore:
                         self.logger.log(msg, "Error")
                         raise Exception(msg)
                     for gen_obj_i in gen_obj_data[ctx.step[0]]:
-                        gen_query = parse_query_placeholder(ctx.step[1], gen_obj_i, 'GEN_OBJ_FLD_')
-                        step_hash = hashlib.md5(gen_query.encode()).hexdigest()
+                        gen_query = ctx.step[2].render(gen_obj_i=gen_obj_i)
+                        step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
                         if step_hash in steps_hashes:
                             continue
                         # ========================================================================
@@ -1301,6 +1875,7 @@ class DBCCore:
                             execute_ro(db_local, gen_query)
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log("%s: action finished" % (ctx.info()), "Info")
+                            self.track_progress(ctx)
                         # ========================================================================
                 # case 3: only NSP generator is exists
                 if ctx.step[1].find("GEN_NSP_FLD_") > -1 and ctx.step[1].find("GEN_OBJ_FLD_") == -1:
@@ -1309,8 +1884,8 @@ class DBCCore:
                         self.logger.log(msg, "Error")
                         raise Exception(msg)
                     for gen_nsp_i in gen_nsp_data[ctx.step[0]]:
-                        gen_query = parse_query_placeholder(ctx.step[1], gen_nsp_i, 'GEN_NSP_FLD_')
-                        step_hash = hashlib.md5(gen_query.encode()).hexdigest()
+                        gen_query = ctx.step[2].render(gen_nsp_i=gen_nsp_i)
+                        step_hash = hashlib.md5(str(gen_query).encode()).hexdigest()
                         if step_hash in steps_hashes:
                             continue
                         # ========================================================================
@@ -1328,6 +1903,7 @@ class DBCCore:
                             execute_ro(db_local, gen_query)
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log("%s: action finished" % (ctx.info()), "Info")
+                            self.track_progress(ctx)
                         # ========================================================================
                 # case 4: no generators
                 if ctx.step[1].find("GEN_NSP_FLD_") == -1 and ctx.step[1].find("GEN_OBJ_FLD_") == -1:
@@ -1341,6 +1917,7 @@ class DBCCore:
                             execute_ro(db_local, ctx.step[1])
                             steps_hashes[step_hash] = ctx.step[0]
                             self.logger.log("%s: action finished" % (ctx.info()), "Info")
+                            self.track_progress(ctx)
                         # ========================================================================
             except (
                     postgresql.exceptions.PLPGSQLRaiseError,
@@ -0,0 +1,109 @@
+import time
+import threading
+from psc.psccommon.psc_common import get_scalar
+
+
+class ActionGovernor:
+    """
+    Adaptive delay between generator actions driven by the feedback of the server.
+    Canary query latency and the number of active sessions of the cluster are sampled
+    every "check_interval" seconds on a separate session: if one of them is over the threshold,
+    the delay is doubled (up to "max_delay"), otherwise the delay is halved (down to "min_delay").
+
+    Configured by the "governor" section of meta_data.json:
+        "governor": {
+            "canary_query": "SELECT 1",
+            "check_interval": 1,
+            "max_canary_latency": 0.05,
+            "max_active_sessions": 20,
+            "min_delay": 0,
+            "max_delay": 10
+        }
+    """
+    default_params = {
+        "canary_query": "SELECT 1",
+        "check_interval": 1,            # seconds between samples
+        "max_canary_latency": 0.05,     # seconds, 0 - not checked
+        "max_active_sessions": 0,       # 0 - not checked
+        "min_delay": 0,
+        "max_delay": 10,
+        "delay_step": 0.1               # first delay after the server is overloaded
+    }
+
+    def __init__(self, params, conn_manager, db_name, str_conn, logger=None, is_stopped=None):
+        self.params = dict(self.default_params)
+        self.params.update(params)
+        self.conn_manager = conn_manager
+        self.db_name = db_name
+        self.str_conn = str_conn
+        self.logger = logger
+        self.is_stopped = is_stopped
+        self.conn = None
+        self.lock = threading.Lock()    # actions of one step can be executed by several threads
+        self.delay = float(self.params["min_delay"])
+        self.last_sample_time = None
+        self.canary_latency = None
+        self.active_sessions = None
+
+    def log(self, msg, msg_type="Info"):
+        if self.logger is not None:
+            self.logger.log("Governor of '%s': %s" % (self.db_name, msg), msg_type)
+
+    def sample(self):
+        if self.conn is None:
+            # the governor doesn't wait for a session taken by the worker or parallel actions
+            self.conn = self.conn_manager.acquire(self.db_name, self.str_conn, blocking=False)
+        start_time = time.time()
+        get_scalar(self.conn, self.params["canary_query"])
+        self.canary_latency = time.time() - start_time
+        self.active_sessions = get_scalar(self.conn, """
+            SELECT count(1)
+            FROM pg_stat_activity
+            WHERE state = 'active' AND pid <> pg_backend_pid()
+        """)
+
+    def is_overloaded(self):
+        if 0 < float(self.params["max_canary_latency"]) < self.canary_latency:
+            return True
+        if 0 < int(self.params["max_active_sessions"]) < self.active_sessions:
+            return True
+        return False
+
+    def adjust(self):
+        prev_delay = self.delay
+        if self.is_overloaded():
+            self.delay = min(max(self.delay * 2, float(self.params["delay_step"])), float(self.params["max_delay"]))
+        else:
+            self.delay = self.delay / 2
+            if self.delay < float(self.params["delay_step"]):
+                self.delay = 0.0
+            self.delay = max(self.delay, float(self.params["min_delay"]))
+        if self.delay != prev_delay:
+            self.log(
+                "canary latency %.3f sec, active sessions %d, delay between actions %.2f sec" %
+                (self.canary_latency, self.active_sessions, self.delay)
+            )
+
+    # called before each generator action
+    def throttle(self):
+        with self.lock:
+            if self.last_sample_time is None or \
+                    time.time() - self.last_sample_time >= float(self.params["check_interval"]):
+                self.last_sample_time = time.time()
+                try:
+                    self.sample()
+                    self.adjust()
+                except:
+                    # the governor must not break the deployment: keep the current delay
+                    self.log("sampling failed, delay between actions %.2f sec" % self.delay, "Error")
+                    self.close(reuse=False)
+        wait_until = time.time() + self.delay
+        while time.time() < wait_until:
+            if self.is_stopped is not None and self.is_stopped():
+                break
+            time.sleep(min(0.1, wait_until - time.time()) if wait_until > time.time() else 0)
+
+    def close(self, reuse=True):
+        if self.conn is not None:
+            self.conn_manager.release(self.db_name, self.conn, reuse)
+            self.conn = None
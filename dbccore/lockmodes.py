@@ -0,0 +1,359 @@
+import re
+import sqlparse
+
+
+# table-level lock modes from the weakest to the strongest, as they are named in pg_locks
+LOCK_MODES = [
+    'AccessShareLock',
+    'RowShareLock',
+    'RowExclusiveLock',
+    'ShareUpdateExclusiveLock',
+    'ShareLock',
+    'ShareRowExclusiveLock',
+    'ExclusiveLock',
+    'AccessExclusiveLock'
+]
+
+LOCK_CONFLICTS = {
+    'AccessShareLock': ['AccessExclusiveLock'],
+    'RowShareLock': ['ExclusiveLock', 'AccessExclusiveLock'],
+    'RowExclusiveLock': ['ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'],
+    'ShareUpdateExclusiveLock': [
+        'ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'
+    ],
+    'ShareLock': [
+        'RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'
+    ],
+    'ShareRowExclusiveLock': [
+        'RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock',
+        'AccessExclusiveLock'
+    ],
+    'ExclusiveLock': [
+        'RowShareLock', 'RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock',
+        'ExclusiveLock', 'AccessExclusiveLock'
+    ],
+    'AccessExclusiveLock': list(LOCK_MODES)
+}
+
+RELATION = r'(?:"[^"]+"|[\w$]+)(?:\s*\.\s*(?:"[^"]+"|[\w$]+))?'
+RELATIONS = r'%s(?:\s*,\s*%s)*' % (RELATION, RELATION)
+
+# subcommands of ALTER TABLE which take the lock weaker than ACCESS EXCLUSIVE
+alter_table_modes = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), mode) for v, mode in [
+        (r'^VALIDATE\s+CONSTRAINT\b', 'ShareUpdateExclusiveLock'),
+        (r'^ALTER\s+(?:COLUMN\s+)?\S+\s+SET\s+STATISTICS\b', 'ShareUpdateExclusiveLock'),
+        (r'^CLUSTER\s+ON\b', 'ShareUpdateExclusiveLock'),
+        (r'^SET\s+WITHOUT\s+CLUSTER\b', 'ShareUpdateExclusiveLock'),
+        (r'^(?:SET|RESET)\s*\(', 'ShareUpdateExclusiveLock'),    # storage parameters
+        (r'^ATTACH\s+PARTITION\b', 'ShareUpdateExclusiveLock'),
+        (r'^DETACH\s+PARTITION\b.*\bCONCURRENTLY\b', 'ShareUpdateExclusiveLock'),
+        (r'^ADD\s+(?:CONSTRAINT\s+\S+\s+)?FOREIGN\s+KEY\b', 'ShareRowExclusiveLock'),
+        (r'^(?:ENABLE|DISABLE)\s+(?:ALWAYS\s+|REPLICA\s+)?TRIGGER\b', 'ShareRowExclusiveLock'),
+    ]
+]
+
+# (regex, lock mode): the mode is a function of the match object if it depends on the options of the statement
+statement_modes = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), mode) for v, mode in [
+        (
+            r'^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?(?P<rel>%s)\s*\*?\s+(?P<cmds>.*)$' % RELATION,
+            lambda m: get_alter_table_mode(m.group('cmds'))
+        ),
+        (r'^DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?P<rels>%s)' % RELATIONS, 'AccessExclusiveLock'),
+        (
+            r'^DROP\s+TRIGGER\s+(?:IF\s+EXISTS\s+)?\S+\s+ON\s+(?:ONLY\s+)?(?P<rel>%s)' % RELATION,
+            'AccessExclusiveLock'
+        ),
+        (r'^TRUNCATE\s+(?:TABLE\s+)?(?:ONLY\s+)?(?P<rels>%s)' % RELATIONS, 'AccessExclusiveLock'),
+        (
+            r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?P<concurrently>CONCURRENTLY\s+)?.*?\bON\s+(?:ONLY\s+)?(?P<rel>%s)' %
+            RELATION,
+            lambda m: 'ShareUpdateExclusiveLock' if m.group('concurrently') else 'ShareLock'
+        ),
+        (
+            r'^REINDEX\s+(?:\([^)]*\)\s*)?TABLE\s+(?P<concurrently>CONCURRENTLY\s+)?(?P<rel>%s)' % RELATION,
+            lambda m: 'ShareUpdateExclusiveLock' if m.group('concurrently') else 'ShareLock'
+        ),
+        (
+            r'^LOCK\s+(?:TABLE\s+)?(?:ONLY\s+)?(?P<rels>%s)(?:\s+IN\s+(?P<mode>[\w\s]+?)\s+MODE)?' % RELATIONS,
+            lambda m: get_lock_table_mode(m.group('mode'))
+        ),
+        (
+            r'^VACUUM\s+(?:\((?P<options>[^)]*)\)\s*|(?P<keywords>(?:(?:FULL|FREEZE|VERBOSE|ANALYZE)\s+)*))'
+            r'(?!(?:FULL|FREEZE|VERBOSE|ANALYZE)\b)(?P<rels>%s)' % RELATIONS,
+            lambda m: 'AccessExclusiveLock'
+            if re.search(r'\bFULL\b', (m.group('options') or '') + (m.group('keywords') or ''), re.IGNORECASE)
+            else 'ShareUpdateExclusiveLock'
+        ),
+        (r'^CLUSTER\s+(?:VERBOSE\s+)?(?P<rel>%s)' % RELATION, 'AccessExclusiveLock'),
+        (
+            r'^REFRESH\s+MATERIALIZED\s+VIEW\s+(?P<concurrently>CONCURRENTLY\s+)?(?P<rel>%s)' % RELATION,
+            lambda m: 'ExclusiveLock' if m.group('concurrently') else 'AccessExclusiveLock'
+        ),
+        (
+            r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:CONSTRAINT\s+)?TRIGGER\s+.*?\bON\s+(?P<rel>%s)' % RELATION,
+            'ShareRowExclusiveLock'
+        ),
+    ]
+]
+
+
+# statements which lock only new objects or don't lock relations, see "get_statement_impact"
+dml_modes = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), mode) for v, mode in [
+        (r'^INSERT\s+INTO\s+(?P<rel>%s)' % RELATION, 'RowExclusiveLock'),
+        (r'^UPDATE\s+(?:ONLY\s+)?(?P<rel>%s)' % RELATION, 'RowExclusiveLock'),
+        (r'^DELETE\s+FROM\s+(?:ONLY\s+)?(?P<rel>%s)' % RELATION, 'RowExclusiveLock'),
+        (r'^MERGE\s+INTO\s+(?:ONLY\s+)?(?P<rel>%s)' % RELATION, 'RowExclusiveLock'),
+        (r'^SELECT\b.*\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b', 'RowShareLock'),
+        (r'^SELECT\b', 'AccessShareLock'),
+        (
+            r'^(?:CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|SEQUENCE|SCHEMA|FUNCTION|PROCEDURE|TYPE|EXTENSION|VIEW)'
+            r'|ALTER\s+SEQUENCE|DROP\s+(?:FUNCTION|PROCEDURE|TYPE)|COMMENT|GRANT|REVOKE|SET|RESET|SHOW)\b',
+            None
+        ),
+    ]
+]
+
+# subcommands of ALTER TABLE which rewrite the table or scan it under the lock
+alter_table_rewrites = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), risk) for v, risk in [
+        (r'^ALTER\s+(?:COLUMN\s+)?\S+\s+(?:SET\s+DATA\s+)?TYPE\b', 'rewrite'),
+        (r'^SET\s+(?:LOGGED|UNLOGGED|TABLESPACE|ACCESS\s+METHOD)\b', 'rewrite'),
+        (r'^ADD\s+(?:COLUMN\s+)?.*\bGENERATED\s+ALWAYS\s+AS\s*\(.*\bSTORED\b', 'rewrite'),
+        (r'^ADD\s+(?:COLUMN\s+)?(?:IF\s+NOT\s+EXISTS\s+)?\S+\s+(?:SMALL|BIG)?SERIAL\b', 'rewrite'),
+        (
+            r'^ADD\s+(?:COLUMN\s+)?.*\bDEFAULT\s+.*\b'
+            r'(?:random|clock_timestamp|timeofday|gen_random_uuid|uuid_generate_v\w+|nextval)\s*\(',
+            'rewrite'
+        ),
+        (r'^ADD\s+(?:CONSTRAINT\s+\S+\s+)?(?:PRIMARY\s+KEY|UNIQUE|EXCLUDE)\b(?!.*\bUSING\s+INDEX\b)', 'scan'),
+        (r'^ADD\s+(?:CONSTRAINT\s+\S+\s+)?(?:CHECK|FOREIGN\s+KEY)\b(?!.*\bNOT\s+VALID\b)', 'scan'),
+        (r'^ALTER\s+(?:COLUMN\s+)?\S+\s+SET\s+NOT\s+NULL\b', 'scan'),
+        (r'^VALIDATE\s+CONSTRAINT\b', 'scan'),
+        (r'^ATTACH\s+PARTITION\b', 'scan'),
+    ]
+]
+
+# subcommands of ALTER TABLE which rewrite the table on the versions before the given "server_version_num":
+# the constant DEFAULT of the new column is stored in the catalog since PostgreSQL 11
+alter_table_rewrites_before = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), version_num, risk) for v, version_num, risk in [
+        (r'^ADD\s+(?:COLUMN\s+)?.*\bDEFAULT\s+(?!NULL\b)', 110000, 'rewrite'),
+    ]
+]
+
+statement_rewrites = [
+    (re.compile(v, re.IGNORECASE | re.DOTALL), risk) for v, risk in [
+        (r'^VACUUM\s+(?:\([^)]*\bFULL\b[^)]*\)|(?:(?:FREEZE|VERBOSE|ANALYZE)\s+)*FULL\b)', 'rewrite'),
+        (r'^(?:CLUSTER|REFRESH\s+MATERIALIZED\s+VIEW)\b', 'rewrite'),
+        (r'^(?:VACUUM|CREATE\s+(?:UNIQUE\s+)?INDEX|REINDEX)\b', 'scan'),
+    ]
+]
+rewrite_risks = ['', 'scan', 'rewrite']
+impact_levels = ['low', 'unknown', 'medium', 'high']
+
+# start of the statement inside of the body of DO block
+inner_statement = re.compile(
+    r'\b(?:ALTER\s+TABLE|DROP\s+TABLE|TRUNCATE|CREATE\s+(?:UNIQUE\s+)?INDEX|REINDEX|LOCK\s+TABLE|VACUUM|CLUSTER'
+    r'|REFRESH\s+MATERIALIZED|CREATE\s+(?:OR\s+REPLACE\s+)?(?:CONSTRAINT\s+)?TRIGGER'
+    r'|INSERT\s+INTO|(?<!FOR )UPDATE|DELETE\s+FROM|MERGE\s+INTO)\b',
+    re.IGNORECASE
+)
+do_block = re.compile(r'^DO\s+(?:LANGUAGE\s+\w+\s+)?\$(\w*)\$(?P<body>.*)\$\1\$', re.IGNORECASE | re.DOTALL)
+
+
+def strongest_lock_mode(modes):
+    return max(modes, key=lambda mode: LOCK_MODES.index(mode))
+
+
+# subcommands are separated by commas which are not inside of parentheses or quotes
+def split_subcommands(cmds):
+    res = []
+    depth = 0
+    quote = None
+    start = 0
+    for pos, char in enumerate(cmds):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            res.append(cmds[start:pos].strip())
+            start = pos + 1
+    res.append(cmds[start:].strip())
+    return [cmd for cmd in res if len(cmd) > 0]
+
+
+def get_alter_table_mode(cmds):
+    modes = []
+    for cmd in split_subcommands(cmds):
+        mode = 'AccessExclusiveLock'
+        for regex, cmd_mode in alter_table_modes:
+            if regex.search(cmd):
+                mode = cmd_mode
+                break
+        modes.append(mode)
+    return strongest_lock_mode(modes) if len(modes) > 0 else 'AccessExclusiveLock'
+
+
+def get_lock_table_mode(mode):
+    if mode is None:
+        return 'AccessExclusiveLock'
+    # "SHARE ROW EXCLUSIVE" -> "ShareRowExclusiveLock"
+    name = ''.join(word.capitalize() for word in mode.split()) + 'Lock'
+    return name if name in LOCK_MODES else 'AccessExclusiveLock'
+
+
+def split_relations(rels):
+    return [re.sub(r'\s*\.\s*', '.', rel.strip()) for rel in re.findall(RELATION, rels)]
+
+
+def normalize_statement(stm):
+    return sqlparse.format(stm, strip_comments=True).strip().rstrip(';').strip()
+
+
+# statements of DO block are found by the keywords, nested blocks and dynamic SQL are not analyzed
+def get_inner_statements(stm):
+    found = do_block.search(stm)
+    if not found:
+        return None
+    res = []
+    for chunk in found.group('body').split(';'):
+        start = inner_statement.search(chunk)
+        if start:
+            res.append(chunk[start.start():].strip())
+    return res
+
+
+def match_statement(stm, rules):
+    # returns (relations, lock mode) of the first matched rule or None
+    for regex, mode in rules:
+        found = regex.search(stm)
+        if found:
+            lock_mode = mode(found) if callable(mode) else mode
+            if 'rels' in regex.groupindex:
+                return split_relations(found.group('rels')), lock_mode
+            if 'rel' in regex.groupindex:
+                return split_relations(found.group('rel')), lock_mode
+            return [], lock_mode
+    return None
+
+
+def get_statement_locks(stm):
+    """
+    Relations and lock modes requested by one SQL statement: list of pairs (relation, lock mode).
+    Only statements with the known lock of the target relation are recognized (DDL and maintenance commands,
+    also inside of DO blocks), the list is empty for other statements.
+    """
+    stm = normalize_statement(stm)
+    inner_stms = get_inner_statements(stm)
+    if inner_stms is not None:
+        return [lock for inner_stm in inner_stms for lock in get_statement_locks(inner_stm)]
+    found = match_statement(stm, statement_modes)
+    if found is None:
+        return []
+    rels, lock_mode = found
+    return [(rel, lock_mode) for rel in rels]
+
+
+def get_query_impact(query, non_tx_ops=(), server_version_num=None):
+    return [
+        get_statement_impact(stm, non_tx_ops, server_version_num)
+        for stm in sqlparse.split(query) if len(normalize_statement(stm)) > 0
+    ]
+
+
+def get_max_impact(impacts):
+    return max([impact["impact"] for impact in impacts] + ['low'], key=impact_levels.index)
+
+
+def get_query_locks(query):
+    res = []
+    for stm in sqlparse.split(query):
+        res.extend(get_statement_locks(stm))
+    return res
+
+
+def get_rewrite_risk(stm, server_version_num=None):
+    found = re.search(
+        r'^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?%s\s*\*?\s+(?P<cmds>.*)$' % RELATION,
+        stm, re.IGNORECASE | re.DOTALL
+    )
+    risks = ['']
+    rules = statement_rewrites
+    cmds = [stm]
+    if found:
+        rules = alter_table_rewrites + [
+            (regex, risk) for regex, version_num, risk in alter_table_rewrites_before
+            if server_version_num is not None and server_version_num < version_num
+        ]
+        cmds = split_subcommands(found.group('cmds'))
+    for cmd in cmds:
+        for regex, risk in rules:
+            if regex.search(cmd):
+                risks.append(risk)
+                break
+    return max(risks, key=rewrite_risks.index)
+
+
+def get_statement_impact(stm, non_tx_ops=(), server_version_num=None):
+    """
+    Expected lock impact of one SQL statement:
+        "relations" - relations locked by the statement
+        "lock_mode" - the strongest table lock, None for new objects, "unknown" if the statement is not recognized
+        "rewrite" - "rewrite" if the table is rewritten, "scan" if the table is scanned to build an index
+            or to validate a constraint, "" otherwise
+        "non_tx" - the statement can't be executed in a transaction block, see "SysConf.non_tx_ops"
+        "impact" - "high" if the statement blocks writes while the table is rewritten or scanned,
+            "medium" if it blocks writes for a short time, is non-transactional or rewrites the table
+            under a weaker lock, "low" if it doesn't block writes, "unknown" if the statement is not recognized
+    "server_version_num" is the version of the target server (e.g. 90605), PostgreSQL 11+ is assumed if it's None.
+    """
+    stm = normalize_statement(stm)
+    inner_stms = get_inner_statements(stm)
+    impacts = [get_statement_impact(inner_stm, non_tx_ops, server_version_num) for inner_stm in inner_stms] \
+        if inner_stms is not None else []
+    found = match_statement(stm, statement_modes) if inner_stms is None else None
+    if found is None and inner_stms is None:
+        found = match_statement(stm, dml_modes)
+
+    if inner_stms is not None:
+        rels = [rel for impact in impacts for rel in impact["relations"]]
+        modes = [impact["lock_mode"] for impact in impacts if impact["lock_mode"] in LOCK_MODES]
+        lock_mode = strongest_lock_mode(modes) if len(modes) > 0 else 'unknown'
+        rewrite = max([''] + [impact["rewrite"] for impact in impacts], key=rewrite_risks.index)
+    elif found is not None:
+        rels, lock_mode = found
+        rewrite = get_rewrite_risk(stm, server_version_num)
+    else:
+        rels, lock_mode, rewrite = [], 'unknown', ''
+
+    non_tx = any(op.search(stm) for op in non_tx_ops)
+    blocks_writes = lock_mode in LOCK_CONFLICTS['RowExclusiveLock']
+    if inner_stms is not None and len(impacts) > 0:
+        # the statements of DO block are executed one by one
+        impact = get_max_impact(impacts)
+    elif blocks_writes and rewrite != '':
+        impact = 'high'
+    elif blocks_writes or non_tx or rewrite != '':
+        impact = 'medium'
+    elif lock_mode == 'unknown':
+        impact = 'unknown'
+    else:
+        impact = 'low'
+
+    return {
+        "statement": stm,
+        "relations": list(dict.fromkeys(rels)),
+        "lock_mode": lock_mode,
+        "rewrite": rewrite,
+        "non_tx": non_tx,
+        "impact": impact
+    }
@@ -0,0 +1,176 @@
+import time
+import threading
+
+
+class ClusterObserver:
+    """
+    Lock observer of one PostgreSQL instance ("host:port"): one session and one query per cycle
+    for all observed pids of all databases of the cluster processed at the same time.
+    Locks and pg_stat_activity are cluster-wide, so the session can be opened to any database of the cluster.
+
+    Observed pid is cancelled if
+        "blocker" - it blocks another transaction which waits for any kind of lock (relation, tuple, transactionid,
+            advisory, etc.) and is older than "cancel_blocker_tx_timeout"
+        "wait" - it waits for a heavyweight lock and its transaction is older than "cancel_wait_tx_timeout"
+    Blockers are found by pg_blocking_pids() which is called only for backends waiting for a lock.
+
+    Each observed lock wait is an event (pid, reason, blocked and blocking pids and queries, relation or lock type,
+    wait duration since the start of the blocked query) which is finished when the wait is over or the pid is
+    cancelled; finished events are taken by "pop_finished" and stored in "dbc_lock_events" by the worker.
+
+    Interval between cycles is adaptive: it is doubled up to "max_interval" while observed pids
+    neither wait for a lock nor block other sessions, and it is reset to "min_interval" as soon as they do
+    or while they execute steps with high lock impact (see "get_statement_impact").
+    """
+    check_query = """
+        WITH waiting AS (
+            SELECT
+                a.pid,
+                a.query,
+                a.xact_start,
+                a.query_start,
+                pg_blocking_pids(a.pid) AS blocking_pids,
+                (
+                    SELECT coalesce(
+                        (
+                            SELECT n.nspname || '.' || c.relname
+                            FROM pg_class c
+                            JOIN pg_namespace n ON n.oid = c.relnamespace
+                            WHERE c.oid = l.relation
+                                AND l.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+                        ),
+                        l.relation::text,
+                        l.locktype
+                    )
+                    FROM pg_locks l
+                    WHERE l.pid = a.pid AND NOT l.granted
+                    LIMIT 1
+                ) AS relation
+            FROM pg_stat_activity a
+            WHERE a.wait_event is not null
+                AND a.wait_event_type = 'Lock'
+                AND a.pid <> pg_backend_pid()
+        )
+        SELECT
+            blocker.pid,
+            'blocker' AS reason,
+            age(clock_timestamp(), w.xact_start) > interval %s AS expired,
+            w.pid AS blocked_pid,
+            blocker.pid AS blocking_pid,
+            w.query AS blocked_query,
+            b.query AS blocking_query,
+            w.relation,
+            extract(epoch from clock_timestamp() - w.query_start)::float8 AS wait_duration
+        FROM waiting w
+        CROSS JOIN LATERAL unnest(w.blocking_pids) AS blocker(pid)
+        LEFT JOIN pg_stat_activity b ON b.pid = blocker.pid
+        WHERE w.pid <> blocker.pid
+            AND blocker.pid = ANY($1::integer[])
+        UNION ALL
+        SELECT
+            w.pid,
+            'wait' AS reason,
+            age(clock_timestamp(), w.xact_start) > interval %s AS expired,
+            w.pid AS blocked_pid,
+            w.blocking_pids[1] AS blocking_pid,
+            w.query AS blocked_query,
+            b.query AS blocking_query,
+            w.relation,
+            extract(epoch from clock_timestamp() - w.query_start)::float8 AS wait_duration
+        FROM waiting w
+        LEFT JOIN pg_stat_activity b ON b.pid = w.blocking_pids[1]
+        WHERE w.pid = ANY($1::integer[])
+    """
+    cancel_query = """
+        SELECT pg_cancel_backend(pid) FROM unnest($1::integer[]) AS t(pid)
+    """
+
+    def __init__(self, cluster, db_name, str_conn, min_interval=0.2, max_interval=5):
+        self.cluster = cluster
+        self.db_name = db_name          # session of observer is opened to this database
+        self.str_conn = str_conn
+        self.db_names = set()           # observed databases of the cluster
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.statements = {}            # prepared statements of the current session
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.interval = self.min_interval
+        self.contention = False         # observed pids wait for a lock or block other sessions
+        self.lock = threading.Lock()    # events are finished by the observer and by the workers
+        self.events = {}                # key is (reason, blocked_pid, blocking_pid), value is observed lock wait
+        self.finished = []              # lock waits which are over or cancelled
+
+    def prepare(self, conn, blocker_timeout, wait_timeout):
+        self.statements = {
+            "check": conn.prepare(self.check_query % (blocker_timeout, wait_timeout)),
+            "cancel": conn.prepare(self.cancel_query)
+        }
+
+    # returns list of pairs (pid, reason) of the pids to cancel, "blocker" is preferred if both are expired
+    # "get_context" returns dict of fields of new event by pid: "db_name", "step" and "step_hash" of the action
+    def check(self, pids, get_context=None):
+        res = self.statements["check"](list(pids)) if len(pids) > 0 else []
+        self.contention = len(res) > 0
+        cancel_pids = {}
+        with self.lock:
+            observed = set()
+            for pid, reason, expired, blocked_pid, blocking_pid, blocked_query, blocking_query, relation, \
+                    wait_duration in res:
+                if expired and cancel_pids.get(pid) != 'blocker':
+                    cancel_pids[pid] = reason
+                key = (reason, blocked_pid, blocking_pid)
+                observed.add(key)
+                event = self.events.get(key)
+                if event is None:
+                    event = {
+                        "dt": time.time(),
+                        "pid": pid,
+                        "reason": reason,
+                        "cancelled": False,
+                        "blocked_pid": blocked_pid,
+                        "blocking_pid": blocking_pid,
+                        "db_name": None,
+                        "step": None,
+                        "step_hash": None
+                    }
+                    if get_context is not None:
+                        event.update(get_context(pid))
+                    self.events[key] = event
+                event["blocked_query"] = blocked_query
+                event["blocking_query"] = blocking_query
+                event["relation"] = relation
+                event["wait_duration"] = wait_duration
+            for key in [key for key in self.events if key not in observed]:
+                self.finished.append(self.events.pop(key))
+        return sorted(cancel_pids.items())
+
+    # interval before the next cycle, "urgent" - observed pids execute high impact statements
+    def next_interval(self, urgent=False):
+        if self.contention or urgent:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self.interval
+
+    # "cancel_pids" is list of pairs (pid, reason) returned by "check", lock waits of cancelled pids are finished
+    def cancel(self, cancel_pids):
+        if len(cancel_pids) > 0:
+            self.statements["cancel"]([pid for pid, _ in cancel_pids])
+            reasons = dict(cancel_pids)
+            with self.lock:
+                for key in [key for key, event in self.events.items() if event["pid"] in reasons]:
+                    event = self.events.pop(key)
+                    event["cancelled"] = event["reason"] == reasons[event["pid"]]
+                    self.finished.append(event)
+
+    # lock waits of the finished worker are over
+    def finish_db(self, db_name):
+        with self.lock:
+            for key in [key for key, event in self.events.items() if event["db_name"] == db_name]:
+                self.finished.append(self.events.pop(key))
+
+    def pop_finished(self):
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
@@ -0,0 +1,71 @@
+import time
+import datetime
+import threading
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "unknown"
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+class ActionProgress:
+    """
+    Progress of the packet in actions: every generated action and every step without generators is one action,
+    actions of chunked steps are not counted (progress of chunked step is logged per chunk).
+    Throughput is the exponential moving average of actions per second sampled on each "describe" call,
+    so the ETA follows the current speed of the deployment rather than the average since the start.
+    """
+    def __init__(self, total, done=0, smoothing=0.3):
+        self.total = total
+        self.done = done
+        self.smoothing = smoothing
+        self.lock = threading.Lock()    # actions of one step can be executed by several threads
+        self.rate = None                # actions per second
+        self.last_sample_time = time.time()
+        self.last_sample_done = done
+        self.last_log_time = time.time()
+
+    def add(self, cnt=1):
+        with self.lock:
+            self.done += cnt
+
+    def sample(self):
+        now = time.time()
+        if now - self.last_sample_time <= 0:
+            return
+        rate = (self.done - self.last_sample_done) / (now - self.last_sample_time)
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        self.last_sample_time = now
+        self.last_sample_done = self.done
+
+    def percent(self):
+        if self.total <= 0:
+            return 100.0
+        return min(float(self.done) * 100 / self.total, 100.0)
+
+    def eta(self):
+        if self.done >= self.total:
+            return 0
+        if not self.rate:
+            return None
+        return (self.total - self.done) / self.rate
+
+    # returns True once per "interval" seconds
+    def is_due(self, interval):
+        with self.lock:
+            if time.time() - self.last_log_time >= interval:
+                self.last_log_time = time.time()
+                return True
+            return False
+
+    def describe(self):
+        with self.lock:
+            self.sample()
+            return "%s%% (%d of %d actions), %s actions/sec, ETA %s" % (
+                round(self.percent(), 2),
+                min(self.done, self.total),
+                self.total,
+                "%.2f" % self.rate if self.rate is not None else "-",
+                format_eta(self.eta())
+            )
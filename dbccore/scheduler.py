@@ -0,0 +1,74 @@
+import threading
+import psc.postgresql.iri as pg_iri
+
+
+def get_cluster_name(str_conn):
+    # databases with the same "host:port" belong to the same PostgreSQL instance
+    try:
+        params = pg_iri.parse(str_conn)
+    except:
+        return str_conn
+    return "%s:%s" % (params.get('host', 'localhost'), params.get('port', '5432'))
+
+
+class DBScheduler:
+    """
+    Work queue of databases served by a fixed pool of slots.
+    Each slot takes the next database as soon as the previous one is finished.
+    Databases are spread across clusters first: the next database is taken from the cluster
+    with the smallest number of running databases, and no more than "max_parallel_per_cluster"
+    databases of one cluster are running at the same time.
+    """
+    def __init__(self, dbs, max_parallel, clusters=None, max_parallel_per_cluster=0):
+        self.queue = list(dbs)
+        self.cond = threading.Condition()
+        self.clusters = clusters if clusters is not None else {}     # key is "db_name", value is cluster name
+        self.max_parallel_per_cluster = max_parallel_per_cluster
+        self.running = {}       # key is cluster name, value is number of running databases
+        # max_parallel <= 0 means "no limit": one slot per database
+        if max_parallel is None or max_parallel <= 0:
+            max_parallel = len(self.queue)
+        self.slots_count = max(min(max_parallel, len(self.queue)), 1) if len(self.queue) > 0 else 0
+
+    def get_cluster(self, db_name):
+        return self.clusters.get(db_name, db_name)
+
+    def pick_db(self):
+        picked = None
+        for db_name in self.queue:
+            running = self.running.get(self.get_cluster(db_name), 0)
+            if 0 < self.max_parallel_per_cluster <= running:
+                continue
+            if picked is None or running < self.running.get(self.get_cluster(picked), 0):
+                picked = db_name
+        return picked
+
+    # blocks while all pending databases belong to busy clusters,
+    # returns None if queue is empty or "is_stopped" returns True
+    def next_db(self, is_stopped=None):
+        with self.cond:
+            while len(self.queue) > 0:
+                if is_stopped is not None and is_stopped():
+                    return None
+                db_name = self.pick_db()
+                if db_name is not None:
+                    self.queue.remove(db_name)
+                    cluster = self.get_cluster(db_name)
+                    self.running[cluster] = self.running.get(cluster, 0) + 1
+                    return db_name
+                self.cond.wait()
+            return None
+
+    def done(self, db_name):
+        with self.cond:
+            self.running[self.get_cluster(db_name)] -= 1
+            self.cond.notify_all()
+
+    # wake up slots waiting in "next_db", e.g. on termination
+    def wake_up(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def pending(self):
+        with self.cond:
+            return list(self.queue)
@@ -0,0 +1,154 @@
+import re
+import sqlparse
+
+
+# values of the generator row: the first field is the maintenance command, GEN_..._FLD_n is the field "n",
+# fields are numbered by the names of columns as before, so the duplicate names of columns are one field
+def get_row_values(gen_i):
+    if gen_i is None:
+        return None
+    return list(dict(gen_i).values())
+
+
+class QueryTemplate:
+    """
+    Query tokenized once into the literal text and placeholders:
+        GEN_NSP_FLD_n and GEN_OBJ_FLD_n - fields of the namespace and object generators, substituted by "render"
+        DBC_PL_name - placeholders of the "--placeholders" argument, substituted when the query is tokenized
+    The longest name of placeholder is matched, so GEN_OBJ_FLD_1 is not substituted inside of GEN_OBJ_FLD_10
+    and the substituted values are never scanned for placeholders again. Placeholders without values and
+    numbers with leading zeros (GEN_OBJ_FLD_01) are kept as is.
+    Rendering is one pass over the pieces of the template and one join, whatever the number of fields.
+    """
+    def __init__(self, query, placeholders=None):
+        self.pieces = []    # literal text or placeholder: (prefix, field number, text of placeholder)
+        self.slots = []     # indexes of placeholders in "pieces"
+        pattern = r'(?P<gen>GEN_NSP_FLD_|GEN_OBJ_FLD_)(?P<fld_id>[1-9]\d*|0)'
+        names = sorted(placeholders or {}, key=len, reverse=True)
+        if len(names) > 0:
+            pattern += r'|DBC_PL_(?P<name>%s)' % '|'.join(re.escape(name) for name in names)
+        pos = 0
+        for found in re.finditer(pattern, query):
+            self.add_text(query[pos:found.start()])
+            if found.group('gen') is not None:
+                self.add_placeholder((found.group('gen'), int(found.group('fld_id')), found.group(0)))
+            else:
+                # value of DBC_PL_ can contain fields of generators
+                for piece in QueryTemplate(str(placeholders[found.group('name')])).pieces:
+                    if isinstance(piece, str):
+                        self.add_text(piece)
+                    else:
+                        self.add_placeholder(piece)
+            pos = found.end()
+        self.add_text(query[pos:])
+
+    def add_text(self, text):
+        if len(text) == 0:
+            return
+        if len(self.pieces) > 0 and isinstance(self.pieces[-1], str):
+            self.pieces[-1] += text
+        else:
+            self.pieces.append(text)
+
+    def add_placeholder(self, placeholder):
+        self.slots.append(len(self.pieces))
+        self.pieces.append(placeholder)
+
+    # "values" is dict of prefix and values of generator row, see "get_row_values"
+    def render_values(self, values):
+        pieces = list(self.pieces)
+        for slot in self.slots:
+            prefix, fld_id, text = pieces[slot]
+            row = values.get(prefix)
+            pieces[slot] = str(row[fld_id]) if row is not None and 0 < fld_id < len(row) else text
+        return ''.join(pieces)
+
+    def render(self, gen_nsp_i=None, gen_obj_i=None):
+        return self.render_values({
+            'GEN_NSP_FLD_': get_row_values(gen_nsp_i),
+            'GEN_OBJ_FLD_': get_row_values(gen_obj_i)
+        })
+
+
+def parse_query_placeholder(query, gen_i, placeholder):
+    # placeholder is GEN_NSP_FLD_ or GEN_OBJ_FLD_
+    return QueryTemplate(query).render_values({placeholder: get_row_values(gen_i)})
+
+
+class ActionQuery:
+    """
+    SQL of the generated action rendered by StepTemplate: "text" is the whole SQL (it is hashed, logged and
+    executed as is by non transactional actions), "stms" are the statements of the action.
+    """
+    def __init__(self, text, stms, non_tx, returns_rows):
+        self.text = text
+        self.stms = stms
+        self.non_tx = non_tx
+        self.returns_rows = returns_rows
+
+    def __str__(self):
+        return self.text
+
+
+class StepTemplate:
+    """
+    SQL step with generators compiled once per packet by "parse_packet": the step is split into statements
+    and classified (non transactional, returns rows) before the actions are generated, so each action is only
+    the substitution of GEN_NSP_FLD_n and GEN_OBJ_FLD_n into the parts of the template, see QueryTemplate.
+
+    Values of generators are substituted into the compiled template only if they are plain values (names,
+    numbers, etc.) which can't change the split and the classification of the statements. Values with spaces,
+    quotes or semicolons can be the SQL itself (e.g. "GEN_OBJ_FLD_1" step with "CREATE DATABASE ..." values),
+    so "render" returns the substituted SQL as string for them and the action is split by "execute_q" as before.
+    Words of "non_tx_ops" (VACUUM, CONCURRENTLY, etc.), SELECT and RETURNING are not plain values either:
+    they can make the action non transactional or returning rows, so the rendered SQL is classified again.
+
+    The template is the sequence of parts "gap, statement, gap, ..., statement, gap", where gaps are the text
+    between statements, so the joined parts of the action are equal to the step with substituted placeholders.
+    If the statements can't be located in the step, all actions are rendered as strings.
+    """
+    plain_value = re.compile(r"[^\s;'$]*")
+    rows_keywords = {'SELECT', 'RETURNING'}
+
+    def __init__(self, query, non_tx, returns_rows=None, non_tx_ops=()):
+        self.query = query
+        self.non_tx = non_tx
+        # keywords of values which can change the classification of the action
+        self.keywords = set(self.rows_keywords)
+        for op in non_tx_ops:
+            self.keywords.update(word.upper() for word in re.findall(r'\\b(\w+)\\b', op.pattern))
+        self.template = QueryTemplate(query)
+        parts = []              # gaps and statements of the template
+        self.stm_parts = []     # indexes of statements in "parts"
+        stms = [] if non_tx else sqlparse.split(query)
+        self.returns_rows = returns_rows is not None and any(returns_rows(stm) for stm in stms)
+        pos = 0
+        for stm in stms:
+            start = query.find(stm, pos)
+            if start == -1:
+                parts = None
+                break
+            parts.append(query[pos:start])
+            self.stm_parts.append(len(parts))
+            parts.append(stm)
+            pos = start + len(stm)
+        if parts is not None:
+            parts.append(query[pos:])
+        self.parts = None if parts is None else [QueryTemplate(part) for part in parts]
+
+    def is_plain(self, row):
+        return row is None or all(
+            self.plain_value.fullmatch(str(fld_val)) is not None and
+            self.keywords.isdisjoint(word.upper() for word in re.findall(r'\w+', str(fld_val)))
+            for fld_val in row[1:]
+        )
+
+    def render(self, gen_nsp_i=None, gen_obj_i=None):
+        values = {
+            'GEN_NSP_FLD_': get_row_values(gen_nsp_i),
+            'GEN_OBJ_FLD_': get_row_values(gen_obj_i)
+        }
+        if self.parts is None or not all(self.is_plain(row) for row in values.values()):
+            return self.template.render_values(values)
+        parts = [part.render_values(values) for part in self.parts]
+        return ActionQuery(''.join(parts), [parts[i] for i in self.stm_parts], self.non_tx, self.returns_rows)
@@ -11,7 +11,7 @@ from pg_index i
 join pg_class ci on ci.oid = i.indexrelid and ci.relkind = 'i'
 join pg_class cr on cr.oid = i.indrelid and cr.relkind = 'r'
 join pg_namespace n on n.oid = ci.relnamespace and
-	nspname not in ('pg_catalog', 'pg_toast', 'information_schema')
+	nspname not in ('pg_catalog', 'pg_toast', 'information_schema', 'dbc')	-- tracker tables of db_converter
 join pg_attribute a on
 	  a.attrelid = i.indrelid and a.attnum = any(i.indkey) and not a.attisdropped
 join pg_type t on t.oid = atttypid
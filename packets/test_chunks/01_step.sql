@@ -0,0 +1,8 @@
+DROP TABLE IF EXISTS public.test_chunks;
+CREATE TABLE public.test_chunks
+(
+	id integer primary key,
+	processed boolean not null default false
+);
+INSERT INTO public.test_chunks(id)
+	SELECT T.id FROM generate_series(1, 50000) as T(id);
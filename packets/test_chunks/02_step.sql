@@ -0,0 +1,2 @@
+UPDATE public.test_chunks SET processed = true
+WHERE id >= GEN_CHUNK_START and id <= GEN_CHUNK_END;
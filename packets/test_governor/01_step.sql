@@ -0,0 +1,5 @@
+DROP TABLE IF EXISTS public.test_governor;
+CREATE TABLE public.test_governor
+(
+	id integer
+);
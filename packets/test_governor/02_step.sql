@@ -0,0 +1 @@
+INSERT INTO public.test_governor(id) VALUES (GEN_OBJ_FLD_1);
@@ -0,0 +1 @@
+DROP TABLE IF EXISTS public.test_governor;
@@ -0,0 +1 @@
+ALTER TABLE public.test_lock_probe_tbl ADD COLUMN IF NOT EXISTS fld_2 integer;
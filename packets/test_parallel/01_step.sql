@@ -0,0 +1,6 @@
+DROP TABLE IF EXISTS public.test_parallel;
+CREATE TABLE public.test_parallel
+(
+	id integer primary key,
+	pid integer
+);
@@ -0,0 +1,4 @@
+select
+	null as maint,	-- "maint" is system field
+	T.id			-- GEN_OBJ_FLD_1
+from generate_series(1, 12) as T(id);
@@ -0,0 +1,2 @@
+INSERT INTO public.test_parallel(id, pid)
+	SELECT GEN_OBJ_FLD_1, pg_backend_pid() FROM pg_sleep(0.2);
@@ -49,9 +49,11 @@ def prepare_dirs(current_dir, dirs=['log', 'download']):
 class SignalHandler(object):
     tornado_is_exists = False
 
-    def __init__(self):
+    def __init__(self, callback=None):
         self.sigterm = signal.SIGTERM
         self.sigint = signal.SIGINT
+        # called on each received signal, e.g. to wake up threads waiting for completion
+        self.callback = callback
 
     def __enter__(self):
         self.interrupted = False
@@ -60,8 +62,11 @@ class SignalHandler(object):
         self.handler_sigint = signal.getsignal(self.sigint)
 
         def handler(signum, frame):
-            self.release()
             self.interrupted = True
+            if self.callback is not None:
+                self.callback()
+            else:
+                self.release()
 
         signal.signal(self.sigterm, handler)
         signal.signal(self.sigint, handler)
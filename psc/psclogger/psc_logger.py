@@ -37,6 +37,7 @@ class PSCLogger(Thread):
         self.logger.setLevel(log_level)
         self.delay = delay
         self.log_level = log_level
+        self.stop_event = threading.Event()
         PSCLogger.__instance = self
         Thread.__init__(self)
         self.lock_logger.release()
@@ -61,18 +62,16 @@ class PSCLogger(Thread):
             self.stop()
 
     def run(self):
-        live_iteration = 0
         while not self.do_stop:
-            time.sleep(self.delay/50)
-            if live_iteration % 50 == 0 or self.do_stop:
-                self.flush_data()
-            live_iteration += 1
+            self.stop_event.wait(self.delay)
+            self.flush_data()
 
         if self.log_level == logging.DEBUG:
             print("PSCLogger stopped!")
 
     def stop(self):
         self.do_stop = True
+        self.stop_event.set()
         self.flush_data()
         self.lock_logger.acquire()
         self.logger.removeHandler(self.handler)
@@ -4,9 +4,11 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from db_converter import *
 import psc.postgresql as postgresql
-from actiontracker import ActionTracker
+from psc.postgresql.types import Row
+from actiontracker import ActionTracker, PacketTracker
 import pyzipper
 import difflib
+import sqlparse
 from unittest import mock
 from test_psc import *
 
@@ -58,7 +60,12 @@ class TestDBCPackets(unittest.TestCase, CommonVars):
                 'test_override_conf_param',
                 'test_placeholders',
                 'test_get_version',
-                'test_dba_idx_diag'
+                'test_dba_idx_diag',
+                'test_governor',
+                'test_chunks',
+                'test_parallel',
+                'test_lock_retry',
+                'test_lock_probe'
             ]
         ]
         packets.sort()
@@ -446,6 +453,22 @@ class TestDBCBlockerTxTimeout(unittest.TestCase, CommonVars):
         self.assertTrue(res_2.packet_status[self.test_dbc_01] == PacketStatus.DONE)
         self.assertTrue(res_2.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
 
+        # cancellation is stored with the blocked query and the action of the blocker
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        events = get_resultset(db_conn, """
+            SELECT e.relation, e.blocked_query, s.name, e.step_hash, e.wait_duration
+            FROM {0}.dbc_lock_events e
+            JOIN {0}.dbc_packets p ON p.id = e.packet_id
+            LEFT JOIN {0}.dbc_steps s ON s.id = e.step_id
+            WHERE p.name = '{1}' AND e.reason = 'blocker' AND e.cancelled
+        """.format(main.sys_conf.schema_location, self.packet_name))
+        db_conn.close()
+        self.assertTrue(len(events) == 1)
+        self.assertTrue(events[0][0] == 'public.test_blocker_tx_tbl')
+        self.assertTrue(events[0][1] == 'vacuum full public.test_blocker_tx_tbl')
+        self.assertTrue(events[0][2] == '02_step.sql' and events[0][3] is not None)
+        self.assertTrue(events[0][4] > 0)
+
 
 class TestDBCWaitTxTimeout(unittest.TestCase, CommonVars):
     packet_name = 'test_wait_tx'
@@ -537,6 +560,8 @@ class TestDBCInt4ToInt8(unittest.TestCase, CommonVars):
         main.append_thread('test_dbc_02_ext_th', emulate_workload(main.sys_conf.dbs_dict[self.test_dbc_02]))
 
         res = main.run()
+        # databases of one cluster are observed by one lock observer
+        self.assertTrue(main.lock_observers_cnt == 1)
 
         self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
         self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
@@ -841,6 +866,939 @@ class TestDBCAllSeq(unittest.TestCase, CommonVars):
         self.assertTrue(res.result_code[self.test_dbc_02] == ResultCode.SUCCESS)
 
 
+class TestDBCMaxParallel(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_max_parallel(self, mocked_requests_post):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + db_name,
+            '--max-parallel=2',
+        ])
+
+        main = MainRoutine(args, self.conf_file)
+        self.assertTrue(main.sys_conf.max_parallel == 2)
+        self.assertTrue(DBScheduler(main.dbs, main.sys_conf.max_parallel).slots_count == 2)
+        res = main.run()
+
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.packet_status[db] == PacketStatus.DONE)
+            self.assertTrue(res.result_code[db] == ResultCode.SUCCESS)
+
+
+class TestDBCClusterLimits(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_cluster_limits(self, mocked_requests_post):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + db_name,
+            '--conf={"max_parallel_per_cluster": "1", "max_conns_per_cluster": "2"}',
+        ])
+
+        main = MainRoutine(args, self.conf_file)
+        self.assertTrue(main.sys_conf.max_parallel_per_cluster == 1)
+        self.assertTrue(main.sys_conf.dbs_clusters[self.test_dbc_01] == '127.0.0.1:5432')
+        self.assertTrue(len(set(main.sys_conf.dbs_clusters[db] for db in main.dbs)) == 1)
+
+        scheduler = DBScheduler(main.dbs, 0, main.sys_conf.dbs_clusters, 1)
+        self.assertTrue(scheduler.next_db() is not None)
+        self.assertTrue(scheduler.pick_db() is None)    # the only cluster is busy
+
+        # the slot waiting for the busy cluster is woken up on termination
+        stopped = threading.Event()
+        slot = threading.Thread(target=lambda: scheduler.next_db(stopped.is_set))
+        slot.start()
+        stopped.set()
+        scheduler.wake_up()
+        slot.join(5)
+        self.assertFalse(slot.is_alive())
+
+        res = main.run()
+
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.packet_status[db] == PacketStatus.DONE)
+            self.assertTrue(res.result_code[db] == ResultCode.SUCCESS)
+
+
+class TestDBCGovernor(unittest.TestCase, CommonVars):
+    packet_name = 'test_governor'
+
+    def test_governor(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+
+        start_time = time.time()
+        res = main.run()
+        # canary latency is always over the threshold: delays 0.1 + 0.2 + 0.3 + 0.3 + 0.3 sec
+        self.assertTrue(time.time() - start_time >= 1.2)
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        governor = ActionGovernor({"max_canary_latency": 0.5, "max_delay": 1}, None, self.test_dbc_01, None)
+        governor.canary_latency, governor.active_sessions = 1, 0
+        governor.adjust()
+        governor.adjust()
+        self.assertTrue(governor.delay == 0.2)
+        governor.canary_latency = 0.01
+        governor.adjust()
+        self.assertTrue(governor.delay == 0.1)
+        governor.adjust()
+        self.assertTrue(governor.delay == 0)
+
+
+class TestDBCChunks(unittest.TestCase, CommonVars):
+    packet_name = 'test_chunks'
+
+    def test_chunks(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ])
+        main = MainRoutine(args, self.conf_file)
+        schema_location = main.sys_conf.schema_location
+        res = main.run()
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        self.assertTrue(get_scalar(db_conn, "SELECT count(1) FROM public.test_chunks WHERE not processed") == 0)
+        chunks_query = """
+            SELECT count(1) FROM %s.dbc_actions a
+            JOIN %s.dbc_packets p ON p.id = a.packet_id
+            WHERE p.name = '%s' AND a.chunk_end IS NOT NULL
+        """ % (schema_location, schema_location, self.packet_name)
+        self.assertTrue(get_scalar(db_conn, chunks_query) > 1)
+
+        # emulate interrupted deployment: the second half of the table is not processed
+        db_conn.execute("""
+            UPDATE public.test_chunks SET processed = false WHERE id > 25000;
+            DELETE FROM {0}.dbc_actions WHERE chunk_end > 25000;
+            UPDATE {0}.dbc_packets SET status = 'started' WHERE name = '{1}';
+            UPDATE public.test_chunks SET processed = false WHERE id = 1;   -- must not be processed again
+        """.format(schema_location, self.packet_name))
+        resumed_from = get_scalar(db_conn, chunks_query)
+
+        res = MainRoutine(args, self.conf_file).run()
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        self.assertTrue(
+            get_scalar(db_conn, "SELECT array_agg(id) FROM public.test_chunks WHERE not processed") == [1]
+        )
+        self.assertTrue(get_scalar(db_conn, chunks_query) > resumed_from)
+        db_conn.execute("DROP TABLE IF EXISTS public.test_chunks")
+        db_conn.close()
+
+
+class TestDBCParallelActions(unittest.TestCase, CommonVars):
+    packet_name = 'test_parallel'
+
+    def test_parallel_actions(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        schema_location = main.sys_conf.schema_location
+        res = main.run()
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        self.assertTrue(get_scalar(db_conn, "SELECT count(1) FROM public.test_parallel") == 12)
+        self.assertTrue(get_scalar(db_conn, "SELECT count(distinct pid) FROM public.test_parallel") > 1)
+        # each action is tracked once
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT count(1) FROM %s.dbc_actions a
+            JOIN %s.dbc_steps s ON s.id = a.step_id
+            JOIN %s.dbc_packets p ON p.id = a.packet_id
+            WHERE p.name = '%s' AND s.name = '02_step.sql'
+        """ % (schema_location, schema_location, schema_location, self.packet_name)) == 12)
+        # completed actions are preloaded by one query when the step resumes
+        tracker = PacketTracker(db_conn, schema_location, self.packet_name, None, None)
+        self.assertTrue(len(tracker.get_action_hashes('02_step.sql')) == 12)
+        self.assertTrue(len(tracker.statements) == 3)  # packet id, step id and hashes
+        db_conn.execute("DROP TABLE IF EXISTS public.test_parallel")
+        db_conn.close()
+
+
+class TestDBCTrackerSchema(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+    schema_location = 'dbc_test_tracker_schema'
+
+    def test_tracker_schema(self):
+        parser = DBCParams.get_arg_parser()
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        res = main.run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        db_conn.execute("DROP SCHEMA IF EXISTS %s CASCADE" % self.schema_location)
+        ActionTracker.cleanup(db_conn, self.schema_location)
+
+        ActionTracker.init_tbls(db_conn, self.schema_location)
+        self.assertTrue(
+            ActionTracker.get_schema_version(db_conn, self.schema_location) == ActionTracker.schema_version
+        )
+
+        # tracker tables of previous versions: history is kept, missing migrations are applied
+        db_conn.execute("""
+            INSERT INTO {0}.dbc_locks(name) VALUES ('{1}');
+            DROP TABLE {0}.dbc_schema_version;
+            ALTER TABLE {0}.dbc_actions DROP COLUMN chunk_end;
+        """.format(self.schema_location, self.packet_name))
+        ActionTracker.init_tbls(db_conn, self.schema_location)    # already verified by this process
+        self.assertTrue(ActionTracker.get_schema_version(db_conn, self.schema_location) == 0)
+
+        ActionTracker.verified_dbs.clear()
+        ActionTracker.init_tbls(db_conn, self.schema_location)
+        self.assertTrue(
+            ActionTracker.get_schema_version(db_conn, self.schema_location) == ActionTracker.schema_version
+        )
+        self.assertTrue(
+            ActionTracker.is_packet_locked(db_conn, self.schema_location, self.packet_name)
+        )
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT count(1) FROM information_schema.columns
+            WHERE table_schema = '%s' AND table_name = 'dbc_actions' AND column_name = 'chunk_end'
+        """ % self.schema_location) == 1)
+        # tables of packet are partitioned on PostgreSQL 11+ only
+        self.assertTrue(
+            ActionTracker.is_partitioned(db_conn, self.schema_location) ==
+            (get_scalar(db_conn, "SELECT current_setting('server_version_num')::integer") >= 110000)
+        )
+
+        ActionTracker.cleanup(db_conn, self.schema_location)
+        db_conn.execute("DROP SCHEMA IF EXISTS %s CASCADE" % self.schema_location)
+        db_conn.close()
+
+
+class TestDBCRetention(unittest.TestCase, CommonVars):
+    packet_name = 'test_parallel'
+
+    def test_retention(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        schema_location = main.sys_conf.schema_location
+        res = main.run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        packet_id = get_scalar(
+            db_conn, "SELECT id FROM %s.dbc_packets WHERE name = '%s'" % (schema_location, self.packet_name)
+        )
+        count_actions = "SELECT count(1) FROM %s.dbc_actions WHERE packet_id = %d" % (schema_location, packet_id)
+        # 12 actions of "02_step.sql" and one action of "01_step.sql"
+        self.assertTrue(get_scalar(db_conn, count_actions) == 13)
+
+        # finished packet is not older than one day: nothing to drop
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--retention=1'
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.NOTHING_TODO)
+
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--retention=0'
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        self.assertTrue(get_scalar(db_conn, count_actions) == 0)
+        if ActionTracker.is_partitioned(db_conn, schema_location):
+            partition = ActionTracker.get_partition(schema_location, packet_id)
+            self.assertTrue(get_scalar(db_conn, "SELECT to_regclass('%s') IS NULL" % partition))
+
+        # packet is still deployed
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file).run()
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.NOTHING_TODO)
+
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn.execute("DROP TABLE IF EXISTS public.test_parallel")
+        db_conn.close()
+
+
+class TestDBCActionStats(unittest.TestCase, CommonVars):
+    packet_name = 'test_parallel'
+
+    def test_action_stats(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        schema_location = main.sys_conf.schema_location
+        res = main.run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        # command tags of the action executed with "track_query" in one simple query
+        self.assertTrue(res.result_data[self.test_dbc_01]['02_step.sql'] == [('INSERT', 1)])
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        stats = get_resultset(db_conn, """
+            SELECT s.name, count(1), sum(a.row_count), min(a.duration), sum(a.retry_count)
+            FROM %s.dbc_action_stats a
+            JOIN %s.dbc_packets p ON p.id = a.packet_id
+            JOIN %s.dbc_steps s ON s.id = a.step_id
+            WHERE p.name = '%s'
+            GROUP BY s.name
+            ORDER BY s.name
+        """ % (schema_location, schema_location, schema_location, self.packet_name))
+        self.assertTrue(len(stats) == 2)
+        self.assertTrue(stats[1][0] == '02_step.sql')
+        self.assertTrue(stats[1][1] == 12)
+        self.assertTrue(stats[1][2] == 12)
+        self.assertTrue(stats[1][3] >= 0.2)
+        self.assertTrue(stats[1][4] == 0)
+
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--report'
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        report = res.result_data[self.test_dbc_01]
+        self.assertTrue(len(report) == 2)
+        self.assertTrue(report[1]["step"] == '02_step.sql')
+        self.assertTrue(report[1]["actions"] == 12)
+        self.assertTrue(report[1]["rows"] == 12)
+        # 3 threads, each action takes at least 0.2 sec
+        self.assertTrue(report[1]["actions_per_sec"] <= 15)
+        self.assertTrue(report[1]["p50"] <= report[1]["p99"] <= report[1]["max"])
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT count(1) FROM %s.dbc_action_stats
+            WHERE packet_id NOT IN (SELECT id FROM %s.dbc_packets)
+        """ % (schema_location, schema_location)) == 0)
+
+        db_conn.execute("DROP TABLE IF EXISTS public.test_parallel")
+        db_conn.close()
+
+
+class TestDBCProgress(unittest.TestCase, CommonVars):
+    packet_name = 'test_parallel'
+
+    def test_action_progress(self):
+        progress = ActionProgress(10, 2)
+        self.assertTrue(progress.percent() == 20.0)
+        self.assertTrue(progress.eta() is None)
+        progress.last_sample_time -= 1
+        progress.add(3)
+        self.assertTrue(progress.describe().startswith("50.0% (5 of 10 actions)"))
+        self.assertTrue(progress.rate > 0)
+        self.assertTrue(progress.eta() > 0)
+        self.assertTrue(format_eta(3725) == "1:02:05")
+
+    def test_progress_status(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        schema_location = main.sys_conf.schema_location
+        res = main.run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        # 12 generated actions of "02_step.sql" and one action of "01_step.sql"
+        progress = ActionTracker.get_progress(db_conn, schema_location, self.packet_name)
+        self.assertTrue(progress["total"] == 13)
+        self.assertTrue(progress["done"] == 13)
+        self.assertTrue(progress["percent"] == 100.0)
+        self.assertTrue(progress["eta"] == 0)
+        self.assertTrue(progress["actions_per_sec"] > 0)
+        self.assertTrue(ActionTracker.get_progress(db_conn, schema_location, 'test_100%_done') is None)
+
+        # progress of running packet is shown by "--status"
+        db_conn.execute(
+            "UPDATE %s.dbc_packets SET status = 'started' WHERE name = '%s'" % (schema_location, self.packet_name)
+        )
+        db_conn.execute("""
+            DELETE FROM {0}.dbc_actions
+            WHERE (step_id, step_hash) IN (
+                SELECT a.step_id, a.step_hash
+                FROM {0}.dbc_actions a
+                JOIN {0}.dbc_steps s ON s.id = a.step_id
+                JOIN {0}.dbc_packets p ON p.id = s.packet_id
+                WHERE p.name = '{1}' AND s.name = '02_step.sql'
+                LIMIT 3
+            )
+        """.format(schema_location, self.packet_name))
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--status'
+        ]), self.conf_file).run()
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.STARTED)
+        progress = res.result_data[self.test_dbc_01]
+        self.assertTrue(progress["done"] == 10)
+        self.assertTrue(progress["percent"] == round(1000 / 13, 2))
+        self.assertTrue(progress["eta"] > 0)
+
+        # resumed packet continues from the tracked actions
+        db_conn.execute("TRUNCATE public.test_parallel")
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        self.assertTrue(ActionTracker.get_progress(db_conn, schema_location, self.packet_name)["done"] == 13)
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+        db_conn.execute("DROP TABLE IF EXISTS public.test_parallel")
+        db_conn.close()
+
+
+class TestDBCLockObserverCheck(unittest.TestCase, CommonVars):
+
+    def test_advisory_lock_blocker(self):
+        sys_conf = SysConf(self.conf_file)
+        str_conn = sys_conf.dbs_dict[self.test_dbc_01]
+        blocker_conn = postgresql.open(str_conn)
+        waiting_conn = postgresql.open(str_conn)
+        observer_conn = postgresql.open(str_conn)
+        blocker_pid = get_scalar(blocker_conn, "SELECT pg_backend_pid()")
+        waiting_pid = get_scalar(waiting_conn, "SELECT pg_backend_pid()")
+
+        blocker_conn.execute("SELECT pg_advisory_lock(20181)")
+
+        @threaded
+        def wait_advisory_lock():
+            try:
+                waiting_conn.execute("BEGIN; SELECT pg_advisory_xact_lock(20181); COMMIT")
+            except postgresql.exceptions.QueryCanceledError:
+                pass
+
+        th = wait_advisory_lock()
+        observer = ClusterObserver('cluster', self.test_dbc_01, str_conn, 0.2, 1)
+        observer.prepare(observer_conn, "'0 seconds'", "'1 hour'")
+        for _ in range(50):
+            if get_scalar(observer_conn, "SELECT wait_event_type FROM pg_stat_activity WHERE pid = %d" % waiting_pid) \
+                    == 'Lock':
+                break
+            time.sleep(0.1)
+        time.sleep(0.1)
+
+        # advisory locks are not found by the join of pg_locks by relation or transaction
+        self.assertTrue(observer.check([blocker_pid, waiting_pid]) == [(blocker_pid, 'blocker')])
+        observer.prepare(observer_conn, "'1 hour'", "'0 seconds'")
+        self.assertTrue(observer.check([blocker_pid, waiting_pid]) == [(waiting_pid, 'wait')])
+
+        # lock wait resets the interval of observer to the min value
+        observer.interval = 1
+        self.assertTrue(observer.check([blocker_pid]) == [])
+        self.assertTrue(observer.contention)
+        self.assertTrue(observer.next_interval() == 0.2)
+
+        self.assertTrue(observer.check([blocker_pid, waiting_pid]) == [(waiting_pid, 'wait')])
+        observer.cancel([(waiting_pid, 'wait')])
+        th.join()
+        self.assertTrue(observer.check([blocker_pid, waiting_pid]) == [])
+        # no lock waits: back off up to the max value
+        self.assertTrue([observer.next_interval() for _ in range(4)] == [0.4, 0.8, 1, 1])
+
+        # the wait which is over and the cancelled wait are two events, the blocker event is over after the cancel
+        events = observer.pop_finished()
+        self.assertTrue(
+            sorted((e["reason"], e["cancelled"], e["blocked_pid"], e["blocking_pid"], e["relation"]) for e in events) ==
+            [
+                ('blocker', False, waiting_pid, blocker_pid, 'advisory'),
+                ('wait', False, waiting_pid, blocker_pid, 'advisory'),
+                ('wait', True, waiting_pid, blocker_pid, 'advisory')
+            ]
+        )
+        self.assertTrue(observer.pop_finished() == [] and observer.events == {})
+
+        blocker_conn.close()
+        waiting_conn.close()
+        observer_conn.close()
+
+
+class TestDBCLockRetry(unittest.TestCase, CommonVars):
+    packet_name = 'test_lock_retry'
+
+    def test_lock_retry(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+        schema_location = main.sys_conf.schema_location
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        db_conn.execute("""
+            DROP TABLE IF EXISTS public.test_lock_retry_tbl;
+            CREATE TABLE public.test_lock_retry_tbl(fld_1 integer);
+        """)
+        th_db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        th_db_conn.execute("BEGIN; LOCK TABLE public.test_lock_retry_tbl IN ACCESS SHARE MODE")
+
+        @threaded
+        def release_lock():
+            time.sleep(2)
+            th_db_conn.execute("COMMIT")
+            th_db_conn.close()
+
+        main.append_thread(self.test_dbc_01 + '_ext', release_lock())
+        res = main.run()
+
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        # ALTER TABLE is retried on the same session instead of waiting in the lock queue
+        self.assertTrue(main.lock_observer_wait_cnt == 0)
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT a.retry_count
+            FROM %s.dbc_action_stats a
+            JOIN %s.dbc_packets p ON p.id = a.packet_id
+            WHERE p.name = '%s'
+        """ % (schema_location, schema_location, self.packet_name)) > 0)
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT count(1) FROM information_schema.columns
+            WHERE table_name = 'test_lock_retry_tbl' AND column_name = 'fld_2'
+        """) == 1)
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+        db_conn.execute("DROP TABLE IF EXISTS public.test_lock_retry_tbl")
+        db_conn.close()
+
+
+class TestDBCLockProbe(unittest.TestCase, CommonVars):
+    packet_name = 'test_lock_probe'
+
+    def test_statement_locks(self):
+        self.assertTrue(get_query_locks("""
+            -- comment
+            ALTER TABLE public.t ADD COLUMN fld_2 integer;
+            ALTER TABLE ONLY t VALIDATE CONSTRAINT c, ALTER COLUMN fld_1 SET STATISTICS 1000;
+            CREATE INDEX CONCURRENTLY i ON public.t USING btree (fld_1);
+            CREATE UNIQUE INDEX i ON t (fld_1);
+            TRUNCATE TABLE t, "S"."T";
+            LOCK TABLE t IN SHARE ROW EXCLUSIVE MODE;
+            VACUUM (FULL, ANALYZE) t;
+            VACUUM ANALYZE t;
+            INSERT INTO t VALUES (1);
+        """) == [
+            ('public.t', 'AccessExclusiveLock'),
+            ('t', 'ShareUpdateExclusiveLock'),
+            ('public.t', 'ShareUpdateExclusiveLock'),
+            ('t', 'ShareLock'),
+            ('t', 'AccessExclusiveLock'),
+            ('"S"."T"', 'AccessExclusiveLock'),
+            ('t', 'ShareRowExclusiveLock'),
+            ('t', 'AccessExclusiveLock'),
+            ('t', 'ShareUpdateExclusiveLock')
+        ])
+
+    def test_lock_probe(self):
+        parser = DBCParams.get_arg_parser()
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ]), self.conf_file)
+
+        db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        db_conn.execute("""
+            DROP TABLE IF EXISTS public.test_lock_probe_tbl;
+            CREATE TABLE public.test_lock_probe_tbl(fld_1 integer);
+        """)
+        th_db_conn = postgresql.open(main.sys_conf.dbs_dict[self.test_dbc_01])
+        th_db_conn.execute("BEGIN; LOCK TABLE public.test_lock_probe_tbl IN ACCESS SHARE MODE")
+
+        @threaded
+        def release_lock():
+            time.sleep(2)
+            th_db_conn.execute("COMMIT")
+            th_db_conn.close()
+
+        main.append_thread(self.test_dbc_01 + '_ext', release_lock())
+        res = main.run()
+
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        # ALTER TABLE is executed after the lock is released instead of waiting in the lock queue
+        self.assertTrue(main.lock_probe_wait_cnt == 1)
+        self.assertTrue(main.lock_observer_wait_cnt == 0)
+        self.assertTrue(len([e for e in main.lock_events_history if e["reason"] == 'wait']) == 0)
+        self.assertTrue(get_scalar(db_conn, """
+            SELECT count(1) FROM information_schema.columns
+            WHERE table_name = 'test_lock_probe_tbl' AND column_name = 'fld_2'
+        """) == 1)
+
+        MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+        db_conn.execute("DROP TABLE IF EXISTS public.test_lock_probe_tbl")
+        db_conn.close()
+
+
+class TestDBCLockImpact(unittest.TestCase, CommonVars):
+    packet_name = 'test_int4_to_int8'
+
+    def test_statement_impact(self):
+        def impact(stm):
+            res = get_statement_impact(stm, SysConf.non_tx_ops)
+            return res["lock_mode"], res["rewrite"], res["non_tx"], res["impact"]
+
+        self.assertTrue(impact("ALTER TABLE t ALTER COLUMN fld_1 TYPE bigint") ==
+                        ('AccessExclusiveLock', 'rewrite', False, 'high'))
+        self.assertTrue(impact("ALTER TABLE t ADD COLUMN fld_2 integer DEFAULT 0") ==
+                        ('AccessExclusiveLock', '', False, 'medium'))
+        self.assertTrue(impact("ALTER TABLE t ADD CONSTRAINT c CHECK (fld_1 > 0) NOT VALID") ==
+                        ('AccessExclusiveLock', '', False, 'medium'))
+        self.assertTrue(impact("ALTER TABLE t VALIDATE CONSTRAINT c") ==
+                        ('ShareUpdateExclusiveLock', 'scan', False, 'medium'))
+        self.assertTrue(impact("CREATE INDEX i ON t (fld_1)") == ('ShareLock', 'scan', False, 'high'))
+        self.assertTrue(impact("VACUUM FULL t") == ('AccessExclusiveLock', 'rewrite', True, 'high'))
+        self.assertTrue(impact("UPDATE t SET fld_1 = 1") == ('RowExclusiveLock', '', False, 'low'))
+        self.assertTrue(impact("DROP VIEW v") == ('unknown', '', False, 'unknown'))
+
+        # the constant DEFAULT of the new column rewrites the table before PostgreSQL 11
+        stm = "ALTER TABLE t ADD COLUMN fld_2 integer DEFAULT 0"
+        self.assertTrue(get_statement_impact(stm, SysConf.non_tx_ops, 100012)["impact"] == 'high')
+        self.assertTrue(get_statement_impact(stm, SysConf.non_tx_ops, 110000)["rewrite"] == '')
+        stm = "ALTER TABLE t ADD COLUMN fld_2 integer DEFAULT NULL"
+        self.assertTrue(get_statement_impact(stm, SysConf.non_tx_ops, 90605)["rewrite"] == '')
+
+    def test_analyze(self):
+        parser = DBCParams.get_arg_parser()
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--analyze'
+        ]), self.conf_file)
+        res = main.run()
+
+        self.assertTrue(res.command_type == CommandType.ANALYZE)
+        self.assertTrue(len(res.result_code) == 0)
+        impacts = {}
+        for impact in res.result_data[self.packet_name]:
+            impacts.setdefault(impact["step"], []).append(impact)
+        self.assertTrue(sorted(impacts.keys()) == [
+            '01_step.sql', '02_step.sql', '03_step.sql', '04_step.sql', '05_step.sql', '06_step.sql', '07_step.sql',
+            'run_once.sql'
+        ])
+        # ALTER TABLE inside of DO block
+        self.assertTrue(impacts['01_step.sql'][0]["lock_mode"] == 'AccessExclusiveLock')
+        self.assertTrue(impacts['01_step.sql'][0]["relations"] == ['public.test_tbl'])
+        self.assertTrue(impacts['02_step.sql'][0]["impact"] == 'low')
+        self.assertTrue(impacts['05_step.sql'][0]["non_tx"])
+        self.assertTrue(impacts['05_step.sql'][0]["lock_mode"] == 'ShareUpdateExclusiveLock')
+        self.assertTrue(len(impacts['06_step.sql']) == 9)
+
+
+class TestDBCStepTemplate(unittest.TestCase, CommonVars):
+    def test_query_template(self):
+        gen_obj_i = {'maint': None}
+        gen_obj_i.update({'fld_%d' % fld_id: 'val_%d' % fld_id for fld_id in range(1, 11)})
+        template = QueryTemplate(
+            "SELECT GEN_OBJ_FLD_1, GEN_OBJ_FLD_10, GEN_OBJ_FLD_11, GEN_NSP_FLD_1, DBC_PL_tbl_name FROM DBC_PL_tbl",
+            {"tbl": "public.GEN_OBJ_FLD_2", "tbl_name": "'tbl'"}
+        )
+        self.assertTrue(
+            template.render(gen_obj_i=gen_obj_i) ==
+            "SELECT val_1, val_10, GEN_OBJ_FLD_11, GEN_NSP_FLD_1, 'tbl' FROM public.val_2"
+        )
+        self.assertTrue(QueryTemplate("GEN_OBJ_FLD_10GEN_OBJ_FLD_1").render(gen_obj_i=gen_obj_i) == "val_10val_1")
+        self.assertTrue(QueryTemplate("GEN_OBJ_FLD_01").render(gen_obj_i=gen_obj_i) == "GEN_OBJ_FLD_01")
+
+        # columns with the same name are one field of generator, as "dict(gen_i)" before
+        gen_obj_i = Row.from_sequence({'maint': 0, 'fld': 2}, [None, 'val_1', 'val_2'])
+        self.assertTrue(
+            QueryTemplate("GEN_OBJ_FLD_1 GEN_OBJ_FLD_2").render(gen_obj_i=gen_obj_i) == "val_2 GEN_OBJ_FLD_2"
+        )
+
+    def test_render(self):
+        query = """
+            -- statement with GEN_OBJ_FLD_1 in comment
+            UPDATE GEN_NSP_FLD_1.GEN_OBJ_FLD_1 SET fld = 1;
+            SELECT count(1) FROM GEN_NSP_FLD_1.GEN_OBJ_FLD_1;
+        """
+        gen_nsp_i = {'maint': None, 'nspname': 'public'}
+        gen_obj_i = {'maint': None, 'relname': 'test_tbl'}
+        template = StepTemplate(query, False, DBCCore.is_rows_query)
+        action = template.render(gen_nsp_i, gen_obj_i)
+        expected = query.replace('GEN_NSP_FLD_1', 'public').replace('GEN_OBJ_FLD_1', 'test_tbl')
+
+        self.assertTrue(isinstance(action, ActionQuery))
+        # hash of action is the same as the hash of substituted step
+        self.assertTrue(str(action) == expected)
+        self.assertTrue(action.stms == sqlparse.split(expected))
+        self.assertTrue(action.returns_rows)
+        self.assertFalse(action.non_tx)
+
+        template = StepTemplate("VACUUM GEN_OBJ_FLD_1", True, DBCCore.is_rows_query)
+        action = template.render(gen_obj_i=gen_obj_i)
+        self.assertTrue(action.text == "VACUUM test_tbl")
+        self.assertTrue(action.stms == [])
+        self.assertTrue(action.non_tx)
+
+        # the value is SQL, so the action is split and classified by "execute_q"
+        template = StepTemplate("GEN_OBJ_FLD_1", False, DBCCore.is_rows_query)
+        action = template.render(gen_obj_i={'maint': None, 'query': 'CREATE DATABASE test_db'})
+        self.assertTrue(action == "CREATE DATABASE test_db")
+
+        # the value is keyword of "non_tx_ops", the rendered SQL is classified by "execute_q"
+        template = StepTemplate("GEN_OBJ_FLD_1 public.test_tbl", False, DBCCore.is_rows_query, SysConf.non_tx_ops)
+        self.assertTrue(template.render(gen_obj_i={'maint': None, 'cmd': 'VACUUM'}) == "VACUUM public.test_tbl")
+        self.assertTrue(isinstance(template.render(gen_obj_i={'maint': None, 'cmd': 'ANALYZE'}), ActionQuery))
+
+
+class TestDBCWorkersProcess(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_workers_process(self, mocked_requests_post):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + db_name,
+            '--workers=process',
+        ])
+
+        res = MainRoutine(args, self.conf_file).run()
+
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.packet_status[db] == PacketStatus.DONE)
+            self.assertTrue(res.result_code[db] == ResultCode.SUCCESS)
+            self.assertTrue(res.workers_result[db] == WorkerResult.SUCCESS)
+            self.assertTrue(res.result_data[db]['01_step.sql'][0][0][0].startswith('PostgreSQL'))
+
+    def test_shard_died(self):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + db_name,
+            '--workers=process',
+        ])
+
+        with mock.patch('db_converter.run_shard', new=exit_shard):
+            res = MainRoutine(args, self.conf_file).run()
+
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.result_code[db] == ResultCode.FAIL)
+
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_cluster_limits(self, mocked_requests_post):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=test_sleep',
+            '--db-name=' + db_name,
+            '--workers=process',
+            '--conf={"max_parallel_per_cluster": "1"}',
+        ])
+
+        main = MainRoutine(args, self.conf_file)
+        self.assertTrue(main.get_shards(10) == [main.dbs])    # the only cluster is not split
+
+        start_time = time.time()
+        res = main.run()
+        # one database of the cluster at a time: pg_sleep(5) in each of 3 databases
+        self.assertTrue(time.time() - start_time >= 15)
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.result_code[db] == ResultCode.SUCCESS)
+
+
+# shard process which dies without result, see TestDBCWorkersProcess
+def exit_shard(*args):
+    os._exit(1)
+
+
+class TestDBCPreflight(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_preflight(self, mocked_requests_post):
+        db_name = 'ALL,exclude:%s' % self.pg_db
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + db_name,
+            '--conf={"preflight_parallel": "2"}',
+        ])
+
+        main = MainRoutine(args, self.conf_file)
+        self.assertTrue(main.sys_conf.preflight_parallel == 2)
+        res = main.run()
+
+        for db in (self.test_dbc_01, self.test_dbc_02, self.test_dbc_packets):
+            self.assertTrue(res.packet_status[db] == PacketStatus.DONE)
+            self.assertTrue(res.result_code[db] == ResultCode.SUCCESS)
+            self.assertTrue(res.preflight_latency[db] is not None and res.preflight_latency[db] >= 0)
+
+
+class TestDBCConnManager(unittest.TestCase, CommonVars):
+    packet_name = 'test_get_version'
+
+    @mock.patch('matterhook.incoming.requests.post', side_effect=mocked_requests_post)
+    def test_conn_manager(self, mocked_requests_post):
+        parser = DBCParams.get_arg_parser()
+
+        args = parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+        ])
+
+        main = MainRoutine(args, self.conf_file)
+        res = main.run()
+
+        self.assertTrue(res.packet_status[self.test_dbc_01] == PacketStatus.DONE)
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+        # preflight session is reused by worker or lock observer, and then by final unlock
+        self.assertTrue(main.conn_manager.opened_cnt == 2)
+        self.assertTrue(main.conn_manager.reused_cnt == 2)
+        self.assertTrue(len(main.conn_manager.idle) == 0)
+
+    def test_acquire_limits(self):
+        parser = DBCParams.get_arg_parser()
+        main = MainRoutine(parser.parse_args([
+            '--packet-name=' + self.packet_name,
+            '--db-name=' + self.test_dbc_01,
+            '--list'
+        ]), self.conf_file)
+        str_conn = main.sys_conf.dbs_dict[self.test_dbc_01]
+        is_stopped = [False]
+        conn_manager = DBConnManager(2, acquire_timeout=0.5, is_stopped=lambda: is_stopped[0])
+        conns = [conn_manager.acquire(self.test_dbc_01, str_conn) for _ in range(2)]
+        self.assertTrue(conn_manager.free_conns(self.test_dbc_01) == 0)
+        with self.assertRaises(Exception):
+            conn_manager.acquire(self.test_dbc_01, str_conn, blocking=False)
+        start_time = time.time()
+        with self.assertRaises(Exception):
+            conn_manager.acquire(self.test_dbc_01, str_conn)
+        self.assertTrue(time.time() - start_time >= 0.5)
+        is_stopped[0] = True
+        conn_manager.acquire_timeout = 0
+        with self.assertRaises(Exception):
+            conn_manager.acquire(self.test_dbc_01, str_conn)
+        for conn in conns:
+            conn_manager.release(self.test_dbc_01, conn)
+        self.assertTrue(conn_manager.free_conns(self.test_dbc_01) == 2)
+        conn_manager.close_all()
+
+    def test_parallelism_limit(self):
+        parser = DBCParams.get_arg_parser()
+        MainRoutine(parser.parse_args([
+            '--packet-name=test_parallel',
+            '--db-name=' + self.test_dbc_01,
+            '--wipe'
+        ]), self.conf_file).run()
+
+        # sessions of worker and lock observer take the limit, actions are executed by one connection
+        res = MainRoutine(parser.parse_args([
+            '--packet-name=test_parallel',
+            '--db-name=' + self.test_dbc_01,
+            '--conf={"max_conns_per_db": "2", "conn_acquire_timeout": "30"}'
+        ]), self.conf_file).run()
+        self.assertTrue(res.result_code[self.test_dbc_01] == ResultCode.SUCCESS)
+
+
 class DBCPacketUnitTest(unittest.TestCase, CommonVars):
     test_packet_names = []
 